@@ -0,0 +1,181 @@
+"""
+Бенчмарк приёма обновлений: long polling (как было) против webhook с очередью и обработчиками (utils/webhook.py).
+
+Заглушка Max API отдаёт /me, /chats/{id} (с задержкой api-ms, её вызывает maxapi при разборе каждого обновления)
+и /updates (long polling). Генератор создаёт обновления с заданной частотой по случайным чатам; в режиме polling
+они копятся в /updates, в режиме webhook отправляются POST-запросами на сервер приёма. Обработчик «работает»
+handler-ms и замеряет задержку от timestamp обновления до своего начала.
+
+Запуск: python -m benchmarks.bench_ingest [--updates 1000] [--rps 50] [--chats 200] [--handler-ms 5] [--api-ms 10]
+"""
+import time
+import random
+import asyncio
+import argparse
+import logging
+
+from aiohttp import ClientSession, web
+from maxapi import Bot, Dispatcher, Router
+from maxapi.types import MessageCreated
+
+from utils.latency import LatencyWindow
+from utils.webhook import WebhookIngest, prepare_dispatcher
+
+PORT = 18181
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Задержка update→handler: polling против webhook")
+    parser.add_argument("--updates", type=int, default=1000)
+    parser.add_argument("--rps", type=float, default=50)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--handler-ms", type=float, default=5)
+    parser.add_argument("--api-ms", type=float, default=10)
+    parser.add_argument("--workers", type=int, default=8)
+    return parser.parse_args()
+
+
+def make_update(chat_id: int, seq: int) -> dict:
+    now = int(time.time() * 1000)
+    return {
+        "update_type": "message_created",
+        "timestamp": now,
+        "message": {
+            "sender": {"user_id": chat_id, "first_name": "bench", "is_bot": False, "last_activity_time": now},
+            "recipient": {"chat_id": chat_id, "chat_type": "dialog"},
+            "timestamp": now,
+            "body": {"mid": f"mid.{seq}", "seq": seq, "text": "/today"},
+        },
+    }
+
+
+def build_stub(args, pending: list, arrived: asyncio.Event) -> web.Application:
+    app = web.Application()
+
+    async def me(request):
+        return web.json_response({"user_id": 1, "first_name": "bench", "is_bot": True, "last_activity_time": 0})
+
+    async def chat(request):
+        await asyncio.sleep(args.api_ms / 1000)
+        return web.json_response({
+            "chat_id": int(request.match_info["chat_id"]), "type": "dialog", "status": "active",
+            "last_event_time": 0, "participants_count": 2, "is_public": False,
+        })
+
+    async def updates(request):
+        if not pending:
+            arrived.clear()
+            try:
+                await asyncio.wait_for(arrived.wait(), 1)
+            except asyncio.TimeoutError:
+                pass
+        batch = pending[:100]
+        del pending[:100]
+        return web.json_response({"updates": batch, "marker": None})
+
+    app.router.add_get("/me", me)
+    app.router.add_get("/chats/{chat_id}", chat)
+    app.router.add_get("/updates", updates)
+    return app
+
+
+def build_dispatcher(args, window: LatencyWindow, done: asyncio.Event, total: int) -> Dispatcher:
+    dp = Dispatcher()
+    router = Router()
+
+    @router.message_created()
+    async def handler(event: MessageCreated):
+        window.observe(time.time() - event.timestamp / 1000)
+        await asyncio.sleep(args.handler_ms / 1000)
+        if window.count == total:
+            done.set()
+
+    dp.include_routers(router)
+    return dp
+
+
+async def produce(args, deliver):
+    rnd = random.Random(7)
+    started = time.monotonic()
+    for seq in range(args.updates):
+        await asyncio.sleep(max(started + seq / args.rps - time.monotonic(), 0))
+        await deliver(make_update(rnd.randrange(args.chats), seq))
+
+
+async def run_polling(args, pending: list, arrived: asyncio.Event) -> LatencyWindow:
+    window, done = LatencyWindow("polling"), asyncio.Event()
+    dp = build_dispatcher(args, window, done, args.updates)
+    bot = Bot("bench", auto_check_subscriptions=False)
+    bot.set_api_url(f"http://127.0.0.1:{PORT}")
+
+    async def deliver(update):
+        pending.append(update)
+        arrived.set()
+
+    polling = asyncio.create_task(dp.start_polling(bot))
+    await produce(args, deliver)
+    await done.wait()
+    dp.polling = False
+    polling.cancel()
+    await asyncio.gather(polling, return_exceptions=True)
+    await bot.close_session()
+    return window
+
+
+async def run_webhook(args) -> tuple[LatencyWindow, WebhookIngest]:
+    window, done = LatencyWindow("webhook"), asyncio.Event()
+    dp = build_dispatcher(args, window, done, args.updates)
+    bot = Bot("bench")
+    bot.set_api_url(f"http://127.0.0.1:{PORT}")
+    await prepare_dispatcher(dp, bot)
+
+    ingest = WebhookIngest(dp, bot, workers=args.workers, secret="bench-secret")
+    runner = web.AppRunner(ingest.build_app())
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT + 1).start()
+    ingest.start_workers()
+
+    async with ClientSession() as session:
+        url = f"http://127.0.0.1:{PORT + 1}{ingest.path}"
+        posts = set()
+
+        async def post(update):
+            async with session.post(url, json=update, headers={"X-Max-Bot-Api-Secret": "bench-secret"}) as r:
+                assert r.status == 200, r.status
+
+        async def deliver(update):
+            task = asyncio.create_task(post(update))
+            posts.add(task)
+            task.add_done_callback(posts.discard)
+
+        await produce(args, deliver)
+        await done.wait()
+
+    await ingest.stop_workers()
+    await runner.cleanup()
+    await bot.close_session()
+    return window, ingest
+
+
+async def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    pending, arrived = [], asyncio.Event()
+    runner = web.AppRunner(build_stub(args, pending, arrived))
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+
+    print(f"Обновлений: {args.updates}, {args.rps:g}/с по {args.chats} чатам, "
+          f"обработчик {args.handler_ms:g} мс, запрос чата {args.api_ms:g} мс\n")
+    try:
+        polling = await run_polling(args, pending, arrived)
+        print(polling.describe())
+        webhook, ingest = await run_webhook(args)
+        print(webhook.describe() + f"  [{args.workers} обработчиков]")
+        print(ingest.queue_latency.describe())
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,150 @@
+"""
+Бенчмарк хранения расписания: строки снапшота на каждую дату против повторяющихся занятий recurrence_store.
+
+Строит синтетический SQLite-снапшот (группы по 18 пар в неделю на 16 недель, часть пар по чётным/нечётным неделям)
+и сравнивает память на расписания всех групп и время ответа на запрос недели. Затем сверяет тексты
+расписаний групп и преподавателей по неделям: тексты должны совпадать точно, вместе с порядком
+участников занятия (преподавателей, групп, аудиторий); совпадение с точностью до порядка участников
+выводится отдельно.
+
+Запуск: python -m benchmarks.bench_recurrence [количество групп]
+"""
+import os
+import sys
+import time
+import random
+import sqlite3
+import tempfile
+from datetime import date, datetime, timedelta
+
+from benchmarks.bench_update_records import measure
+from db.db_operations import get_lessons, merge_duplicate_lessons, render_schedule
+from db.recurrence_store import SCHEDULE_TZ, timetable_from_snapshot
+
+SEMESTER = date(2025, 9, 1)
+WEEKS = 16
+SLOTS = [540, 630, 730, 820, 910, 1000]
+
+
+def build_snapshot(path: str, groups: int):
+    rnd = random.Random(1)
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE discipline (id INTEGER PRIMARY KEY, title TEXT);
+        CREATE TABLE lesson_type (id INTEGER PRIMARY KEY, title TEXT);
+        CREATE TABLE lesson (id INTEGER PRIMARY KEY, start INTEGER, end INTEGER, discipline_id INTEGER,
+                             lesson_type_id INTEGER);
+        CREATE TABLE teacher (id INTEGER PRIMARY KEY, name TEXT);
+        CREATE TABLE academic_group (id INTEGER PRIMARY KEY, title TEXT);
+        CREATE TABLE place (id INTEGER PRIMARY KEY, title TEXT, campus TEXT);
+        CREATE TABLE lesson_teacher (lesson_id INTEGER, teacher_id INTEGER);
+        CREATE TABLE lesson_academic_group (lesson_id INTEGER, academic_group_id INTEGER);
+        CREATE TABLE lesson_place (lesson_id INTEGER, place_id INTEGER);
+        CREATE INDEX lesson_teacher_lesson ON lesson_teacher (lesson_id);
+        CREATE INDEX lesson_teacher_teacher ON lesson_teacher (teacher_id);
+        CREATE INDEX lesson_group_lesson ON lesson_academic_group (lesson_id);
+        CREATE INDEX lesson_group_group ON lesson_academic_group (academic_group_id);
+        CREATE INDEX lesson_place_lesson ON lesson_place (lesson_id);
+        CREATE INDEX lesson_place_place ON lesson_place (place_id);
+        CREATE INDEX lesson_start ON lesson (start);
+    """)
+    conn.executemany("INSERT INTO discipline VALUES (?, ?)", [(i, f"Дисциплина {i}") for i in range(500)])
+    conn.executemany("INSERT INTO lesson_type VALUES (?, ?)", [(1, "ЛК"), (2, "ПР"), (3, "ЛАБ")])
+    conn.executemany("INSERT INTO teacher VALUES (?, ?)", [(i, f"Преподаватель {i}") for i in range(groups)])
+    conn.executemany("INSERT INTO academic_group VALUES (?, ?)", [(i, f"ИКБО-{i:02d}-24") for i in range(groups)])
+    conn.executemany("INSERT INTO place VALUES (?, ?, ?)", [(i, f"А-{i}", "В-78") for i in range(groups)])
+
+    lessons, teachers, group_links, places = [], [], [], []
+    for group in range(groups):
+        for _ in range(18):
+            weekday, slot = rnd.randrange(6), rnd.choice(SLOTS)
+            discipline, lesson_type = rnd.randrange(500), rnd.randint(1, 3)
+            parity = rnd.choice([None, 0, 1])
+            teacher, place = rnd.randrange(groups), rnd.randrange(groups)
+            stream = [group] + rnd.sample(range(groups), 2)
+            for week in range(WEEKS):
+                if parity is not None and week % 2 != parity:
+                    continue
+                day = SEMESTER + timedelta(weeks=week, days=weekday)
+                start = int((datetime(day.year, day.month, day.day, tzinfo=SCHEDULE_TZ)
+                             + timedelta(minutes=slot)).timestamp())
+                lesson_id = len(lessons)
+                lessons.append((lesson_id, start, start + 5400, discipline, lesson_type))
+                teachers.append((lesson_id, teacher))
+                group_links.extend((lesson_id, g) for g in set(stream))
+                places.append((lesson_id, place))
+
+    conn.executemany("INSERT INTO lesson VALUES (?, ?, ?, ?, ?)", lessons)
+    conn.executemany("INSERT INTO lesson_teacher VALUES (?, ?)", teachers)
+    conn.executemany("INSERT INTO lesson_academic_group VALUES (?, ?)", group_links)
+    conn.executemany("INSERT INTO lesson_place VALUES (?, ?)", places)
+    conn.commit()
+    conn.close()
+    return len(lessons)
+
+
+def _day_ts(day: date, end_of_day: bool = False) -> int:
+    moment = datetime.combine(day, datetime.max.time() if end_of_day else datetime.min.time(), tzinfo=SCHEDULE_TZ)
+    return int(moment.timestamp())
+
+
+def _normalized(lessons: list) -> list:
+    """Занятия недели без учёта порядка участников"""
+    return sorted(
+        (lesson["start"], lesson["end"], lesson["discipline"], lesson["lesson_type"],
+         tuple(sorted(lesson["teachers"])), tuple(sorted(lesson["groups"])), tuple(sorted(lesson["places"])))
+        for lesson in merge_duplicate_lessons(lessons)
+    )
+
+
+def compare_outputs(path: str, groups: int, entities: int = 50, week_step: int = 3):
+    """Сверяет расписания недель из get_lessons и EntityTimetable.expand для групп и преподавателей"""
+    pairs = exact = unordered = 0
+    for sub_type, field in (("group", "group_id"), ("teacher", "teacher_id")):
+        for entity_id in range(min(entities, groups)):
+            timetable = timetable_from_snapshot(path, sub_type, entity_id, SEMESTER)
+            for week in range(0, WEEKS, week_step):
+                week_start = SEMESTER + timedelta(weeks=week)
+                week_end = week_start + timedelta(days=6)
+                expected = get_lessons(path, **{field: entity_id}, start_ts=_day_ts(week_start),
+                                       end_ts=_day_ts(week_end, True))
+                actual = timetable.expand(week_start, week_end) if timetable else []
+                pairs += 1
+                exact += (render_schedule(expected, "Расписание", sub_type)
+                          == render_schedule(actual, "Расписание", sub_type))
+                unordered += _normalized(expected) == _normalized(actual)
+    print(f"Пар сущность/неделя: {pairs}, текст совпадает: {exact}, "
+          f"совпадает с точностью до порядка участников: {unordered}")
+    return pairs, exact, unordered
+
+
+def main():
+    groups = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "schedule.db")
+        rows = build_snapshot(path, groups)
+        print(f"Групп: {groups}, строк lesson: {rows}\n")
+
+        measure("Строки снапшота: все группы", lambda: [get_lessons(path, group_id=g) for g in range(groups)])
+        timetables = measure("Повторяющиеся занятия: все группы",
+                             lambda: [timetable_from_snapshot(path, "group", g, SEMESTER) for g in range(groups)])
+        print(f"Повторяющихся занятий: {sum(len(t.lessons) for t in timetables)}\n")
+
+        week_start = SEMESTER + timedelta(weeks=5)
+        week_end = week_start + timedelta(days=6)
+        for title, query in (
+            ("get_lessons, неделя", lambda g: get_lessons(path, group_id=g, start_ts=_day_ts(week_start),
+                                                         end_ts=_day_ts(week_end, True))),
+            ("EntityTimetable.expand, неделя", lambda g: timetables[g].expand(week_start, week_end)),
+        ):
+            started = time.perf_counter()
+            for group in range(groups):
+                query(group)
+            print(f"{title:<40} {(time.perf_counter() - started) / groups * 1000:>10.3f} мс на запрос")
+
+        print()
+        compare_outputs(path, groups)
+
+
+if __name__ == "__main__":
+    main()
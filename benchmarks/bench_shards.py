@@ -0,0 +1,97 @@
+"""
+Бенчмарк масштабирования по процессам-обработчикам (utils/sharding.py): пропускная способность
+при CPU-нагруженном обработчике для 1, 2, 4… процессов.
+
+Обработчик занимает процессор на cpu-ms (как разбор и отрисовка большого расписания). Основной процесс
+раздаёт обновления по chat_id так же, как в боевом режиме, и ждёт, пока все процессы разберут свои очереди.
+Рост близок к линейному, пока процессов не больше, чем ядер.
+
+Запуск: python -m benchmarks.bench_shards [--updates 2000] [--cpu-ms 2] [--shards 1 2 4]
+"""
+import os
+import time
+import random
+import asyncio
+import argparse
+import logging
+import functools
+import multiprocessing
+
+from aiohttp import web
+from maxapi import Bot, Dispatcher, Router
+from maxapi.types import MessageCreated
+
+from benchmarks.bench_ingest import make_update
+from utils.sharding import ShardRouter, serve_shard
+
+PORT = 18191
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Пропускная способность по числу процессов-обработчиков")
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--chats", type=int, default=500)
+    parser.add_argument("--cpu-ms", type=float, default=2)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    return parser.parse_args()
+
+
+def bench_worker(cpu_ms: float, ready, index: int, shard_queue):
+    logging.basicConfig(level=logging.WARNING)
+    dp, router = Dispatcher(), Router()
+
+    @router.message_created()
+    async def handler(event: MessageCreated):
+        until = time.perf_counter() + cpu_ms / 1000
+        while time.perf_counter() < until:
+            pass
+
+    dp.include_routers(router)
+    bot = Bot("bench", auto_requests=False)
+    bot.set_api_url(f"http://127.0.0.1:{PORT}")
+    ready.put(index)
+    asyncio.run(serve_shard(dp, bot, shard_queue))
+
+
+async def measure(args, shards: int) -> float:
+    ready = multiprocessing.get_context("spawn").Queue()
+    router = ShardRouter(shards, functools.partial(bench_worker, args.cpu_ms, ready), queue_size=args.updates)
+    router.start()
+    for _ in range(shards):
+        await asyncio.to_thread(ready.get)
+
+    rnd = random.Random(5)
+    updates = [make_update(rnd.randrange(args.chats), seq) for seq in range(args.updates)]
+    started = time.perf_counter()
+    for update in updates:
+        await router.forward(update)
+    await asyncio.to_thread(router.stop, 600)
+    return args.updates / (time.perf_counter() - started)
+
+
+async def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    async def me(request):
+        return web.json_response({"user_id": 1, "first_name": "bench", "is_bot": True, "last_activity_time": 0})
+
+    app = web.Application()
+    app.router.add_get("/me", me)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+
+    print(f"Обновлений: {args.updates}, обработчик {args.cpu_ms:g} мс процессора, ядер: {os.cpu_count()}\n")
+    try:
+        base = None
+        for shards in args.shards:
+            rate = await measure(args, shards)
+            base = base or rate
+            print(f"{shards:>3} процесс(а/ов): {rate:>8.0f} обновлений/с  (x{rate / base:.2f})")
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,63 @@
+"""
+Бенчмарк получения названий подписок для /schedules и клавиатур отписки и выбора расписания:
+запрос к SQLite на каждую подписку (как было) против одного пакетного get_entity_names.
+
+Запуск: python -m benchmarks.bench_titles [количество подписок]
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import tempfile
+
+from benchmarks.bench_recurrence import build_snapshot
+from db.db_operations import get_campus_by_place_id, get_entity_name_by_type, get_entity_names
+from db.snapshot_store import _pinned_path
+
+ROUNDS = 200
+
+
+# === Прежняя схема: запрос на каждую подписку (для сравнения) ===
+async def legacy_names(db_path: str, subs: dict) -> dict:
+    names = {}
+    for stype, ids in subs.items():
+        for eid in ids:
+            title = await get_entity_name_by_type(db_path, stype, eid)
+            campus = get_campus_by_place_id(eid) if stype == "place" else None
+            names.setdefault(stype, {})[eid] = (title, campus)
+    return names
+
+
+async def main():
+    subscriptions = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    rnd = random.Random(3)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "schedule.db")
+        build_snapshot(path, 200)
+        # get_campus_by_place_id читает снапшот, закреплённый за запросом
+        _pinned_path.set(path)
+
+        subs = {"group": [], "teacher": [], "place": []}
+        for _ in range(subscriptions):
+            subs[rnd.choice(list(subs))].append(rnd.randrange(200))
+        print(f"Подписок: {subscriptions} ({', '.join(f'{k}: {len(v)}' for k, v in subs.items())})\n")
+
+        assert await legacy_names(path, subs) == get_entity_names(path, subs)
+
+        started = time.perf_counter()
+        for _ in range(ROUNDS):
+            await legacy_names(path, subs)
+        legacy = (time.perf_counter() - started) / ROUNDS
+
+        started = time.perf_counter()
+        for _ in range(ROUNDS):
+            get_entity_names(path, subs)
+        batched = (time.perf_counter() - started) / ROUNDS
+
+        print(f"{'По запросу на подписку':<30} {legacy * 1000:>8.2f} мс")
+        print(f"{'get_entity_names':<30} {batched * 1000:>8.2f} мс  (x{legacy / batched:.1f})")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,100 @@
+"""
+Бенчмарк транспорта ScheduleWebClient: новая сессия на каждый запуск клиента против общего keep-alive транспорта.
+Клиент обращается к локальной заглушке gRPC-Web, поэтому измеряются только накладные расходы HTTP-клиента.
+
+Запуск: python -m benchmarks.bench_transport [запусков] [RPC на запуск] [параллельность]
+"""
+import sys
+import time
+import asyncio
+
+import aiohttp
+from aiohttp import web
+
+from grpc import personal_schedule_pb2 as pb2
+from grpc.grpc_web import encode_frame, encode_trailers
+from grpc.schedule_client import ScheduleWebClient, create_schedule_id
+from grpc.transport import close_shared_session
+
+
+class StaticTokenProvider:
+    """Постоянный токен: заглушка не проверяет авторизацию"""
+
+    async def get_token(self, session=None) -> str:
+        return "bench"
+
+    def invalidate(self, token=None):
+        pass
+
+
+async def get_schedule_title(request: web.Request) -> web.Response:
+    await request.read()
+    message = pb2.GetScheduleTitleResponse().SerializeToString()
+    body = encode_frame(message) + encode_trailers()
+    return web.Response(body=body, content_type="application/grpc-web+proto")
+
+
+async def start_stub_server() -> tuple[web.AppRunner, str]:
+    app = web.Application()
+    app.router.add_post("/rtu.schedule.api.PersonalScheduleService/GetScheduleTitle", get_schedule_title)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+async def run_client(client: ScheduleWebClient, rpcs: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    schedule_id = create_schedule_id(pb2.SCHEDULE_TYPE_GROUP, 1)
+
+    async def call():
+        async with semaphore:
+            await client.get_schedule_title(schedule_id)
+
+    await asyncio.gather(*(call() for _ in range(rpcs)))
+
+
+async def per_run_sessions(base_url: str, runs: int, rpcs: int, concurrency: int):
+    """Прежнее поведение: каждый запуск клиента открывает и закрывает свою сессию"""
+    for _ in range(runs):
+        async with aiohttp.ClientSession() as session:
+            async with ScheduleWebClient(StaticTokenProvider(), session=session, base_url=base_url) as client:
+                await run_client(client, rpcs, concurrency)
+
+
+async def shared_transport(base_url: str, runs: int, rpcs: int, concurrency: int):
+    for _ in range(runs):
+        async with ScheduleWebClient(StaticTokenProvider(), base_url=base_url) as client:
+            await run_client(client, rpcs, concurrency)
+
+
+async def measure(name: str, scenario, base_url: str, runs: int, rpcs: int, concurrency: int):
+    started = time.perf_counter()
+    await scenario(base_url, runs, rpcs, concurrency)
+    elapsed = time.perf_counter() - started
+    total = runs * rpcs
+    print(f"{name:<22} {total} RPC за {elapsed:.2f} с — {total / elapsed:,.0f} RPC/с")
+
+
+async def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    rpcs = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    concurrency = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+
+    runner, base_url = await start_stub_server()
+    try:
+        print(f"Запусков клиента: {runs}, RPC на запуск: {rpcs}, параллельность: {concurrency}")
+        # Прогрев: импорт кодеков и первое соединение не должны попасть в замер
+        await shared_transport(base_url, 1, rpcs, concurrency)
+
+        await measure("Сессия на запуск", per_run_sessions, base_url, runs, rpcs, concurrency)
+        await measure("Общий транспорт", shared_transport, base_url, runs, rpcs, concurrency)
+    finally:
+        await close_shared_session()
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,198 @@
+"""
+Бенчмарк разбора и форматирования диффов GetPersonalScheduleUpdates: вложенные словари против записей
+update_records. Записи разбираются лениво, поэтому сравнивать имеет смысл весь путь «разбор + форматирование»;
+тексты уведомлений обоих путей сверяются.
+
+Запуск: python -m benchmarks.bench_update_records [количество расписаний]
+"""
+import gc
+import sys
+import time
+import tracemalloc
+
+from grpc import personal_schedule_pb2 as pb2
+from datetime import datetime, timedelta
+from google.type import dayofweek_pb2
+from cronjobs.update_records import ScheduleUpdate
+from loadtest.synthetic import build_synthetic_diff
+from cronjobs.updates_by_api import format_updates_for_chat, get_russian_day, _format_week_parity
+
+
+# === Прежний разбор во вложенные словари (для сравнения) ===
+def _legacy_lesson(lesson):
+    return {
+        "discipline": lesson.discipline,
+        "lesson_type": lesson.lesson_type.value if lesson.HasField("lesson_type") else None,
+        "groups": list(lesson.groups),
+        "teachers": list(lesson.teachers),
+        "auditoriums": list(lesson.auditoriums),
+        "begin_time": lesson.begin_time,
+        "end_time": lesson.end_time,
+        "time_details": {
+            "weeks_include": list(lesson.time_details.weeks_include),
+            "weeks_exclude": list(lesson.time_details.weeks_exclude),
+        } if lesson.HasField("time_details") else None,
+    }
+
+
+def _legacy_event(event):
+    return {
+        "discipline": event.discipline,
+        "lesson_type": event.lesson_type,
+        "groups": list(event.groups),
+        "teachers": list(event.teachers),
+        "auditoriums": list(event.auditoriums),
+    }
+
+
+def _legacy_change_type(d) -> str:
+    prev, curr = d.HasField("previous"), d.HasField("current")
+    if not prev and curr:
+        return "ADDED"
+    if prev and not curr:
+        return "REMOVED"
+    if prev and curr:
+        return "MODIFIED"
+    return "UNKNOWN"
+
+
+def legacy_record(index: int, diff) -> dict:
+    return {
+        "type": "SCHEDULE_TYPE_GROUP",
+        "id": index,
+        "title": f"Расписание {index}",
+        "snapshot_id": diff.snapshot_id,
+        "previous_time": diff.previous_time.ToDatetime().isoformat(),
+        "current_time": diff.current_time.ToDatetime().isoformat(),
+        "timetable_changes": [{
+            "time_slot": {
+                "day_of_week": dayofweek_pb2.DayOfWeek.Name(td.time_slot.day_of_week),
+                "number_in_day": td.time_slot.number_in_day,
+                "week_parity": pb2.WeekParity.Name(td.time_slot.week_parity),
+            },
+            "cells": [
+                {k: _legacy_lesson(getattr(c, k)) for k in ("previous", "current") if c.HasField(k)}
+                for c in td.cells
+            ],
+        } for td in diff.timetable_diff],
+        "event_changes": [[{
+            "start_time": ed.time_slot.start.ToDatetime().isoformat() if ed.time_slot.HasField("start") else None,
+            "end_time": ed.time_slot.end.ToDatetime().isoformat() if ed.time_slot.HasField("end") else None,
+            "previous": _legacy_event(d.previous) if d.HasField("previous") else None,
+            "current": _legacy_event(d.current) if d.HasField("current") else None,
+            "change_type": _legacy_change_type(d),
+        } for d in ed.diff] for ed in diff.event_diff],
+    }
+
+
+# === Прежнее форматирование словарей (для сравнения) ===
+def _legacy_format_lesson(lesson: dict) -> str:
+    lines = []
+    if lesson.get("discipline"):
+        lt = f" ({lesson['lesson_type']})" if lesson.get("lesson_type") else ""
+        lines.append(f"📚 {lesson['discipline']}{lt}")
+    if lesson.get("groups"):
+        lines.append(f"👥 Группа: {', '.join(lesson['groups'])}")
+    if lesson.get("teachers"):
+        lines.append(f"👨‍🏫 {', '.join(lesson['teachers'])}")
+    if lesson.get("auditoriums"):
+        lines.append(f"🏫 {', '.join(lesson['auditoriums'])}")
+    return "\n".join(lines)
+
+
+def _legacy_format_timetable_change(t: dict) -> str:
+    time_slot = t["time_slot"]
+    lines = [f"<b>{time_slot['number_in_day']} пара ({_format_week_parity(time_slot['week_parity'])})</b>"]
+    for cell in t["cells"]:
+        prev, curr = cell.get("previous"), cell.get("current")
+        if curr and not prev:
+            lines.append("<b>➕ Добавлено:</b>")
+            lines.append(_legacy_format_lesson(curr))
+        elif prev and not curr:
+            lines.append("<b>➖ Убрано:</b>")
+            lines.append(_legacy_format_lesson(prev))
+        elif prev and curr:
+            lines.append("<b>✏️ Изменено:</b>")
+            lines.append(_legacy_format_lesson(curr))
+    return "\n".join(lines)
+
+
+def _legacy_event_time(value: str | None) -> str | None:
+    if not value:
+        return None
+    return (datetime.fromisoformat(value) + timedelta(hours=3)).strftime("%d.%m %H:%M")
+
+
+def _legacy_format_event_change(event: dict) -> str:
+    start = _legacy_event_time(event["start_time"])
+    end = _legacy_event_time(event["end_time"])
+    when = f"{start}-{end[-5:]}" if start and end else start or end or "время не указано"
+
+    lines = [f"<b>{when}</b>"]
+    if event["change_type"] == "ADDED":
+        lines.append("<b>➕ Добавлено:</b>")
+        lines.append(_legacy_format_lesson(event["current"]))
+    elif event["change_type"] == "REMOVED":
+        lines.append("<b>➖ Убрано:</b>")
+        lines.append(_legacy_format_lesson(event["previous"]))
+    elif event["change_type"] == "MODIFIED":
+        lines.append("<b>✏️ Изменено:</b>")
+        lines.append(_legacy_format_lesson(event["current"]))
+    return "\n".join(lines)
+
+
+def legacy_format_updates_for_chat(changes: list[dict]) -> list[str]:
+    lines = []
+    for upd in changes:
+        lines.append(f"🔔 <b>Изменения в расписании: {upd['title']}</b>")
+        for t in upd["timetable_changes"]:
+            lines.append(f"📅 {get_russian_day(t['time_slot']['day_of_week'])}")
+            lines.append(_legacy_format_timetable_change(t))
+        for event_changes in upd["event_changes"]:
+            for event in event_changes:
+                lines.append(_legacy_format_event_change(event))
+        lines.append("")
+    return lines
+
+
+def measure(title: str, func):
+    """Время меряется отдельным прогоном без tracemalloc, память — вторым прогоном"""
+    gc.collect()
+    started = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    result = func()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{title:<40} {elapsed * 1000:>10.1f} мс  удержано {current / 2**20:>8.1f} МБ  пик {peak / 2**20:>8.1f} МБ")
+    return result
+
+
+def main():
+    schedules = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    diffs = [build_synthetic_diff() for _ in range(schedules)]
+    print(f"Расписаний: {schedules}, изменений в слотах: {schedules * 80}, событий: {schedules * 10}\n")
+
+    def parse_records():
+        return [ScheduleUpdate("SCHEDULE_TYPE_GROUP", i, f"Расписание {i}", d.snapshot_id, d)
+                for i, d in enumerate(diffs)]
+
+    def parse_dicts():
+        return [legacy_record(i, d) for i, d in enumerate(diffs)]
+
+    records = measure("Записи: разбор", parse_records)
+    record_texts = measure("Записи: форматирование", lambda: [format_updates_for_chat([r]) for r in records])
+    measure("Записи: разбор + форматирование", lambda: [format_updates_for_chat([r]) for r in parse_records()])
+    print()
+    dicts = measure("Словари: разбор", parse_dicts)
+    dict_texts = measure("Словари: форматирование", lambda: [legacy_format_updates_for_chat([r]) for r in dicts])
+    measure("Словари: разбор + форматирование", lambda: [legacy_format_updates_for_chat([r]) for r in parse_dicts()])
+
+    mismatches = sum(a != b for a, b in zip(record_texts, dict_texts))
+    print(f"\nТексты уведомлений совпадают: {schedules - mismatches}/{schedules}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,17 @@
 import asyncio
 import logging
-import os
 from datetime import datetime, timedelta
 from sqlalchemy import text as sql_text
 
 from handlers.days_handler import to_unix_timestamp
 from db.db_operations import get_db_session, get_lessons, get_user_subscriptions, merge_duplicate_lessons
+from db.snapshot_store import current_db_path, pinned_snapshot
 from utils.messaging import send_message, split_long_message
 
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
-DB_PATH = os.getenv("SQLITE_PATH")
-
 
 async def build_schedule_text(peer_id: int) -> str:
     subs = await get_user_subscriptions(peer_id)
@@ -30,7 +28,7 @@ async def build_schedule_text(peer_id: int) -> str:
     for stype, ids in subs.items():
         for sid in ids:
             lessons = get_lessons(
-                DB_PATH,
+                current_db_path(),
                 **{f"{stype}_id": sid},
                 start_ts=start_ts,
                 end_ts=end_ts
@@ -72,20 +70,23 @@ async def build_schedule_text(peer_id: int) -> str:
 async def daily_notifier():
     logger.info("Daily notifier started")
     try:
-        async with get_db_session() as session:
+        async with get_db_session(reraise=True) as session:
             result = await session.execute(sql_text(
                 "SELECT chat_id FROM max_subscribes WHERE everyday_nots IS TRUE"
             ))
             rows = result.all()
             logger.info(f"Found {len(rows)} rows with everyday_nots = true")
     except Exception as e:
-        logger.exception("Failed to fetch subscribers")
-        return
+        # Без списка подписчиков рассылка не выполнена — запуск не должен считаться успешным
+        logger.error(f"Failed to fetch subscribers: {e}")
+        raise
 
+    failed = 0
     for row in rows:
         peer_id = row[0]
         try:
-            message_text = await build_schedule_text(peer_id)
+            with pinned_snapshot():
+                message_text = await build_schedule_text(peer_id)
             if not message_text:
                 logger.info(f"No message for {peer_id}")
                 continue
@@ -94,9 +95,13 @@ async def daily_notifier():
                 await send_message(peer_id, chunk)
 
         except Exception as e:
+            failed += 1
             logger.exception(f"Error processing peer_id={peer_id}: {e}")
 
-    logger.info("Daily notifier finished")
+    # Ошибки отдельных чатов не мешают остальным, но если не дошло ни одно сообщение — запуск не выполнен
+    if rows and failed == len(rows):
+        raise RuntimeError(f"Daily notifier failed for all {failed} chats")
+    logger.info(f"Daily notifier finished, failed: {failed}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,173 @@
+import os
+import time
+import zlib
+import asyncio
+import logging
+import functools
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+
+from apscheduler.triggers.base import BaseTrigger
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from db.db_operations import engine, get_db_session
+from utils.metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+# Сколько ждать общую блокировку конвейера расписания (скачивание снапшота / рассылка обновлений)
+PIPELINE_LOCK_WAIT = float(os.getenv("PIPELINE_LOCK_WAIT", "600"))
+# Насколько запуск может опоздать относительно расписания (misfire_grace_time планировщика)
+JOB_MISFIRE_GRACE = int(os.getenv("JOB_MISFIRE_GRACE", "300"))
+
+job_runs_total = Counter("cron_job_runs_total", "Запуски крон-задач по результату (ok, error, skipped)",
+                         ["job", "result"])
+job_seconds = Histogram("cron_job_seconds", "Длительность крон-задач", ["job"])
+job_last_success = Gauge("cron_job_last_success_timestamp_seconds", "Время последнего успешного завершения задачи",
+                         ["job"])
+
+
+def lock_key(name: str) -> int:
+    """Стабильный ключ pg_advisory_lock для имени блокировки"""
+    return zlib.crc32(f"max_timetable_bot:{name}".encode())
+
+
+async def _try_lock(conn: AsyncConnection, name: str) -> bool:
+    return bool(await conn.scalar(text("SELECT pg_try_advisory_lock(:key)"), {"key": lock_key(name)}))
+
+
+async def _unlock(conn: AsyncConnection, name: str):
+    await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": lock_key(name)})
+
+
+@asynccontextmanager
+async def advisory_lock(name: str, wait: float = 0.0):
+    """
+    Сессионная advisory-блокировка PostgreSQL, общая для всех реплик.
+    Отдаёт True, если блокировка взята (в течение wait секунд), иначе False.
+    """
+    async with engine.connect() as conn:
+        deadline = time.monotonic() + wait
+        acquired = await _try_lock(conn, name)
+        while not acquired and time.monotonic() < deadline:
+            await asyncio.sleep(1)
+            acquired = await _try_lock(conn, name)
+
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                try:
+                    await _unlock(conn, name)
+                except Exception as e:
+                    # Закрытие соединения снимет блокировку на стороне PostgreSQL
+                    logger.error(f"Не удалось снять блокировку {name}: {e}")
+                    await conn.invalidate()
+
+
+def scheduled_run_time(trigger: BaseTrigger, now: datetime | None = None) -> datetime | None:
+    """Время срабатывания trigger, к которому относится запуск в момент now: последнее не позже now"""
+    now = now or datetime.now(trigger.timezone)
+    fire_time = trigger.get_next_fire_time(None, now - timedelta(seconds=JOB_MISFIRE_GRACE))
+    scheduled = None
+    while fire_time is not None and fire_time <= now:
+        scheduled = fire_time
+        fire_time = trigger.get_next_fire_time(fire_time, fire_time)
+    return scheduled
+
+
+async def _already_completed(job_id: str, scheduled: datetime) -> bool:
+    """
+    Выполнен ли уже запуск задачи на время scheduled (в любой реплике).
+    При ошибке БД — False: задача всё равно защищена блокировкой от одновременного выполнения.
+    """
+    try:
+        async with get_db_session(reraise=True) as session:
+            last = await session.scalar(
+                text("SELECT last_scheduled_run_time FROM cron_job_state WHERE job_id = :job_id"),
+                {"job_id": job_id},
+            )
+    except Exception as e:
+        logger.error(f"Не удалось прочитать последний запуск задачи {job_id}: {e}")
+        return False
+    return last is not None and last >= scheduled
+
+
+async def _mark_completed(job_id: str, scheduled: datetime):
+    try:
+        async with get_db_session(reraise=True) as session:
+            await session.execute(text("""
+                INSERT INTO cron_job_state (job_id, last_scheduled_run_time)
+                VALUES (:job_id, :scheduled)
+                ON CONFLICT (job_id) DO UPDATE SET last_scheduled_run_time =
+                    GREATEST(cron_job_state.last_scheduled_run_time, EXCLUDED.last_scheduled_run_time)
+            """), {"job_id": job_id, "scheduled": scheduled})
+    except Exception as e:
+        logger.error(f"Не удалось сохранить запуск задачи {job_id} на {scheduled}: {e}")
+
+
+def exclusive_job(job_id: str, pipeline_lock: str | None = None, trigger: BaseTrigger | None = None):
+    """
+    Запускает задачу только в одном экземпляре на все реплики крон-сервиса.
+    Если задача уже выполняется — запуск пропускается.
+    trigger — расписание задачи: время срабатывания, к которому относится запуск, сохраняется в
+    cron_job_state только после выполнения без исключения, и повторный запуск на то же время (реплика,
+    сработавшая позже другой) пропускается.
+    pipeline_lock — общая блокировка для задач, которые не должны выполняться одновременно:
+    такую блокировку задача ждёт до PIPELINE_LOCK_WAIT секунд.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            scheduled = scheduled_run_time(trigger) if trigger is not None else None
+            async with advisory_lock(job_id) as acquired:
+                if not acquired:
+                    logger.warning(f"⏭ Задача {job_id} пропущена: уже выполняется в этой или другой реплике")
+                    job_runs_total.inc(job=job_id, result="skipped")
+                    return None
+
+                if scheduled is not None and await _already_completed(job_id, scheduled):
+                    logger.info(f"⏭ Задача {job_id} пропущена: запуск на {scheduled} уже выполнен")
+                    job_runs_total.inc(job=job_id, result="skipped")
+                    return None
+
+                if pipeline_lock is None:
+                    value = await _run_timed(job_id, func, *args, **kwargs)
+                else:
+                    async with advisory_lock(pipeline_lock, wait=PIPELINE_LOCK_WAIT) as pipeline_acquired:
+                        if not pipeline_acquired:
+                            logger.warning(f"⏭ Задача {job_id} пропущена: блокировка {pipeline_lock} занята "
+                                           f"дольше {PIPELINE_LOCK_WAIT:.0f} с")
+                            job_runs_total.inc(job=job_id, result="skipped")
+                            return None
+                        value = await _run_timed(job_id, func, *args, **kwargs)
+
+                if scheduled is not None:
+                    await _mark_completed(job_id, scheduled)
+                return value
+
+        return wrapper
+    return decorator
+
+
+async def _run_timed(job_id: str, func, *args, **kwargs):
+    """
+    Выполняет задачу и записывает метрики. Успехом (result="ok", cron_job_last_success_timestamp_seconds)
+    считается только выполнение без исключения: задача должна пробрасывать свои ошибки, а не глотать их.
+    """
+    started = time.monotonic()
+    result = "error"
+    try:
+        value = await func(*args, **kwargs)
+        result = "ok"
+        job_last_success.set(time.time(), job=job_id)
+        return value
+    finally:
+        elapsed = time.monotonic() - started
+        job_runs_total.inc(job=job_id, result=result)
+        job_seconds.observe(elapsed, job=job_id)
+        if result == "ok":
+            logger.info(f"Задача {job_id} завершена за {elapsed:.1f} с")
+        else:
+            logger.error(f"Задача {job_id} завершилась с ошибкой за {elapsed:.1f} с")
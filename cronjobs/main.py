@@ -1,14 +1,17 @@
-import os
 import asyncio
-import aiohttp
 import logging
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.events import EVENT_JOB_MAX_INSTANCES, EVENT_JOB_MISSED
 from cronjobs.subscribe_by_api import update_schedule_if_needed
-from cronjobs.updates_by_api import get_structured_updates, send_updates_to_subscribers
+from cronjobs.updates_by_api import get_structured_updates, send_updates_to_subscribers, accept_updates_bulk, \
+    get_sent_snapshot_ids, mark_updates_sent
 from cronjobs.daily_notifier import daily_notifier
+from cronjobs.locks import JOB_MISFIRE_GRACE, exclusive_job
 from grpc.schedule_client import ScheduleWebClient
-from grpc import personal_schedule_pb2 as pb2
+from grpc.transport import close_shared_session
+from utils.auth import token_provider
+from utils.metrics import start_metrics_server
 
 from pytz import timezone
 
@@ -16,89 +19,98 @@ from pytz import timezone
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
-TOKEN_URL = os.getenv("TOKEN_URL")
-CLIENT_ID = os.getenv("CLIENT_ID")
-CLIENT_SECRET = os.getenv("CLIENT_SECRET")
 
-TOKEN_DATA = {
-    "grant_type": "client_credentials",
-    "scope": "openid",
-    "client_id": CLIENT_ID,
-    "client_secret": CLIENT_SECRET
+# Общая блокировка: скачивание снапшота и рассылка обновлений не выполняются одновременно
+SCHEDULE_PIPELINE_LOCK = "schedule_pipeline"
+
+# Не более одного запуска каждой задачи; пропущенные запуски схлопываются в один
+JOB_DEFAULTS = {
+    "max_instances": 1,
+    "coalesce": True,
+    "misfire_grace_time": JOB_MISFIRE_GRACE,
 }
 
+moscow_tz = timezone('Europe/Moscow')
+
+DAILY_NOTIFIER_TRIGGER = CronTrigger(hour=8, minute=30, day_of_week="0-5", timezone=moscow_tz)
+SCHEDULE_UPDATE_TRIGGER = CronTrigger(minute="0", timezone=moscow_tz)
+SEND_UPDATES_TRIGGER = CronTrigger(hour="7-20", minute="*/10", timezone=moscow_tz)
+
+
+@exclusive_job("daily_notifier", trigger=DAILY_NOTIFIER_TRIGGER)
+async def run_daily_notifier():
+    await daily_notifier()
 
+
+@exclusive_job("schedule_update", pipeline_lock=SCHEDULE_PIPELINE_LOCK, trigger=SCHEDULE_UPDATE_TRIGGER)
 async def run_update_schedule():
-    try:
-        await update_schedule_if_needed()
-    except Exception as e:
-        logger.exception(f"Ошибка при обновлении расписания: {e}")
+    await update_schedule_if_needed()
 
 
+@exclusive_job("send_updates", pipeline_lock=SCHEDULE_PIPELINE_LOCK, trigger=SEND_UPDATES_TRIGGER)
 async def run_send_updates():
     """Проверка обновлений, рассылка и подтверждение получения"""
     try:
         logger.info("Проверка обновлений и рассылка...")
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post(TOKEN_URL, data=TOKEN_DATA) as resp:
-                resp.raise_for_status()
-                token = (await resp.json())["access_token"]
-
-            async with ScheduleWebClient(token) as client:
-                updates = await get_structured_updates()
-
-                if not updates:
-                    logger.info("Нет новых обновлений")
-                    return
-
-                await send_updates_to_subscribers(updates)
-                logger.info("Обновления отправлены подписчикам")
-
-                for upd in updates:
-                    try:
-                        schedule_id = upd["id"]
-                        snapshot_id = upd["snapshot_id"]
-                        if snapshot_id:
-                            schedule_id_msg = pb2.ScheduleId(
-                                schedule_type=pb2.ScheduleType.Value(upd["type"]),
-                                schedule_id=upd["id"]
-                            )
-
-                            await client.accept_schedule_updates(
-                                schedule_id=schedule_id_msg,
-                                snapshot_id=upd["snapshot_id"]
-                            )
-                            logger.info(f"✅ Приняты обновления для {upd['title']}")
-                    except Exception as e:
-                        logger.warning(f"Не удалось принять обновление для {upd['title']}: {e}")
+        async with ScheduleWebClient(token_provider) as client:
+            updates = await get_structured_updates()
+
+            if not updates:
+                logger.info("Нет новых обновлений")
+                return
+
+            # Изменения, уже разосланные в прошлом запуске, но не принятые (например, после падения),
+            # повторно не отправляются — их нужно только принять
+            sent = await get_sent_snapshot_ids()
+            to_send = [upd for upd in updates if sent.get((upd.type, upd.id)) != upd.snapshot_id]
+            if len(to_send) < len(updates):
+                logger.info(f"Пропущено уже разосланных обновлений: {len(updates) - len(to_send)}")
+
+            await send_updates_to_subscribers(to_send)
+            logger.info("Обновления отправлены подписчикам")
+            try:
+                await mark_updates_sent(to_send)
+            except Exception as e:
+                # Принятие ниже всё равно нужно: принятые обновления API больше не вернёт и повторной рассылки не будет
+                logger.error(f"Не удалось отметить разосланные обновления: {e}")
+
+            await accept_updates_bulk(client, updates)
 
     except Exception as e:
-        logger.exception(f"Ошибка при отправке обновлений: {e}")
+        # Ошибка пробрасывается: неудачный запуск не должен считаться выполненным
+        logger.error(f"Ошибка при отправке обновлений: {e}")
+        raise
 
 
-def start_scheduler():
-    scheduler = AsyncIOScheduler()
+def _log_skipped_job(event):
+    if event.code == EVENT_JOB_MAX_INSTANCES:
+        logger.warning(f"⏭ Задача {event.job_id} пропущена: предыдущий запуск ещё выполняется")
+    elif event.code == EVENT_JOB_MISSED:
+        logger.warning(f"⏭ Задача {event.job_id} пропущена: запуск на {event.scheduled_run_time} опоздал")
+
 
-    moscow_tz = timezone('Europe/Moscow')
+def start_scheduler():
+    scheduler = AsyncIOScheduler(job_defaults=JOB_DEFAULTS)
+    scheduler.add_listener(_log_skipped_job, EVENT_JOB_MAX_INSTANCES | EVENT_JOB_MISSED)
 
     scheduler.add_job(
-        daily_notifier,
-        CronTrigger(hour=8, minute=30, day_of_week="0-5", timezone=moscow_tz),
+        run_daily_notifier,
+        DAILY_NOTIFIER_TRIGGER,
         id="daily_notifier_0830",
         replace_existing=True,
     )
 
     scheduler.add_job(
         run_update_schedule,
-        CronTrigger(minute="0", timezone=moscow_tz),
+        SCHEDULE_UPDATE_TRIGGER,
         id="schedule_update_hourly",
         replace_existing=True,
     )
 
     scheduler.add_job(
         run_send_updates,
-        CronTrigger(hour="7-20", minute="*/10", timezone=moscow_tz),
+        SEND_UPDATES_TRIGGER,
         id="send_updates_10min",
         replace_existing=True,
     )
@@ -111,6 +123,7 @@ def start_scheduler():
 async def main():
     try:
         logger.info("Запуск сервиса обновлений расписания...")
+        metrics = await start_metrics_server()
         scheduler = start_scheduler()
         await asyncio.Event().wait()
     except KeyboardInterrupt:
@@ -119,6 +132,8 @@ async def main():
     except Exception as e:
         logger.exception(f"❌ Ошибка: {e}")
         scheduler.shutdown()
+    finally:
+        await close_shared_session()
 
 if __name__ == "__main__":
     asyncio.run(main())
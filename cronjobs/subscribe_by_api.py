@@ -1,10 +1,19 @@
+import asyncio
 import aiohttp
+import aiofiles
+import hashlib
+import json
 import sqlite3
 from grpc.schedule_client import ScheduleWebClient, create_schedule_id
 from db.db_operations import get_db_session
+from db.snapshot_diff import changes_path, compute_snapshot_diff, save_change_set, summarize_change_set
+from db.snapshot_store import SNAPSHOT_DIR, collect_garbage, prepare_snapshot, publish_snapshot, version_path
+from utils.auth import token_provider
+from utils.resilience import CircuitBreaker, CircuitOpenError
 from sqlalchemy import text
 from typing import List
 import logging
+import time
 import os
 from dotenv import load_dotenv
 
@@ -14,17 +23,24 @@ logging.basicConfig(level=logging.INFO)
 load_dotenv()
 
 DB_PATH = os.getenv("SQLITE_PATH")
-TOKEN_URL = os.getenv("TOKEN_URL")
-CLIENT_ID = os.getenv("CLIENT_ID")
-CLIENT_SECRET = os.getenv("CLIENT_SECRET")
 SCHEDULE_URL = os.getenv("SCHEDULE_URL")
 
-TOKEN_DATA = {
-    "grant_type": "client_credentials",
-    "scope": "openid",
-    "client_id": CLIENT_ID,
-    "client_secret": CLIENT_SECRET
-}
+DOWNLOAD_META_PATH = os.path.join(SNAPSHOT_DIR, "download.json")
+DOWNLOAD_TEMP_PATH = os.path.join(SNAPSHOT_DIR, "download.temp")
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_PROGRESS_STEP = 10 * 1024 * 1024
+
+SUBSCRIBE_CONCURRENCY = int(os.getenv("SUBSCRIBE_CONCURRENCY", "4"))
+SUBSCRIBE_BATCH_SIZE = int(os.getenv("SUBSCRIBE_BATCH_SIZE", "2000"))
+SUBSCRIBE_MIN_BATCH = int(os.getenv("SUBSCRIBE_MIN_BATCH", "100"))
+SUBSCRIBE_MAX_BATCH = int(os.getenv("SUBSCRIBE_MAX_BATCH", "10000"))
+# Желаемое время ответа на батч: быстрее — батч растёт, медленнее — уменьшается
+SUBSCRIBE_TARGET_LATENCY = float(os.getenv("SUBSCRIBE_TARGET_LATENCY", "2"))
+SUBSCRIBE_REQUEST_TIMEOUT = float(os.getenv("SUBSCRIBE_REQUEST_TIMEOUT", "30"))
+
+# Автомат вокруг запросов к API снапшотов. Лимит параллельности не нужен: запросы идут по одному,
+# а длительность скачивания файла зависит от его размера, а не от нагрузки на сервис
+snapshot_breaker = CircuitBreaker("Snapshot API")
 
 TABLES = {
     "teacher": ("teacher", 2),
@@ -79,109 +95,380 @@ def get_all_ids_from_table(table: str) -> List[int]:
         return []
 
 
-async def fetch_access_token(session: aiohttp.ClientSession) -> str:
-    """Получает access token"""
+async def fetch_schedule_info(session: aiohttp.ClientSession) -> dict:
+    """Получает информацию о расписании"""
     try:
-        async with session.post(TOKEN_URL, data=TOKEN_DATA) as resp:
-            resp.raise_for_status()
-            data = await resp.json()
-            return data["access_token"]
+        for attempt in range(2):
+            token = await token_provider.get_token(session)
+            headers = {"Authorization": f"Bearer {token}"}
+            async with snapshot_breaker.guard(), session.get(SCHEDULE_URL, headers=headers) as resp:
+                if resp.status == 401 and attempt == 0:
+                    token_provider.invalidate(token)
+                    continue
+
+                resp.raise_for_status()
+                data = await resp.json()
+                logger.info(f"Информация о расписании получена, snapshot: {data.get('snapshotId')}")
+                return data
     except Exception as e:
-        logger.error(f"Ошибка при получении access token: {e}")
+        logger.error(f"Ошибка при получении информации о расписании: {e}")
         raise
 
 
-async def fetch_schedule_info(session: aiohttp.ClientSession, token: str) -> dict:
-    """Получает информацию о расписании"""
+def save_snapshot_changes(new_db_path: str, snapshot_id: int, path: str):
+    """
+    Сравнивает текущий SQLite файл с только что скачанным и сохраняет набор изменений в path.
+    Ошибка сравнения не должна мешать обновлению расписания.
+    """
+    if not os.path.exists(DB_PATH):
+        return
+
     try:
-        headers = {"Authorization": f"Bearer {token}"}
-        async with session.get(SCHEDULE_URL, headers=headers) as resp:
-            resp.raise_for_status()
-            data = await resp.json()
-            logger.info(f"Информация о расписании получена, snapshot: {data.get('snapshotId')}")
-            return data
+        started = time.monotonic()
+        change_set = compute_snapshot_diff(DB_PATH, new_db_path)
+        save_change_set(change_set, snapshot_id, path, base=os.path.basename(os.path.realpath(DB_PATH)))
+        logger.info(
+            f"Изменения snapshot {snapshot_id} за {time.monotonic() - started:.2f} с: "
+            f"{summarize_change_set(change_set)}"
+        )
     except Exception as e:
-        logger.error(f"Ошибка при получении информации о расписании: {e}")
+        logger.error(f"Ошибка при сравнении снапшотов: {e}")
+
+
+async def download_db_file(session: aiohttp.ClientSession, db_url: str, snapshot_id: int) -> bool:
+    """
+    Скачивает SQLite файл потоково во временный файл, проверяет его целостность,
+    сохраняет как новое поколение снапшота и атомарно переключает на него SQLITE_PATH.
+    Запрос условный (ETag / Last-Modified), оборванная загрузка докачивается через Range.
+    Возвращает False, если файл на сервере не изменился.
+    """
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    temp_db_path = DOWNLOAD_TEMP_PATH
+    meta = load_download_meta()
+    headers = _conditional_headers(meta, db_url)
+    # Без сжатия: Range и Content-Length должны относиться к байтам самого файла
+    headers["Accept-Encoding"] = "identity"
+
+    offset = _resumable_offset(meta, db_url, temp_db_path)
+    if offset:
+        partial = meta["partial"]
+        headers["Range"] = f"bytes={offset}-"
+        headers["If-Range"] = partial.get("etag") or partial["last_modified"]
+
+    try:
+        started = time.monotonic()
+        result = await _stream_to_file(session, db_url, temp_db_path, headers, offset, meta)
+        elapsed = time.monotonic() - started
+
+        if result is None:
+            saved = meta.get("size", 0)
+            logger.info(f"SQLite файл не изменился (304), сэкономлено {saved / (1024 * 1024):.2f} МБ"
+                        f"{_estimate_saved_time(meta, saved)}")
+            return False
+
+        logger.info(f"SQLite файл скачан: {result['size'] / (1024 * 1024):.2f} МБ за {elapsed:.1f} с, "
+                    f"sha256={result['sha256']}")
+        await asyncio.to_thread(verify_db_file, temp_db_path)
+
+    except (ValueError, sqlite3.DatabaseError, aiohttp.ClientResponseError) as e:
+        # Файл повреждён или сервер отказал в запросе — докачивать нечего
+        logger.error(f"Ошибка при скачивании SQLite файла: {e}")
+        _discard_partial(meta, temp_db_path)
+        raise
+    except Exception as e:
+        logger.error(f"Загрузка SQLite файла прервана, будет докачана при следующем запуске: {e!r}")
         raise
 
+    # Проверка, индексы FTS и сравнение снапшотов — синхронная работа с SQLite на секунды, поэтому в потоке:
+    # цикл событий крон-сервиса в это время обслуживает остальные задачи
+    try:
+        await asyncio.to_thread(prepare_snapshot, temp_db_path)
+    except sqlite3.Error as e:
+        # Без индексов снапшот остаётся рабочим, поиск по дисциплинам перейдёт на LIKE
+        logger.error(f"Ошибка при подготовке снапшота: {e}")
+
+    generation_path = version_path(snapshot_id)
+    await asyncio.to_thread(save_snapshot_changes, temp_db_path, snapshot_id, changes_path(generation_path))
+    replace_db_file(temp_db_path, generation_path)
+    publish_snapshot(generation_path)
+
+    transferred, resumed = result["transferred"], result["size"] - result["transferred"]
+    save_download_meta({
+        "url": db_url,
+        "etag": result["etag"],
+        "last_modified": result["last_modified"],
+        "size": result["size"],
+        "sha256": result["sha256"],
+        "bytes_per_second": transferred / elapsed if elapsed > 0 else None,
+    })
 
-async def download_db_file(session: aiohttp.ClientSession, db_url: str):
-    """Скачивает и сохраняет SQLite файл"""
     try:
-        temp_db_path = DB_PATH + ".temp"
-        async with session.get(db_url) as resp:
-            resp.raise_for_status()
-            content = await resp.read()
+        collect_garbage()
+    except OSError as e:
+        logger.error(f"Ошибка при удалении старых поколений снапшота: {e}")
+
+    logger.info(
+        f"SQLite файл обновлен. Передано {transferred / (1024 * 1024):.2f} МБ"
+        + (f", докачано после обрыва, сэкономлено {resumed / (1024 * 1024):.2f} МБ"
+           f"{_estimate_saved_time(meta, resumed)}" if resumed else "")
+    )
+    return True
+
+
+async def _stream_to_file(session: aiohttp.ClientSession, url: str, path: str, headers: dict,
+                          offset: int, meta: dict) -> dict | None:
+    """
+    Пишет тело ответа в файл частями, сбрасывая его на диск.
+    При ответе 206 дописывает файл с позиции offset. Возвращает None при ответе 304.
+    """
+    async with snapshot_breaker.guard(), session.get(url, headers=headers) as resp:
+        if resp.status == 304:
+            return None
+        resp.raise_for_status()
+
+        if resp.status != 206:
+            offset = 0
+
+        etag = resp.headers.get("ETag")
+        last_modified = resp.headers.get("Last-Modified")
+        meta["partial"] = {"url": url, "etag": etag, "last_modified": last_modified}
+        save_download_meta(meta)
+
+        # Хеш уже скачанной части считается в потоке: файл в десятки мегабайт держал бы цикл событий
+        digest = await asyncio.to_thread(_file_sha256, path) if offset else hashlib.sha256()
+        # Сжатый ответ aiohttp распаковывает сам, и Content-Length не равен размеру файла
+        encoded = resp.headers.get("Content-Encoding", "identity").lower() != "identity"
+        total = offset + resp.content_length if resp.content_length is not None and not encoded else None
+        size = offset
+        next_progress = offset + DOWNLOAD_PROGRESS_STEP
+        if offset:
+            logger.info(f"Докачка с {offset / (1024 * 1024):.1f} МБ")
+
+        async with aiofiles.open(path, "ab" if offset else "wb") as f:
+            async for chunk in resp.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                await f.write(chunk)
+                digest.update(chunk)
+                size += len(chunk)
+
+                if size >= next_progress:
+                    next_progress += DOWNLOAD_PROGRESS_STEP
+                    progress = f" из {total / (1024 * 1024):.1f} МБ ({size / total:.0%})" if total else ""
+                    logger.info(f"Скачано {size / (1024 * 1024):.1f} МБ{progress}")
+
+            await f.flush()
+            await asyncio.to_thread(os.fsync, f.fileno())
+
+    if total is not None and size != total:
+        raise ValueError(f"Размер файла {size} не совпадает с Content-Length {total}")
+
+    return {
+        "size": size,
+        "transferred": size - offset,
+        "sha256": digest.hexdigest(),
+        "etag": etag,
+        "last_modified": last_modified,
+    }
+
+
+# === Метаданные загрузки ===
+def load_download_meta() -> dict:
+    try:
+        with open(DOWNLOAD_META_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_download_meta(meta: dict):
+    temp_path = DOWNLOAD_META_PATH + ".temp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(temp_path, DOWNLOAD_META_PATH)
+
+
+def _conditional_headers(meta: dict, url: str) -> dict:
+    """Валидаторы уже скачанного файла, если он скачан по тому же адресу и ещё лежит на диске"""
+    if meta.get("url") != url or not os.path.exists(DB_PATH):
+        return {}
+    if meta.get("etag"):
+        return {"If-None-Match": meta["etag"]}
+    if meta.get("last_modified"):
+        return {"If-Modified-Since": meta["last_modified"]}
+    return {}
+
+
+def _resumable_offset(meta: dict, url: str, temp_path: str) -> int:
+    """Размер недокачанного файла, если его можно продолжить (тот же адрес и есть валидатор)"""
+    partial = meta.get("partial") or {}
+    if partial.get("url") != url or not (partial.get("etag") or partial.get("last_modified")):
+        return 0
+    return os.path.getsize(temp_path) if os.path.exists(temp_path) else 0
 
-            with open(temp_db_path, "wb") as f:
-                f.write(content)
 
-            if os.path.exists(DB_PATH):
-                os.remove(DB_PATH)
-            os.rename(temp_db_path, DB_PATH)
+def _discard_partial(meta: dict, temp_path: str):
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    if meta.pop("partial", None) is not None:
+        save_download_meta(meta)
 
-        file_size = len(content) / (1024 * 1024)
-        logger.info(f"SQLite файл обновлен. Размер: {file_size:.2f} МБ")
 
-    except Exception as e:
-        logger.error(f"Ошибка при скачивании SQLite файла: {e}")
-        if os.path.exists(temp_db_path):
-            os.remove(temp_db_path)
-        raise
+def _file_sha256(path: str):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest
+
+
+def _estimate_saved_time(meta: dict, saved_bytes: int) -> str:
+    speed = meta.get("bytes_per_second")
+    return f" (~{saved_bytes / speed:.1f} с)" if speed and saved_bytes else ""
 
 
-async def update_subscriptions(token: str):
-    """Обновляет подписки на все расписания"""
+def verify_db_file(path: str):
+    """Проверяет целостность SQLite файла"""
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
     try:
-        async with ScheduleWebClient(token) as client:
-            all_schedule_ids = []
+        result = conn.execute("PRAGMA quick_check").fetchone()[0]
+        if result != "ok":
+            raise ValueError(f"PRAGMA quick_check: {result}")
+        conn.execute("SELECT 1 FROM lesson LIMIT 1")
+    finally:
+        conn.close()
 
-            for table_name, (db_table, schedule_type) in TABLES.items():
-                ids = get_all_ids_from_table(db_table)
-                all_schedule_ids.extend([create_schedule_id(schedule_type, schedule_id) for schedule_id in ids])
 
-            logger.info(f"Всего расписаний для подписки: {len(all_schedule_ids)}")
+def replace_db_file(temp_path: str, target_path: str):
+    """Атомарно подменяет файл: читатели видят либо старый, либо новый файл целиком"""
+    os.replace(temp_path, target_path)
 
-            if not all_schedule_ids:
-                logger.warning("Нет расписаний для подписки")
-                return
+    dir_fd = os.open(os.path.dirname(os.path.abspath(target_path)), os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
 
-            batch_size = 10000
-            total_batches = (len(all_schedule_ids) + batch_size - 1) // batch_size
-            successful_batches = 0
 
-            for i in range(0, len(all_schedule_ids), batch_size):
-                batch = all_schedule_ids[i:i + batch_size]
-                batch_num = (i // batch_size) + 1
+async def update_subscriptions():
+    """
+    Обновляет подписки на расписания: отправляет только те расписания снапшота,
+    на которые ещё нет подписки, батчами параллельно.
+    """
+    try:
+        async with ScheduleWebClient(token_provider) as client:
+            wanted = set()
+            for table_name, (db_table, schedule_type) in TABLES.items():
+                wanted.update((schedule_type, schedule_id) for schedule_id in get_all_ids_from_table(db_table))
 
-                logger.info(f"Отправка батча {batch_num}/{total_batches} ({len(batch)} расписаний)")
+            logger.info(f"Всего расписаний в снапшоте: {len(wanted)}")
 
-                try:
-                    response = await client.update_subscribed_schedules(batch)
+            if not wanted:
+                logger.warning("Нет расписаний для подписки")
+                return
 
-                    if response and response.state == response.UPDATE_SUBSCRIBED_SCHEDULES_RESPONSE_OK:
-                        successful_batches += 1
-                        logger.info(f"Батч {batch_num} успешно обработан")
-                    else:
-                        logger.error(f"Ошибка в батче {batch_num}")
+            subscribed = await get_subscribed_keys(client)
+            if subscribed is None:
+                added = wanted
+            else:
+                added = wanted - subscribed
+                removed = subscribed - wanted
+                logger.info(f"Подписок уже есть: {len(subscribed)}, новых: {len(added)}, "
+                            f"пропавших из снапшота: {len(removed)}")
+                if removed:
+                    # API принимает только добавление подписок — пропавшие расписания остаются подписанными
+                    logger.warning(f"Расписания пропали из снапшота, но подписка на них остаётся: {len(removed)}")
+
+            if not added:
+                logger.info("Подписки актуальны, отправлять нечего")
+                return
 
-                except Exception as e:
-                    logger.error(f"Исключение в батче {batch_num}: {e}")
+            schedule_ids = [create_schedule_id(schedule_type, schedule_id) for schedule_type, schedule_id in sorted(added)]
+            started = time.monotonic()
+            sent, failed = await send_subscription_batches(client, schedule_ids)
 
-            logger.info(f"Подписки обновлены. Успешных батчей: {successful_batches}/{total_batches}")
+            logger.info(f"Подписки обновлены за {time.monotonic() - started:.1f} с. "
+                        f"Отправлено: {sent}, с ошибкой: {failed}")
+            if failed:
+                logger.warning("Неотправленные подписки будут повторены при следующем обновлении снапшота")
 
     except Exception as e:
         logger.error(f"Критическая ошибка при обновлении подписок: {e}")
         raise
 
 
+async def get_subscribed_keys(client: ScheduleWebClient) -> set[tuple[int, int]] | None:
+    """Текущие подписки как {(тип, id)}. None, если получить их не удалось — тогда отправляются все расписания"""
+    try:
+        response = await client.get_subscribed_schedules()
+    except Exception as e:
+        logger.error(f"Не удалось получить текущие подписки, будут отправлены все расписания: {e}")
+        return None
+
+    return {(s.schedule_id.schedule_type, s.schedule_id.schedule_id) for s in response.schedules}
+
+
+async def send_subscription_batches(client: ScheduleWebClient, schedule_ids: list) -> tuple[int, int]:
+    """
+    Отправляет подписки батчами в SUBSCRIBE_CONCURRENCY параллельных запросов.
+    Размер батча подстраивается под время ответа: растёт, пока ответы быстрее
+    SUBSCRIBE_TARGET_LATENCY, и уменьшается при медленных ответах и ошибках.
+    Возвращает (отправлено, не отправлено).
+    """
+    position = 0
+    batch_size = SUBSCRIBE_BATCH_SIZE
+    batch_num = 0
+    sent = failed = 0
+
+    async def worker():
+        nonlocal position, batch_size, batch_num, sent, failed
+        while position < len(schedule_ids):
+            batch = schedule_ids[position:position + batch_size]
+            position += len(batch)
+            batch_num += 1
+            num = batch_num
+
+            started = time.monotonic()
+            try:
+                response = await asyncio.wait_for(client.update_subscribed_schedules(batch), SUBSCRIBE_REQUEST_TIMEOUT)
+                ok = response.state == response.UPDATE_SUBSCRIBED_SCHEDULES_RESPONSE_OK
+                if not ok:
+                    logger.error(f"Ошибка в батче {num}: {response.state}")
+            except CircuitOpenError as e:
+                # Сервис недоступен: оставшиеся батчи не отправляем, они будут повторены при следующем обновлении
+                remaining = len(schedule_ids) - position
+                failed += len(batch) + remaining
+                position = len(schedule_ids)
+                logger.error(f"Отправка подписок остановлена на батче {num}: {e}")
+                break
+            except Exception as e:
+                logger.error(f"Исключение в батче {num}: {e!r}")
+                ok = False
+            latency = time.monotonic() - started
+
+            if ok:
+                sent += len(batch)
+            else:
+                failed += len(batch)
+            batch_size = _next_batch_size(batch_size, latency, ok)
+            logger.info(f"Батч {num} ({len(batch)} расписаний) за {latency:.2f} с, "
+                        f"отправлено {sent + failed}/{len(schedule_ids)}, следующий батч: {batch_size}")
+
+    await asyncio.gather(*(worker() for _ in range(SUBSCRIBE_CONCURRENCY)))
+    return sent, failed
+
+
+def _next_batch_size(batch_size: int, latency: float, ok: bool) -> int:
+    if not ok or latency > SUBSCRIBE_TARGET_LATENCY:
+        batch_size //= 2
+    elif latency < SUBSCRIBE_TARGET_LATENCY / 2:
+        batch_size *= 2
+    return max(SUBSCRIBE_MIN_BATCH, min(SUBSCRIBE_MAX_BATCH, batch_size))
+
+
 async def update_schedule_if_needed():
     """Основная функция проверки и обновления расписания"""
     try:
         async with aiohttp.ClientSession() as session:
-            token = await fetch_access_token(session)
-
-            schedule_info = await fetch_schedule_info(session, token)
+            schedule_info = await fetch_schedule_info(session)
             new_snapshot_id = schedule_info["snapshotId"]
             db_file_url = schedule_info["dbFileLink"]
 
@@ -194,11 +481,13 @@ async def update_schedule_if_needed():
 
             logger.info(f"Найдено обновление! Скачиваем snapshot {new_snapshot_id}")
 
-            await download_db_file(session, db_file_url)
+            downloaded = await download_db_file(session, db_file_url, new_snapshot_id)
             await update_snapshot_id(new_snapshot_id)
-            await update_subscriptions(token)
+            if downloaded:
+                await update_subscriptions()
 
             logger.info(f"Обновление завершено для snapshot {new_snapshot_id}")
 
     except Exception as e:
         logger.error(f"Критическая ошибка в основном процессе: {e}")
+        raise
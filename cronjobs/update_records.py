@@ -0,0 +1,139 @@
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Iterator
+
+from grpc import personal_schedule_pb2 as pb2
+from google.type import dayofweek_pb2
+
+
+# Записи об изменениях расписания.
+# Хранят только ссылку на protobuf-сообщение и читают поля по требованию:
+# повторяющиеся поля не копируются в списки, время не превращается в строки.
+
+
+@dataclass(frozen=True, slots=True)
+class LessonRecord:
+    """Занятие из диффа (ScheduleStateTimetableLesson или ScheduleStateLessonEvent)"""
+    message: Any
+
+    @property
+    def discipline(self) -> str:
+        return self.message.discipline
+
+    @property
+    def lesson_type(self) -> str | None:
+        lesson_type = self.message.lesson_type
+        if isinstance(lesson_type, str):
+            return lesson_type or None
+        return lesson_type.value if self.message.HasField("lesson_type") else None
+
+    @property
+    def groups(self):
+        return self.message.groups
+
+    @property
+    def teachers(self):
+        return self.message.teachers
+
+    @property
+    def auditoriums(self):
+        return self.message.auditoriums
+
+
+@dataclass(frozen=True, slots=True)
+class CellChange:
+    """Изменение одного занятия: предыдущая и текущая версии"""
+    message: Any
+
+    @property
+    def previous(self) -> LessonRecord | None:
+        return LessonRecord(self.message.previous) if self.message.HasField("previous") else None
+
+    @property
+    def current(self) -> LessonRecord | None:
+        return LessonRecord(self.message.current) if self.message.HasField("current") else None
+
+    @property
+    def change_type(self) -> str:
+        prev, curr = self.message.HasField("previous"), self.message.HasField("current")
+        if not prev and curr:
+            return "ADDED"
+        if prev and not curr:
+            return "REMOVED"
+        if prev and curr:
+            return "MODIFIED"
+        return "UNKNOWN"
+
+
+@dataclass(frozen=True, slots=True)
+class TimetableChange:
+    """Изменения в повторяющихся занятиях одного слота (TimetableScheduleDiff)"""
+    message: Any
+
+    @property
+    def day_of_week(self) -> str:
+        return dayofweek_pb2.DayOfWeek.Name(self.message.time_slot.day_of_week)
+
+    @property
+    def number_in_day(self) -> int:
+        return self.message.time_slot.number_in_day
+
+    @property
+    def week_parity(self) -> str:
+        return pb2.WeekParity.Name(self.message.time_slot.week_parity)
+
+    @property
+    def cells(self) -> Iterator[CellChange]:
+        return (CellChange(cell) for cell in self.message.cells)
+
+
+@dataclass(frozen=True, slots=True)
+class EventChange(CellChange):
+    """Изменение уникального занятия (элемент EventDiff.diff) вместе с его временем"""
+    time_slot: Any
+
+    @property
+    def start_time(self) -> datetime | None:
+        return self.time_slot.start.ToDatetime() if self.time_slot.HasField("start") else None
+
+    @property
+    def end_time(self) -> datetime | None:
+        return self.time_slot.end.ToDatetime() if self.time_slot.HasField("end") else None
+
+
+@dataclass(frozen=True, slots=True)
+class ScheduleUpdate:
+    """Обновление одного расписания. diff — GetPersonalScheduleUpdatesResponseExists или None"""
+    type: str
+    id: int
+    title: str
+    snapshot_id: str
+    diff: Any = None
+
+    @property
+    def previous_time(self) -> datetime | None:
+        if self.diff is None or not self.diff.HasField("previous_time"):
+            return None
+        return self.diff.previous_time.ToDatetime()
+
+    @property
+    def current_time(self) -> datetime | None:
+        if self.diff is None or not self.diff.HasField("current_time"):
+            return None
+        return self.diff.current_time.ToDatetime()
+
+    @property
+    def has_changes(self) -> bool:
+        return self.diff is not None and bool(len(self.diff.timetable_diff) or len(self.diff.event_diff))
+
+    @property
+    def timetable_changes(self) -> Iterator[TimetableChange]:
+        if self.diff is None:
+            return iter(())
+        return (TimetableChange(td) for td in self.diff.timetable_diff)
+
+    @property
+    def event_changes(self) -> Iterator[EventChange]:
+        if self.diff is None:
+            return iter(())
+        return (EventChange(d, ed.time_slot) for ed in self.diff.event_diff for d in ed.diff)
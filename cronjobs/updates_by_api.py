@@ -1,152 +1,231 @@
 import os
+import time
+import random
+import asyncio
 import logging
-import aiohttp
-from typing import List, Dict, Any
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import List
 from sqlalchemy import text
 
 from db.db_operations import get_db_session
-from grpc.schedule_client import ScheduleWebClient
+from grpc.schedule_client import ScheduleWebClient, schedule_upstream
 from grpc import personal_schedule_pb2 as pb2
-from google.type import dayofweek_pb2
+from cronjobs.update_records import ScheduleUpdate, TimetableChange, EventChange, LessonRecord
 from utils.messaging import send_message, split_long_message
+from utils.auth import token_provider
+from utils.resilience import CircuitOpenError
 
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
-TOKEN_URL = os.getenv("TOKEN_URL")
-CLIENT_ID = os.getenv("CLIENT_ID")
-CLIENT_SECRET = os.getenv("CLIENT_SECRET")
-SCHEDULE_URL = os.getenv("SCHEDULE_URL")
-
-TOKEN_DATA = {
-    "grant_type": "client_credentials",
-    "scope": "openid",
-    "client_id": CLIENT_ID,
-    "client_secret": CLIENT_SECRET,
-}
-
-
-async def fetch_access_token(session: aiohttp.ClientSession) -> str:
-    async with session.post(TOKEN_URL, data=TOKEN_DATA) as resp:
-        resp.raise_for_status()
-        data = await resp.json()
-        return data["access_token"]
-
-
-async def get_structured_updates() -> List[Dict[str, Any]]:
-    async with aiohttp.ClientSession() as session:
-        token = await fetch_access_token(session)
-        async with ScheduleWebClient(token) as client:
-            schedules = await client.get_subscribed_schedules()
-            updates = []
-
-            for schedule in schedules.schedules:
-                try:
-                    updates_response = await client.get_personal_schedule_updates(schedule.schedule_id)
-                    if not updates_response.HasField("exists"):
-                        continue
-
-                    diff = updates_response.exists
-                    record = {
-                        "type": pb2.ScheduleType.Name(schedule.schedule_id.schedule_type),
-                        "id": schedule.schedule_id.schedule_id,
-                        "title": schedule.long_title,
-                        "snapshot_id": diff.snapshot_id,
-                        "previous_time": _safe_time(diff, "previous_time"),
-                        "current_time": _safe_time(diff, "current_time"),
-                        "timetable_changes": [_parse_timetable_diff(td) for td in diff.timetable_diff],
-                        "event_changes": [_parse_event_diff(ed) for ed in diff.event_diff],
-                    }
-                    updates.append(record)
-                except Exception as e:
-                    logger.exception(f"Ошибка при проверке обновлений для {schedule.long_title}: {e}")
-            return updates
-
-
-def _safe_time(diff, field):
-    if diff.HasField(field):
-        return getattr(diff, field).ToDatetime().isoformat()
-    return None
-
-
-def _parse_timetable_diff(diff):
-    slot = diff.time_slot
-    return {
-        "time_slot": {
-            "day_of_week": dayofweek_pb2.DayOfWeek.Name(slot.day_of_week),
-            "number_in_day": slot.number_in_day,
-            "week_parity": pb2.WeekParity.Name(slot.week_parity),
-        },
-        "cells": [
-            {k: _extract_lesson_data(getattr(c, k)) for k in ("previous", "current") if c.HasField(k)}
-            for c in diff.cells
-        ],
-    }
+UPDATES_CONCURRENCY = int(os.getenv("UPDATES_CONCURRENCY", "20"))
+UPDATES_REQUEST_TIMEOUT = float(os.getenv("UPDATES_REQUEST_TIMEOUT", "15"))
 
+# Сколько расписаний без подписчиков опросить, чтобы узнать snapshot_id, если диффов нет
+SNAPSHOT_PROBE_ATTEMPTS = int(os.getenv("SNAPSHOT_PROBE_ATTEMPTS", "3"))
 
-def _parse_event_diff(event_diff):
-    slot = event_diff.time_slot
-    changes = []
-    for d in event_diff.diff:
-        changes.append({
-            "start_time": slot.start.ToDatetime().isoformat() if slot.HasField("start") else None,
-            "end_time": slot.end.ToDatetime().isoformat() if slot.HasField("end") else None,
-            "previous": _extract_event_data(d.previous) if d.HasField("previous") else None,
-            "current": _extract_event_data(d.current) if d.HasField("current") else None,
-            "change_type": _determine_event_change_type(d),
-        })
-    return changes
-
-
-def _extract_lesson_data(lesson):
-    if not lesson:
-        return None
-    return {
-        "discipline": lesson.discipline,
-        "lesson_type": lesson.lesson_type.value if lesson.HasField("lesson_type") else None,
-        "groups": list(lesson.groups),
-        "teachers": list(lesson.teachers),
-        "auditoriums": list(lesson.auditoriums),
-        "begin_time": lesson.begin_time,
-        "end_time": lesson.end_time,
-        "time_details": _extract_time_details(lesson),
-    }
+ACCEPT_CONCURRENCY = int(os.getenv("ACCEPT_CONCURRENCY", "10"))
+ACCEPT_RETRIES = int(os.getenv("ACCEPT_RETRIES", "3"))
+ACCEPT_RETRY_DELAY = float(os.getenv("ACCEPT_RETRY_DELAY", "1"))
+ACCEPT_STATUS_OK = pb2.AcceptScheduleUpdatesResponse.ACCEPT_SCHEDULE_UPDATES_RESPONSE_STATUS_OK
 
+# Тип подписки в max_subscribes -> тип расписания в API
+SUBSCRIPTION_SCHEDULE_TYPES = {
+    "teacher": "SCHEDULE_TYPE_TEACHER",
+    "group": "SCHEDULE_TYPE_GROUP",
+    "place": "SCHEDULE_TYPE_AUDITORIUM",
+}
 
-def _extract_time_details(lesson):
-    if not lesson.HasField("time_details"):
-        return None
-    td = lesson.time_details
-    return {"weeks_include": list(td.weeks_include), "weeks_exclude": list(td.weeks_exclude)}
 
+async def get_structured_updates() -> List[ScheduleUpdate]:
+    """
+    Собирает обновления расписаний.
+    Диффы запрашиваются только для обновлённых расписаний, на которые подписан хотя бы один чат.
+    Остальные обновлённые расписания возвращаются без изменений — только для принятия обновлений.
+    """
+    async with ScheduleWebClient(token_provider) as client:
+        schedules = await client.get_subscribed_schedules()
+        followed = await get_followed_schedules()
+
+        updated = [s for s in schedules.schedules if s.is_updated]
+        to_fetch = [s for s in updated if _schedule_key(s) in followed]
+        to_accept = [s for s in updated if _schedule_key(s) not in followed]
+        logger.info(
+            f"Расписаний в подписке API: {len(schedules.schedules)}, обновлённых: {len(updated)}, "
+            f"с подписчиками: {len(to_fetch)}, только принять: {len(to_accept)}"
+        )
 
-def _extract_event_data(event):
-    if not event:
+        semaphore = asyncio.Semaphore(UPDATES_CONCURRENCY)
+        stats = {"rpc": 0, "errors": 0, "timeouts": 0, "rejected": 0}
+        started = time.monotonic()
+
+        # gather сохраняет порядок результатов в порядке расписаний
+        results = await asyncio.gather(*(
+            _fetch_schedule_update(client, schedule, semaphore, stats)
+            for schedule in to_fetch
+        ))
+        updates = [record for record in results if record is not None]
+
+        _log_polling_stats(stats, len(updates), time.monotonic() - started)
+
+        if to_accept:
+            snapshot_id = await _resolve_current_snapshot_id(client, updates, to_accept, semaphore, stats)
+            if snapshot_id:
+                updates.extend(_accept_only_record(schedule, snapshot_id) for schedule in to_accept)
+            else:
+                logger.warning(f"Не удалось получить snapshot_id, принятие {len(to_accept)} расписаний "
+                               f"без подписчиков отложено до следующего запуска")
+
+        return updates
+
+
+async def get_followed_schedules() -> set[tuple[str, int]]:
+    """Возвращает множество (тип расписания, id), на которые подписан хотя бы один чат"""
+    followed = set()
+    for subs in await get_all_subscriptions():
+        for sub_type, schedule_type in SUBSCRIPTION_SCHEDULE_TYPES.items():
+            followed.update((schedule_type, sid) for sid in subs[sub_type])
+    return followed
+
+
+def _schedule_key(schedule) -> tuple[str, int]:
+    return pb2.ScheduleType.Name(schedule.schedule_id.schedule_type), schedule.schedule_id.schedule_id
+
+
+async def _resolve_current_snapshot_id(client: ScheduleWebClient, updates: List[ScheduleUpdate], to_accept: list,
+                                      semaphore: asyncio.Semaphore, stats: dict) -> str:
+    """
+    Определяет актуальный snapshot_id для принятия обновлений без запроса диффа.
+    Берётся самый частый snapshot_id из полученных диффов. Если диффов нет, запрашивается дифф
+    одного из принимаемых расписаний (до SNAPSHOT_PROBE_ATTEMPTS попыток). Пустая строка — snapshot_id
+    получить не удалось, принимать обновления наугад нельзя.
+    """
+    snapshot_ids = Counter(upd.snapshot_id for upd in updates if upd.snapshot_id)
+    if snapshot_ids:
+        return snapshot_ids.most_common(1)[0][0]
+
+    for schedule in to_accept[:SNAPSHOT_PROBE_ATTEMPTS]:
+        probe = await _fetch_schedule_update(client, schedule, semaphore, stats)
+        if probe is not None and probe.snapshot_id:
+            return probe.snapshot_id
+    return ""
+
+
+def _accept_only_record(schedule, snapshot_id: str) -> ScheduleUpdate:
+    """Запись обновления без изменений: рассылать нечего, нужно только принять обновление"""
+    schedule_type, schedule_id = _schedule_key(schedule)
+    return ScheduleUpdate(schedule_type, schedule_id, schedule.long_title, snapshot_id)
+
+
+async def _fetch_schedule_update(client: ScheduleWebClient, schedule, semaphore: asyncio.Semaphore,
+                                 stats: dict) -> ScheduleUpdate | None:
+    """Запрашивает обновления одного расписания с ограничением параллельности и таймаутом"""
+    async with semaphore:
+        stats["rpc"] += 1
+        try:
+            updates_response = await asyncio.wait_for(
+                client.get_personal_schedule_updates(schedule.schedule_id),
+                timeout=UPDATES_REQUEST_TIMEOUT,
+            )
+        except asyncio.TimeoutError:
+            stats["timeouts"] += 1
+            logger.warning(f"Таймаут при проверке обновлений для {schedule.long_title}")
+            return None
+        except CircuitOpenError:
+            # Сервис недоступен — расписание будет проверено при следующем запуске
+            stats["rejected"] += 1
+            return None
+        except Exception as e:
+            stats["errors"] += 1
+            logger.exception(f"Ошибка при проверке обновлений для {schedule.long_title}: {e}")
+            return None
+
+    if not updates_response.HasField("exists"):
         return None
-    return {
-        "discipline": event.discipline,
-        "lesson_type": event.lesson_type,
-        "groups": list(event.groups),
-        "teachers": list(event.teachers),
-        "auditoriums": list(event.auditoriums),
-    }
-
 
-def _determine_event_change_type(diff_element):
-    prev, curr = diff_element.HasField("previous"), diff_element.HasField("current")
-    if not prev and curr:
-        return "ADDED"
-    if prev and not curr:
-        return "REMOVED"
-    if prev and curr:
-        return "MODIFIED"
-    return "UNKNOWN"
+    schedule_type, schedule_id = _schedule_key(schedule)
+    diff = updates_response.exists
+    return ScheduleUpdate(schedule_type, schedule_id, schedule.long_title, diff.snapshot_id, diff)
+
+
+def _log_polling_stats(stats: dict, updates_count: int, elapsed: float):
+    """Логирует статистику прогона опроса обновлений"""
+    failed = stats["errors"] + stats["timeouts"]
+    error_rate = failed / stats["rpc"] * 100 if stats["rpc"] else 0.0
+    rps = stats["rpc"] / elapsed if elapsed > 0 else 0.0
+    logger.info(
+        f"Опрос обновлений: RPC={stats['rpc']}, обновлений={updates_count}, "
+        f"ошибок={stats['errors']}, таймаутов={stats['timeouts']} ({error_rate:.1f}%), "
+        f"отклонено автоматом={stats['rejected']}, "
+        f"время={elapsed:.2f} с ({rps:.1f} RPC/с), параллельность={UPDATES_CONCURRENCY}"
+    )
+    logger.info(f"Upstream {schedule_upstream.describe()}")
+
+
+# === Принятие обновлений ===
+async def accept_updates_bulk(client: ScheduleWebClient, updates: List[ScheduleUpdate]) -> List[ScheduleUpdate]:
+    """
+    Принимает обновления параллельно (не более ACCEPT_CONCURRENCY запросов одновременно)
+    с повторами и экспоненциальной задержкой. Принятые snapshot_id сохраняются в PostgreSQL.
+    Возвращает список принятых обновлений.
+    """
+    pending = [upd for upd in updates if upd.snapshot_id]
+    if not pending:
+        return []
+
+    semaphore = asyncio.Semaphore(ACCEPT_CONCURRENCY)
+    started = time.monotonic()
+    results = await asyncio.gather(*(_accept_with_retry(client, upd, semaphore) for upd in pending))
+    accepted = [upd for upd, ok in zip(pending, results) if ok]
+
+    try:
+        await mark_updates_accepted(accepted)
+    except Exception as e:
+        # Обновления уже приняты в API и больше не придут; теряется только отметка в БД
+        logger.error(f"Не удалось сохранить принятые snapshot_id: {e}")
+    logger.info(
+        f"Принято обновлений: {len(accepted)}/{len(pending)} за {time.monotonic() - started:.2f} с"
+    )
+    return accepted
+
+
+async def _accept_with_retry(client: ScheduleWebClient, upd: ScheduleUpdate, semaphore: asyncio.Semaphore) -> bool:
+    schedule_id_msg = pb2.ScheduleId(
+        schedule_type=pb2.ScheduleType.Value(upd.type),
+        schedule_id=upd.id
+    )
+
+    for attempt in range(1, ACCEPT_RETRIES + 1):
+        try:
+            async with semaphore:
+                response = await asyncio.wait_for(
+                    client.accept_schedule_updates(schedule_id=schedule_id_msg, snapshot_id=upd.snapshot_id),
+                    timeout=UPDATES_REQUEST_TIMEOUT,
+                )
+            if response.status == ACCEPT_STATUS_OK:
+                return True
+            raise RuntimeError(f"AcceptScheduleUpdates вернул статус {response.status}")
+        except CircuitOpenError as e:
+            # Повторы только добавили бы нагрузки; обновление останется непринятым до следующего запуска
+            logger.warning(f"Обновление для {upd.title} не принято: {e}")
+            return False
+        except Exception as e:
+            if attempt == ACCEPT_RETRIES:
+                logger.warning(f"Не удалось принять обновление для {upd.title} после {attempt} попыток: {e!r}")
+                return False
+
+            delay = ACCEPT_RETRY_DELAY * 2 ** (attempt - 1) + random.uniform(0, ACCEPT_RETRY_DELAY)
+            logger.info(f"Повтор принятия обновления для {upd.title} через {delay:.1f} с ({attempt}: {e!r})")
+            await asyncio.sleep(delay)
+
+    return False
 
 
 # === Работа с БД ===
 async def get_all_subscriptions() -> list[dict]:
-    async with get_db_session() as session:
+    async with get_db_session(reraise=True) as session:
         result = await session.execute(
             text("SELECT chat_id, teacher_ids, group_ids, auditorium_ids FROM max_subscribes")
         )
@@ -166,25 +245,63 @@ def _split_ids(raw):
     return [int(x) for x in (raw or "").split(",") if x.isdigit()]
 
 
+async def get_sent_snapshot_ids() -> dict[tuple[str, int], str]:
+    """
+    Возвращает {(тип расписания, id): snapshot_id}, изменения по которым уже разосланы.
+    При ошибке БД — пустой словарь: лучше повторно разослать изменения, чем не разослать их вовсе.
+    """
+    try:
+        async with get_db_session(reraise=True) as session:
+            result = await session.execute(text(
+                "SELECT schedule_type, schedule_id, sent_snapshot_id FROM schedule_update_state "
+                "WHERE sent_snapshot_id IS NOT NULL"
+            ))
+            return {(row["schedule_type"], row["schedule_id"]): row["sent_snapshot_id"] for row in result.mappings()}
+    except Exception as e:
+        logger.error(f"Не удалось прочитать разосланные обновления из schedule_update_state: {e}")
+        return {}
+
+
+async def mark_updates_sent(updates: list[ScheduleUpdate]):
+    """Запоминает snapshot_id разосланных изменений, чтобы не отправлять их повторно. Ошибку БД пробрасывает"""
+    await _save_snapshot_ids("sent_snapshot_id", updates)
+
+
+async def mark_updates_accepted(updates: list[ScheduleUpdate]):
+    """Запоминает snapshot_id принятых обновлений"""
+    await _save_snapshot_ids("accepted_snapshot_id", updates)
+
+
+async def _save_snapshot_ids(column: str, updates: list[ScheduleUpdate]):
+    params = [
+        {"schedule_type": upd.type, "schedule_id": upd.id, "snapshot_id": upd.snapshot_id}
+        for upd in updates if upd.snapshot_id
+    ]
+    if not params:
+        return
+
+    async with get_db_session(reraise=True) as session:
+        await session.execute(text(f"""
+            INSERT INTO schedule_update_state (schedule_type, schedule_id, {column})
+            VALUES (:schedule_type, :schedule_id, :snapshot_id)
+            ON CONFLICT (schedule_type, schedule_id) DO UPDATE SET {column} = EXCLUDED.{column}
+        """), params)
+
+
 # === Фильтрация изменений ===
-def find_relevant_changes_for_chat(changes: list[dict], subs: dict) -> list[dict]:
-    mapping = {
-        "SCHEDULE_TYPE_TEACHER": subs["teacher"],
-        "SCHEDULE_TYPE_GROUP": subs["group"],
-        "SCHEDULE_TYPE_PLACE": subs["place"],
-    }
-    return [ch for ch in changes if ch["id"] in mapping.get(ch["type"], [])]
+def find_relevant_changes_for_chat(changes: list[ScheduleUpdate], subs: dict) -> list[ScheduleUpdate]:
+    mapping = {schedule_type: subs[sub_type] for sub_type, schedule_type in SUBSCRIPTION_SCHEDULE_TYPES.items()}
+    return [ch for ch in changes if ch.id in mapping.get(ch.type, []) and ch.has_changes]
 
 
 # === Форматирование ===
-def _format_timetable_change(t: dict) -> str:
-    time_slot = t["time_slot"]
-    num = time_slot["number_in_day"]
-    parity = _format_week_parity(time_slot["week_parity"])
+def _format_timetable_change(t: TimetableChange) -> str:
+    num = t.number_in_day
+    parity = _format_week_parity(t.week_parity)
 
     lines = [f"<b>{num} пара ({parity})</b>"]
-    for cell in t["cells"]:
-        prev, curr = cell.get("previous"), cell.get("current")
+    for cell in t.cells:
+        prev, curr = cell.previous, cell.current
 
         if curr and not prev:
             lines.append("<b>➕ Добавлено:</b>")
@@ -201,6 +318,32 @@ def _format_timetable_change(t: dict) -> str:
     return "\n".join(lines)
 
 
+def _format_event_change(event: EventChange) -> str:
+    start = _format_event_time(event.start_time)
+    end = _format_event_time(event.end_time)
+    when = f"{start}-{end[-5:]}" if start and end else start or end or "время не указано"
+
+    lines = [f"<b>{when}</b>"]
+    change_type = event.change_type
+    if change_type == "ADDED":
+        lines.append("<b>➕ Добавлено:</b>")
+        lines.append(_format_lesson_details(event.current))
+    elif change_type == "REMOVED":
+        lines.append("<b>➖ Убрано:</b>")
+        lines.append(_format_lesson_details(event.previous))
+    elif change_type == "MODIFIED":
+        lines.append("<b>✏️ Изменено:</b>")
+        lines.append(_format_lesson_details(event.current))
+
+    return "\n".join(lines)
+
+
+def _format_event_time(value: datetime | None) -> str | None:
+    if not value:
+        return None
+    return (value + timedelta(hours=3)).strftime("%d.%m %H:%M")
+
+
 def _format_week_parity(week_parity: str) -> str:
     mapping = {
         "WEEK_PARITY_EVEN": "чётная неделя",
@@ -211,17 +354,17 @@ def _format_week_parity(week_parity: str) -> str:
     return mapping.get(week_parity, "неизвестно")
 
 
-def _format_lesson_details(lesson: dict) -> str:
+def _format_lesson_details(lesson: LessonRecord) -> str:
     lines = []
-    if lesson.get("discipline"):
-        lt = f" ({lesson['lesson_type']})" if lesson.get("lesson_type") else ""
-        lines.append(f"📚 {lesson['discipline']}{lt}")
-    if lesson.get("groups"):
-        lines.append(f"👥 Группа: {', '.join(lesson['groups'])}")
-    if lesson.get("teachers"):
-        lines.append(f"👨‍🏫 {', '.join(lesson['teachers'])}")
-    if lesson.get("auditoriums"):
-        lines.append(f"🏫 {', '.join(lesson['auditoriums'])}")
+    if lesson.discipline:
+        lt = f" ({lesson.lesson_type})" if lesson.lesson_type else ""
+        lines.append(f"📚 {lesson.discipline}{lt}")
+    if lesson.groups:
+        lines.append(f"👥 Группа: {', '.join(lesson.groups)}")
+    if lesson.teachers:
+        lines.append(f"👨‍🏫 {', '.join(lesson.teachers)}")
+    if lesson.auditoriums:
+        lines.append(f"🏫 {', '.join(lesson.auditoriums)}")
     return "\n".join(lines)
 
 
@@ -238,6 +381,32 @@ def get_russian_day(day: str) -> str:
     return mapping.get(day, day)
 
 
+def format_updates_for_chat(changes: list[ScheduleUpdate]) -> list[str]:
+    """Формирует строки уведомления об изменениях для одного чата"""
+    lines = []
+    for upd in changes:
+        lines.append(f"🔔 <b>Изменения в расписании: {upd.title}</b>")
+        for t in upd.timetable_changes:
+            lines.append(f"📅 {get_russian_day(t.day_of_week)}")
+            lines.append(_format_timetable_change(t))
+        for event in upd.event_changes:
+            lines.append(_format_event_change(event))
+        lines.append("")
+    return lines
+
+
+async def send_updates_to_subscribers(updates: list[ScheduleUpdate]):
+    """Рассылает изменения всем чатам, подписанным на изменившиеся расписания"""
+    for subs in await get_all_subscriptions():
+        relevant = find_relevant_changes_for_chat(updates, subs)
+        if not relevant:
+            continue
+        try:
+            await send_updates_to_chat(subs["peer_id"], format_updates_for_chat(relevant))
+        except Exception as e:
+            logger.exception(f"Ошибка при отправке обновлений в чат {subs['peer_id']}: {e}")
+
+
 async def send_updates_to_chat(chat_id: int, lines: list[str]):
     """Отправка обновлений чата в несколько сообщений, если нужно."""
     text = "\n".join(l for l in lines if l.strip())
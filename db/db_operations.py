@@ -1,3 +1,4 @@
+import re
 import sqlite3
 from typing import List, Dict
 import logging
@@ -10,6 +11,8 @@ from datetime import timedelta
 from sqlalchemy.exc import SQLAlchemyError
 
 from db.db_tables import MaxSubscribe
+from db.snapshot_store import current_db_path
+from utils.metrics import Counter, Histogram, timed
 
 from maxapi.enums.parse_mode import ParseMode
 
@@ -21,8 +24,6 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-DB_PATH = os.getenv("SQLITE_PATH")
-
 url = URL.create(
     drivername=os.getenv("DB_DRIVER"),
     host=os.getenv("DB_HOST"),
@@ -46,18 +47,40 @@ async_session_maker = async_sessionmaker(
     autoflush=False
 )
 
+# Тип подписки -> таблица связи с занятиями и колонка id
+SUBSCRIPTION_LINKS = {
+    "teacher": ("lesson_teacher", "teacher_id"),
+    "group": ("lesson_academic_group", "academic_group_id"),
+    "place": ("lesson_place", "place_id"),
+}
+
+# Тип подписки -> таблица сущности и колонка с названием
+ENTITY_TITLES = {
+    "teacher": ("teacher", "name"),
+    "group": ("academic_group", "title"),
+    "place": ("place", "title"),
+}
+
+sqlite_query_seconds = Histogram("bot_sqlite_query_seconds", "Время запросов к SQLite-снапшоту", ["query"])
+postgres_query_seconds = Histogram("bot_postgres_query_seconds", "Время запросов к PostgreSQL", ["query"])
+postgres_errors_total = Counter("bot_postgres_errors_total", "Сессии PostgreSQL, откатанные из-за ошибки")
+render_seconds = Histogram("bot_schedule_render_seconds", "Время сборки текста расписания")
+
 WEEKDAYS = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье"]
 
 
 @asynccontextmanager
-async def get_db_session():
-    """Контекстный менеджер для получения сессии"""
+async def get_db_session(reraise: bool = False):
+    """Контекстный менеджер для получения сессии. С reraise=True ошибка после отката пробрасывается дальше"""
     async with async_session_maker() as session:
         try:
             yield session
             await session.commit()
         except Exception:
+            postgres_errors_total.inc()
             await session.rollback()
+            if reraise:
+                raise
         finally:
             await session.close()
 
@@ -83,8 +106,11 @@ def merge_duplicate_lessons(lessons: list) -> list:
 
 
 async def send_schedule_message(callback_or_message, lessons, title: str, schedule_type):
-    lessons = merge_duplicate_lessons(lessons)
+    await send_rendered_schedule(callback_or_message, render_schedule(lessons, title, schedule_type), title)
+
 
+async def send_rendered_schedule(callback_or_message, text: str | None, title: str):
+    """Отправляет текст render_schedule; None — занятий нет"""
     if hasattr(callback_or_message, "data"):  # MessageCallback
         callback = callback_or_message
         message = callback.message
@@ -92,12 +118,20 @@ async def send_schedule_message(callback_or_message, lessons, title: str, schedu
         callback = None
         message = callback_or_message.message
 
+    if text is None:
+        await message.answer(f"✅ {title}: нет занятий!")
+    else:
+        await message.answer(text, parse_mode=ParseMode.HTML)
+    if callback:
+        await callback.answer()
+
+
+@timed(render_seconds)
+def render_schedule(lessons, title: str, schedule_type) -> str | None:
+    """HTML-текст расписания по занятиям в формате get_lessons. None, если занятий нет"""
+    lessons = merge_duplicate_lessons(lessons)
     if not lessons:
-        text = f"✅ {title}: нет занятий!"
-        await message.answer(text)
-        if callback:
-            await callback.answer()
-        return
+        return None
 
     if not schedule_type:
         first = lessons[0]
@@ -158,12 +192,11 @@ async def send_schedule_message(callback_or_message, lessons, title: str, schedu
                 text += f"👥 {', '.join(groups)}\n"
             text += "\n"
 
-    await message.answer(text.strip(), parse_mode=ParseMode.HTML)
-    if callback:
-        await callback.answer()
+    return text.strip()
 
 
 
+@timed(sqlite_query_seconds, query="get_lessons")
 def get_lessons(
     db_path: str,
     teacher_id: int = None,
@@ -225,23 +258,121 @@ def get_lessons(
     rows = cursor.fetchall()
     conn.close()
 
-    lessons = []
-    for row in rows:
-        lessons.append({
-            "lesson_id": row[0],
-            "start": row[1],
-            "end": row[2],
-            "discipline": row[3],
-            "lesson_type": row[4],
-            "teacher": row[5] or "Не указан",
-            "group_name": row[6] or "Не указана",
-            "place_name": row[7] or "Не указано",
-            "campus": row[8] or "Не указан",
-        })
-    return lessons
+    return [_lesson_from_row(row) for row in rows]
+
+
+def _lesson_from_row(row) -> Dict:
+    return {
+        "lesson_id": row[0],
+        "start": row[1],
+        "end": row[2],
+        "discipline": row[3],
+        "lesson_type": row[4],
+        "teacher": row[5] or "Не указан",
+        "group_name": row[6] or "Не указана",
+        "place_name": row[7] or "Не указано",
+        "campus": row[8] or "Не указан",
+    }
+
 
+def _fold_title(title: str) -> str:
+    return (title or "").lower().replace("ё", "е")
 
 
+@timed(sqlite_query_seconds, query="search_lessons_by_discipline")
+def search_lessons_by_discipline(
+    db_path: str,
+    query: str,
+    start_ts: int = None,
+    end_ts: int = None,
+    subscriptions: dict = None,
+    limit: int = 20
+) -> List[Dict]:
+    """
+    Ищет занятия по названию дисциплины (полнотекстовый поиск FTS5 по префиксам слов).
+    subscriptions — {'group': [...], 'teacher': [...], 'place': [...]}: только занятия этих расписаний.
+    Возвращает не больше limit занятий в формате get_lessons.
+    Если в снапшоте нет индекса discipline_fts, ищет через LIKE.
+    """
+    words = re.findall(r"\w+", _fold_title(query))
+    if not words:
+        return []
+
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+
+    has_fts = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'discipline_fts'"
+    ).fetchone()
+    if has_fts:
+        disciplines = "SELECT rowid FROM discipline_fts WHERE discipline_fts MATCH ?"
+        params = [" ".join(f'"{word}"*' for word in words)]
+    else:
+        # Встроенные LIKE и lower() в SQLite не понимают регистр кириллицы
+        conn.create_function("fold_title", 1, _fold_title, deterministic=True)
+        disciplines = "SELECT id FROM discipline WHERE " + " AND ".join("fold_title(title) LIKE ?" for _ in words)
+        params = [f"%{word}%" for word in words]
+
+    filters = ""
+    if start_ts is not None:
+        filters += " AND l.start >= ?"
+        params.append(start_ts)
+    if end_ts is not None:
+        filters += " AND l.end <= ?"
+        params.append(end_ts)
+
+    if subscriptions:
+        scopes = []
+        for stype, (table, column) in SUBSCRIPTION_LINKS.items():
+            ids = subscriptions.get(stype) or []
+            if ids:
+                placeholders = ", ".join("?" * len(ids))
+                scopes.append(f"l.id IN (SELECT lesson_id FROM {table} WHERE {column} IN ({placeholders}))")
+                params.extend(ids)
+        if not scopes:
+            conn.close()
+            return []
+        filters += f" AND ({' OR '.join(scopes)})"
+
+    params.append(limit)
+
+    cursor.execute(f"""
+    WITH found AS (
+        SELECT l.id FROM lesson l
+        WHERE l.discipline_id IN ({disciplines}){filters}
+        ORDER BY l.start
+        LIMIT ?
+    )
+    SELECT
+        l.id AS lesson_id,
+        l.start,
+        l.end,
+        d.title AS discipline,
+        lt.title AS lesson_type,
+        t.name AS teacher,
+        ag.title AS group_name,
+        p.title AS place_name,
+        p.campus
+    FROM found
+    JOIN lesson l ON l.id = found.id
+    JOIN discipline d ON l.discipline_id = d.id
+    JOIN lesson_type lt ON l.lesson_type_id = lt.id
+    LEFT JOIN lesson_teacher ltch ON l.id = ltch.lesson_id
+    LEFT JOIN teacher t ON ltch.teacher_id = t.id
+    LEFT JOIN lesson_academic_group lag ON l.id = lag.lesson_id
+    LEFT JOIN academic_group ag ON lag.academic_group_id = ag.id
+    LEFT JOIN lesson_place lp ON l.id = lp.lesson_id
+    LEFT JOIN place p ON lp.place_id = p.id
+    ORDER BY l.start
+    """, tuple(params))
+    rows = cursor.fetchall()
+    conn.close()
+
+    return [_lesson_from_row(row) for row in rows]
+
+
+
+@timed(postgres_query_seconds, query="get_user_subscriptions")
 async def get_user_subscriptions(chat_id: int) -> dict:
     """Возвращает словарь { 'group': [...], 'teacher': [...], 'place': [...] }"""
     async with get_db_session() as session:
@@ -261,6 +392,7 @@ async def get_user_subscriptions(chat_id: int) -> dict:
         }
 
 
+@timed(sqlite_query_seconds, query="get_entity_name_by_type")
 async def get_entity_name_by_type(db_path: str, sub_type: str, entity_id: int) -> str:
     """Получает название сущности по ID и типу"""
     conn = sqlite3.connect(db_path)
@@ -286,6 +418,33 @@ async def get_entity_name_by_type(db_path: str, sub_type: str, entity_id: int) -
     return result[0] if result else f"Неизвестно (ID {entity_id})"
 
 
+@timed(sqlite_query_seconds, query="get_entity_names")
+def get_entity_names(db_path: str, subs: dict) -> dict:
+    """
+    Названия всех сущностей из subs ({'group': [...], 'teacher': [...], 'place': [...]}) за одно открытие SQLite:
+    по запросу на тип вместо запроса на каждую подписку.
+    Возвращает {тип: {id: (название, кампус)}}; кампус есть только у аудиторий.
+    """
+    names = {}
+    conn = sqlite3.connect(db_path)
+    try:
+        for sub_type, ids in subs.items():
+            if not ids or sub_type not in ENTITY_TITLES:
+                continue
+            table, field = ENTITY_TITLES[sub_type]
+            campus = "campus" if sub_type == "place" else "NULL"
+            placeholders = ", ".join("?" * len(ids))
+            rows = conn.execute(
+                f"SELECT id, {field}, {campus} FROM {table} WHERE id IN ({placeholders})", tuple(ids)
+            ).fetchall()
+            found = {row[0]: (row[1], row[2]) for row in rows}
+            names[sub_type] = {eid: found.get(eid, (f"Неизвестно (ID {eid})", None)) for eid in ids}
+    finally:
+        conn.close()
+    return names
+
+
+@timed(postgres_query_seconds, query="add_subscription")
 async def add_subscription(chat_id: int, sub_type: str, item_id: int):
     """Добавляет подписку пользователя в PostgreSQL."""
     async with get_db_session() as session:
@@ -320,6 +479,7 @@ async def add_subscription(chat_id: int, sub_type: str, item_id: int):
             logger.info(f"❌ Ошибка при добавлении подписки: {e}")
 
 
+@timed(postgres_query_seconds, query="remove_subscription")
 async def remove_subscription(chat_id: int, sub_type: str, item_id: int):
     """Удаляет подписку пользователя из PostgreSQL. Если подписок не осталось — удаляет всю запись."""
     async with get_db_session() as session:
@@ -363,8 +523,9 @@ async def remove_subscription(chat_id: int, sub_type: str, item_id: int):
 
 
 
+@timed(sqlite_query_seconds, query="find_entity_by_name")
 def find_entity_by_name(sub_type: str, name: str):
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(current_db_path())
     c = conn.cursor()
 
     if sub_type == "group":
@@ -392,11 +553,12 @@ def find_entity_by_name(sub_type: str, name: str):
     return results
 
 
+@timed(sqlite_query_seconds, query="get_campus_by_place_id")
 def get_campus_by_place_id(place_id: int) -> str | None:
     """
     Возвращает название кампуса по ID аудитории.
     """
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(current_db_path())
     c = conn.cursor()
 
     c.execute("SELECT campus FROM place WHERE id = ?", (place_id,))
@@ -406,6 +568,7 @@ def get_campus_by_place_id(place_id: int) -> str | None:
     return row[0] if row and row[0] else None
 
 
+@timed(postgres_query_seconds, query="update_everyday_notifications")
 async def update_everyday_notifications(chat_id: int, value: bool) -> bool:
     """
     Обновляет флаг ежедневных уведомлений у пользователя.
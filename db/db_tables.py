@@ -1,4 +1,5 @@
-from sqlalchemy import Column, BigInteger, Text, Boolean
+from sqlalchemy import Column, BigInteger, Text, Boolean, DateTime
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import declarative_base
 
 Base = declarative_base()
@@ -18,3 +19,28 @@ class SnapshotInfo(Base):
     __tablename__ = "snapshot_info"
 
     snapshot_id = Column(BigInteger, primary_key=True)
+
+
+class ScheduleUpdateState(Base):
+    __tablename__ = "schedule_update_state"
+
+    schedule_type = Column(Text, primary_key=True)
+    schedule_id = Column(BigInteger, primary_key=True)
+    sent_snapshot_id = Column(Text, nullable=True)
+    accepted_snapshot_id = Column(Text, nullable=True)
+
+
+class CronJobState(Base):
+    __tablename__ = "cron_job_state"
+
+    job_id = Column(Text, primary_key=True)
+    last_scheduled_run_time = Column(DateTime(timezone=True), nullable=False)
+
+
+class BotFsmState(Base):
+    __tablename__ = "bot_fsm_state"
+
+    namespace = Column(Text, primary_key=True)
+    chat_id = Column(BigInteger, primary_key=True)
+    state = Column(Text, nullable=True)
+    data = Column(JSONB, nullable=False, server_default="{}")
@@ -0,0 +1,129 @@
+"""
+Кэш занятий сущности по неделям: одна запись на (тип, id, понедельник недели) с занятиями по дням.
+
+«Сегодня», «завтра» и «неделя» отдаются срезами одной записи, «завтра» в воскресенье — из следующей недели.
+Записи относятся к одному поколению снапшота. При переключении поколения набор изменений нового снапшота
+(db/snapshot_diff) говорит, какие недели каких сущностей изменились: только они и удаляются,
+остальные переносятся в новое поколение. Если набора нет или он посчитан не от закэшированного поколения,
+кэш очищается целиком.
+"""
+import os
+import logging
+import threading
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import Dict, List
+
+from dotenv import load_dotenv
+
+from db.recurrence_store import get_entity_timetable
+from db.snapshot_diff import changes_path, load_change_set
+from db.snapshot_store import current_generation
+from utils.metrics import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Сколько недель (сущность × неделя) держать в памяти
+LESSON_CACHE_WEEKS = int(os.getenv("LESSON_CACHE_WEEKS", "4096"))
+
+WeekKey = tuple[str, int, date]
+
+week_cache_events_total = Counter("bot_week_cache_events_total", "События кэша недель", ["event"])
+week_cache_entries = Gauge("bot_week_cache_entries", "Недель в кэше")
+
+
+class WeekLessonCache:
+    def __init__(self, max_weeks: int = LESSON_CACHE_WEEKS):
+        self.max_weeks = max_weeks
+        self.generation: str | None = None
+        self._weeks: OrderedDict[WeekKey, tuple[list[Dict], ...]] = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "bypassed": 0, "evictions": 0, "invalidated": 0}
+        # Обработчики читают кэш из пула потоков (asyncio.to_thread)
+        self._lock = threading.Lock()
+
+    def lessons(self, db_path: str, sub_type: str, entity_id: int, date_start: date, date_end: date) -> List[Dict]:
+        """Занятия сущности с date_start по date_end включительно в формате get_lessons"""
+        generation = os.path.realpath(db_path)
+        with self._lock:
+            cached = generation == self.generation or self._switch(generation)
+
+        rows = []
+        monday = date_start - timedelta(days=date_start.weekday())
+        while monday <= date_end:
+            days = self._week(db_path, generation, sub_type, entity_id, monday, cached)
+            first = max(date_start, monday)
+            last = min(date_end, monday + timedelta(days=6))
+            for day in days[first.weekday():last.weekday() + 1]:
+                rows.extend(day)
+            monday += timedelta(weeks=1)
+        return rows
+
+    def _week(self, db_path: str, generation: str, sub_type: str, entity_id: int, monday: date,
+              cached: bool) -> tuple[list[Dict], ...]:
+        key = (sub_type, entity_id, monday)
+        if cached:
+            with self._lock:
+                days = self._weeks.get(key)
+                if days is not None:
+                    self.stats["hits"] += 1
+                    self._weeks.move_to_end(key)
+                    return days
+
+        # Неделя строится без блокировки: промахи по разным сущностям читают снапшот параллельно
+        timetable = get_entity_timetable(db_path, sub_type, entity_id)
+        days = tuple(
+            timetable.expand(day, day) if timetable else []
+            for day in (monday + timedelta(days=i) for i in range(7))
+        )
+
+        with self._lock:
+            if not cached or generation != self.generation:
+                # Запрос закреплён за устаревшим поколением или кэш переключился, пока неделя строилась:
+                # не смешиваем его занятия с текущими
+                self.stats["bypassed"] += 1
+                return days
+
+            self.stats["misses"] += 1
+            self._weeks[key] = days
+            while len(self._weeks) > self.max_weeks:
+                self._weeks.popitem(last=False)
+                self.stats["evictions"] += 1
+        return days
+
+    def _switch(self, generation: str) -> bool:
+        """
+        Переходит на новое поколение, если generation — текущее. Возвращает False для запросов,
+        закреплённых за старым поколением: они читают мимо кэша.
+        """
+        if generation != current_generation():
+            return False
+
+        previous, self.generation = self.generation, generation
+        if not self._weeks:
+            return True
+
+        _, base, change_set = load_change_set(changes_path(generation))
+        if previous is None or change_set is None or base != os.path.basename(previous):
+            logger.info(f"Кэш недель очищен при переходе на {os.path.basename(generation)}: "
+                        f"нет набора изменений от {os.path.basename(previous or '-')}")
+            self.stats["invalidated"] += len(self._weeks)
+            self._weeks.clear()
+            return True
+
+        stale = [
+            key for key in self._weeks
+            if key[2].isoformat() in change_set.get(key[0], {}).get(key[1], ())
+        ]
+        for key in stale:
+            del self._weeks[key]
+        self.stats["invalidated"] += len(stale)
+        logger.info(f"Кэш недель перенесён на {os.path.basename(generation)}: "
+                    f"сброшено {len(stale)}, сохранено {len(self._weeks)}")
+        return True
+
+
+week_cache = WeekLessonCache()
+week_cache_events_total.track_stats(week_cache.stats)
+week_cache_entries.track(lambda: len(week_cache._weeks))
@@ -0,0 +1,315 @@
+"""
+Компактное хранение расписания сущности (группы, преподавателя, аудитории) в виде повторяющихся занятий.
+
+В SQLite-снапшоте каждое занятие развёрнуто в отдельную строку на каждую дату. Здесь занятие хранится один раз:
+день недели, время начала и конца, состав (дисциплина, тип, преподаватели, группы, аудитории)
+и битовая маска недель, в которые оно проходит (бит n-1 — неделя n от начала семестра).
+Конкретные даты получаются только по запросу, ответ на любую неделю — проверка бита без сканирования диапазона.
+
+Заполняется из снапшота (timetable_from_snapshot) или из ответа GetWrappedSchedule (timetable_from_wrapped).
+"""
+import os
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta, timezone
+from sys import intern
+from typing import Dict, List
+
+from dotenv import load_dotenv
+
+from db.db_operations import ENTITY_TITLES, SUBSCRIPTION_LINKS, _lesson_from_row, sqlite_query_seconds
+from utils.metrics import timed
+from grpc import personal_schedule_pb2 as pb2
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Время в расписании — московское: begin_time/end_time в GetWrappedSchedule считаются от начала дня по Москве
+SCHEDULE_TZ = timezone(timedelta(hours=3))
+# Первый день семестра (YYYY-MM-DD) для номеров недель из GetWrappedSchedule.
+# Не задан — начало семестра берётся по самому раннему занятию снапшота; для снапшота берётся более ранняя из дат
+SEMESTER_START = os.getenv("SEMESTER_START")
+# Сколько недель в семестре, если у занятия указана только чётность без номеров недель
+SEMESTER_WEEKS = int(os.getenv("SEMESTER_WEEKS", "17"))
+# Сколько расписаний сущностей держать в памяти
+RECURRENCE_CACHE_SIZE = int(os.getenv("RECURRENCE_CACHE_SIZE", "512"))
+
+SCHEDULE_TYPES = {
+    pb2.SCHEDULE_TYPE_GROUP: "group",
+    pb2.SCHEDULE_TYPE_TEACHER: "teacher",
+    pb2.SCHEDULE_TYPE_AUDITORIUM: "place",
+}
+
+
+@dataclass(frozen=True, slots=True)
+class RecurringLesson:
+    weekday: int  # 0 — понедельник
+    begin: int  # минуты от начала дня
+    end: int
+    discipline: str
+    lesson_type: str
+    teachers: tuple[str, ...]
+    groups: tuple[str, ...]
+    places: tuple[tuple[str, str | None], ...]  # (аудитория, кампус)
+    weeks: int  # битовая маска: бит n-1 — занятие есть на неделе n
+
+    def week_numbers(self) -> list[int]:
+        return [n + 1 for n in range(self.weeks.bit_length()) if self.weeks >> n & 1]
+
+
+@dataclass(slots=True)
+class EntityTimetable:
+    sub_type: str
+    title: str
+    semester_start: date  # понедельник первой недели
+    lessons: list[RecurringLesson]
+
+    def week_number(self, day: date) -> int:
+        """Номер недели семестра (с 1), в которую попадает день; 0 и меньше — до начала семестра"""
+        return (day - self.semester_start).days // 7 + 1
+
+    def lessons_on(self, day: date) -> list[RecurringLesson]:
+        return [lesson for _, lesson in self._indexed_on(day)]
+
+    def expand(self, date_start: date, date_end: date) -> List[Dict]:
+        """Занятия с date_start по date_end включительно в формате get_lessons (строки для send_schedule_message)"""
+        rows = []
+        day = date_start
+        while day <= date_end:
+            for index, lesson in self._indexed_on(day):
+                rows.extend(self._rows((index, day.toordinal()), lesson, day))
+            day += timedelta(days=1)
+        return rows
+
+    def _indexed_on(self, day: date) -> list[tuple[int, RecurringLesson]]:
+        week = self.week_number(day)
+        if week < 1:
+            return []
+        bit = 1 << (week - 1)
+        weekday = day.weekday()
+        # lessons отсортированы по дню недели и времени начала
+        return [(i, lesson) for i, lesson in enumerate(self.lessons) if lesson.weekday == weekday and lesson.weeks & bit]
+
+    def _rows(self, lesson_id: tuple[int, int], lesson: RecurringLesson, day: date) -> list[Dict]:
+        midnight = datetime.combine(day, time(), tzinfo=SCHEDULE_TZ)
+        start = int((midnight + timedelta(minutes=lesson.begin)).timestamp())
+        end = int((midnight + timedelta(minutes=lesson.end)).timestamp())
+        # Как и get_lessons с фильтром по сущности: в своём столбце — только сама сущность
+        teachers = (self.title,) if self.sub_type == "teacher" else lesson.teachers
+        groups = (self.title,) if self.sub_type == "group" else lesson.groups
+        places = lesson.places
+        if self.sub_type == "place":
+            places = ((self.title, next((campus for title, campus in places if title == self.title), None)),)
+
+        # Строки как у JOIN в get_lessons: короткие списки повторяются по кругу,
+        # чтобы merge_duplicate_lessons не собрал лишних «Не указан»
+        teachers, groups, places = teachers or (None,), groups or (None,), places or ((None, None),)
+        return [
+            _lesson_from_row((lesson_id, start, end, lesson.discipline, lesson.lesson_type,
+                              teachers[i % len(teachers)], groups[i % len(groups)], *places[i % len(places)]))
+            for i in range(max(len(teachers), len(groups), len(places)))
+        ]
+
+
+def _monday(day: date) -> date:
+    return day - timedelta(days=day.weekday())
+
+
+def _local(ts: int) -> datetime:
+    return datetime.fromtimestamp(ts, SCHEDULE_TZ)
+
+
+def semester_start(db_path: str) -> date:
+    """
+    Понедельник первой недели семестра: из SEMESTER_START, но не позже самого раннего занятия снапшота —
+    иначе занятия до SEMESTER_START (например, установочные) выпали бы из расписания
+    """
+    snapshot_start = _snapshot_semester_start(os.path.realpath(db_path))
+    if SEMESTER_START:
+        return min(_monday(date.fromisoformat(SEMESTER_START)), snapshot_start)
+    return snapshot_start
+
+
+@lru_cache(maxsize=4)
+def _snapshot_semester_start(db_path: str) -> date:
+    conn = sqlite3.connect(db_path)
+    try:
+        first = conn.execute("SELECT MIN(start) FROM lesson").fetchone()[0]
+    finally:
+        conn.close()
+    return _monday(_local(first).date()) if first is not None else _monday(date.today())
+
+
+@timed(sqlite_query_seconds, query="timetable_from_snapshot")
+def timetable_from_snapshot(db_path: str, sub_type: str, entity_id: int,
+                            start: date | None = None) -> EntityTimetable | None:
+    """
+    Сворачивает занятия сущности из снапшота в повторяющиеся: занятия с одинаковым днём недели, временем
+    и составом объединяются, их даты превращаются в биты недель. None, если сущности нет в снапшоте.
+    """
+    table, field = ENTITY_TITLES[sub_type]
+    link_table, link_column = SUBSCRIPTION_LINKS[sub_type]
+    start = start or semester_start(db_path)
+
+    conn = sqlite3.connect(db_path)
+    try:
+        row = conn.execute(f'SELECT {field} FROM "{table}" WHERE id = ?', (entity_id,)).fetchone()
+        if row is None:
+            return None
+        title = row[0]
+
+        entity_lessons = f"SELECT lesson_id FROM {link_table} WHERE {link_column} = ?"
+        lessons = conn.execute(f"""
+            SELECT l.id, l.start, l.end, d.title, lt.title
+            FROM lesson l
+            JOIN discipline d ON l.discipline_id = d.id
+            JOIN lesson_type lt ON l.lesson_type_id = lt.id
+            WHERE l.id IN ({entity_lessons})
+        """, (entity_id,)).fetchall()
+
+        # Участники — в порядке снапшота, как их перечисляет get_lessons
+        teachers, groups, places = {}, {}, {}
+        for lesson_id, name in conn.execute(f"""
+            SELECT lt.lesson_id, t.name FROM lesson_teacher lt JOIN teacher t ON lt.teacher_id = t.id
+            WHERE lt.lesson_id IN ({entity_lessons})
+        """, (entity_id,)):
+            teachers.setdefault(lesson_id, []).append(intern(name))
+        for lesson_id, name in conn.execute(f"""
+            SELECT lag.lesson_id, ag.title FROM lesson_academic_group lag
+            JOIN academic_group ag ON lag.academic_group_id = ag.id
+            WHERE lag.lesson_id IN ({entity_lessons})
+        """, (entity_id,)):
+            groups.setdefault(lesson_id, []).append(intern(name))
+        for lesson_id, name, campus in conn.execute(f"""
+            SELECT lp.lesson_id, p.title, p.campus FROM lesson_place lp JOIN place p ON lp.place_id = p.id
+            WHERE lp.lesson_id IN ({entity_lessons})
+        """, (entity_id,)):
+            places.setdefault(lesson_id, []).append((intern(name), campus and intern(campus)))
+    finally:
+        conn.close()
+
+    weeks, first_seen = {}, {}
+    for lesson_id, lesson_start, lesson_end, discipline, lesson_type in lessons:
+        begin_dt, end_dt = _local(lesson_start), _local(lesson_end)
+        week = (begin_dt.date() - start).days // 7 + 1
+        if week < 1:
+            logger.warning(f"Занятие {lesson_id} раньше начала семестра {start}, пропущено")
+            continue
+        key = (
+            begin_dt.weekday(),
+            begin_dt.hour * 60 + begin_dt.minute,
+            end_dt.hour * 60 + end_dt.minute,
+            intern(discipline),
+            intern(lesson_type),
+            tuple(teachers.get(lesson_id, ())),
+            tuple(groups.get(lesson_id, ())),
+            tuple(places.get(lesson_id, ())),
+        )
+        key = first_seen.setdefault(_merge_key(key), key)
+        weeks[key] = weeks.get(key, 0) | 1 << (week - 1)
+
+    return EntityTimetable(sub_type, title, start, _sorted_lessons(weeks))
+
+
+def timetable_from_wrapped(response: pb2.GetWrappedScheduleResponse, schedule_type: int,
+                           start: date) -> EntityTimetable:
+    """
+    Расписание из ответа GetWrappedSchedule. Недели берутся из weeks_include (без weeks_exclude),
+    а если номера недель не указаны — из чётности слота на SEMESTER_WEEKS недель.
+    """
+    weeks, first_seen = {}, {}
+    for event in response.events:
+        slot = event.time_slot
+        for lesson in event.lessons:
+            mask = _weeks_mask(lesson.time_details, slot.week_parity)
+            if not mask:
+                continue
+            key = (
+                slot.day_of_week - 1,  # google.type.DayOfWeek: MONDAY = 1
+                lesson.begin_time,
+                lesson.end_time,
+                lesson.discipline,
+                lesson.lesson_type.value if lesson.HasField("lesson_type") else "",
+                tuple(lesson.teachers),
+                tuple(lesson.groups),
+                tuple((auditorium, None) for auditorium in lesson.auditoriums),
+            )
+            key = first_seen.setdefault(_merge_key(key), key)
+            weeks[key] = weeks.get(key, 0) | mask
+
+    return EntityTimetable(SCHEDULE_TYPES.get(schedule_type, ""), response.long_title, _monday(start),
+                           _sorted_lessons(weeks))
+
+
+async def timetable_from_api(client, schedule_type: int, schedule_id: int, start: date,
+                             snapshot_id: str | None = None) -> EntityTimetable:
+    """Расписание через ScheduleWebClient.get_wrapped_schedule; с snapshot_id ответ берётся из кэша снапшота"""
+    response = await client.get_wrapped_schedule(
+        pb2.ScheduleId(schedule_type=schedule_type, schedule_id=schedule_id), snapshot_id
+    )
+    return timetable_from_wrapped(response, schedule_type, start)
+
+
+def _weeks_mask(time_details, week_parity: int) -> int:
+    if time_details.weeks_include:
+        mask = 0
+        for week in time_details.weeks_include:
+            if week >= 1:
+                mask |= 1 << (week - 1)
+    else:
+        if week_parity == pb2.WEEK_PARITY_ODD:
+            weeks = range(1, SEMESTER_WEEKS + 1, 2)
+        elif week_parity == pb2.WEEK_PARITY_EVEN:
+            weeks = range(2, SEMESTER_WEEKS + 1, 2)
+        else:
+            weeks = range(1, SEMESTER_WEEKS + 1)
+        mask = sum(1 << (week - 1) for week in weeks)
+
+    for week in time_details.weeks_exclude:
+        if week >= 1:
+            mask &= ~(1 << (week - 1))
+    return mask
+
+
+def _merge_key(key: tuple) -> tuple:
+    """
+    Ключ объединения занятий в одно повторяющееся: состав без учёта порядка участников.
+    Хранится порядок первого встреченного занятия — сортировка здесь только для сравнения.
+    """
+    *head, teachers, groups, places = key
+    return (*head, tuple(sorted(teachers)), tuple(sorted(groups)),
+            tuple(sorted(places, key=lambda place: (place[0], place[1] or ""))))
+
+
+def _sorted_lessons(weeks: dict) -> list[RecurringLesson]:
+    return [RecurringLesson(*key, weeks=mask) for key, mask in sorted(weeks.items(), key=lambda item: item[0][:3])]
+
+
+# === Кэш расписаний сущностей ===
+_timetables: OrderedDict[tuple[str, str, int], EntityTimetable | None] = OrderedDict()
+# Вызывается из пула потоков; блокировка только на операции со словарём, чтение снапшота идёт без неё
+_timetables_lock = threading.Lock()
+
+
+def get_entity_timetable(db_path: str, sub_type: str, entity_id: int) -> EntityTimetable | None:
+    """
+    Расписание сущности из снапшота db_path, свёрнутое один раз на поколение.
+    Ключ — файл поколения, поэтому после переключения снапшота расписание строится заново.
+    """
+    key = (os.path.realpath(db_path), sub_type, entity_id)
+    with _timetables_lock:
+        if key in _timetables:
+            _timetables.move_to_end(key)
+            return _timetables[key]
+
+    timetable = timetable_from_snapshot(db_path, sub_type, entity_id)
+    with _timetables_lock:
+        _timetables[key] = timetable
+        while len(_timetables) > RECURRENCE_CACHE_SIZE:
+            _timetables.popitem(last=False)
+    return timetable
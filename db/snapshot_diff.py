@@ -0,0 +1,138 @@
+import os
+import json
+import sqlite3
+import logging
+from typing import Dict, Set
+
+logger = logging.getLogger(__name__)
+
+CHANGES_SUFFIX = ".changes.json"
+# Версия набора изменений: наборы, посчитанные прежним запросом (без названий сущностей), не используются
+CHANGE_SET_VERSION = 2
+
+# Тип сущности -> колонка с её id в плоской выборке занятий
+ENTITY_COLUMNS = {
+    "teacher": "teacher_id",
+    "group": "group_id",
+    "place": "place_id",
+}
+
+# Плоская выборка занятий снапшота: одна строка на сочетание преподаватель/группа/аудитория.
+# id занятий между снапшотами не стабильны, поэтому сравниваются время и названия,
+# а id сущностей нужны, чтобы отнести изменение к преподавателю, группе или аудитории.
+# Имена преподавателей, названия групп и аудиторий (с корпусом) тоже сравниваются: они попадают
+# в текст расписания всех участников занятия, и переименование должно сбрасывать их недели в кэше.
+# Неделя — дата понедельника по московскому времени (UTC+3).
+LESSON_ROWS_QUERY = """
+SELECT
+    ltch.teacher_id AS teacher_id,
+    lag.academic_group_id AS group_id,
+    lp.place_id AS place_id,
+    date(l.start + 10800, 'unixepoch', 'weekday 0', '-6 days') AS week_start,
+    l.start,
+    l.end,
+    d.title,
+    lt.title,
+    t.name,
+    ag.title,
+    p.title,
+    p.campus
+FROM {schema}.lesson l
+JOIN {schema}.discipline d ON l.discipline_id = d.id
+JOIN {schema}.lesson_type lt ON l.lesson_type_id = lt.id
+LEFT JOIN {schema}.lesson_teacher ltch ON l.id = ltch.lesson_id
+LEFT JOIN {schema}.teacher t ON ltch.teacher_id = t.id
+LEFT JOIN {schema}.lesson_academic_group lag ON l.id = lag.lesson_id
+LEFT JOIN {schema}.academic_group ag ON lag.academic_group_id = ag.id
+LEFT JOIN {schema}.lesson_place lp ON l.id = lp.lesson_id
+LEFT JOIN {schema}.place p ON lp.place_id = p.id
+"""
+
+DIFF_QUERY = f"""
+SELECT teacher_id, group_id, place_id, week_start FROM (
+    {LESSON_ROWS_QUERY.format(schema="main")}
+    EXCEPT
+    {LESSON_ROWS_QUERY.format(schema="old")}
+)
+UNION
+SELECT teacher_id, group_id, place_id, week_start FROM (
+    {LESSON_ROWS_QUERY.format(schema="old")}
+    EXCEPT
+    {LESSON_ROWS_QUERY.format(schema="main")}
+)
+"""
+
+ChangeSet = Dict[str, Dict[int, Set[str]]]
+
+
+def changes_path(db_path: str) -> str:
+    """Файл набора изменений, относящийся к поколению снапшота db_path"""
+    return db_path + CHANGES_SUFFIX
+
+
+def compute_snapshot_diff(old_db_path: str, new_db_path: str) -> ChangeSet:
+    """
+    Сравнивает занятия двух снапшотов SQLite.
+    Возвращает {тип: {id сущности: {даты понедельников изменившихся недель}}}.
+    """
+    change_set: ChangeSet = {stype: {} for stype in ENTITY_COLUMNS}
+
+    conn = sqlite3.connect(f"file:{new_db_path}?mode=ro", uri=True)
+    try:
+        conn.execute("ATTACH DATABASE ? AS old", (f"file:{old_db_path}?mode=ro",))
+        for teacher_id, group_id, place_id, week_start in conn.execute(DIFF_QUERY):
+            for stype, entity_id in (("teacher", teacher_id), ("group", group_id), ("place", place_id)):
+                if entity_id is not None:
+                    change_set[stype].setdefault(entity_id, set()).add(week_start)
+    finally:
+        conn.close()
+
+    return change_set
+
+
+def save_change_set(change_set: ChangeSet, snapshot_id: int, path: str, base: str | None = None):
+    """
+    Сохраняет набор изменений в компактном JSON рядом со снапшотом.
+    base — имя файла поколения, с которым сравнивался снапшот
+    """
+    data = {
+        "version": CHANGE_SET_VERSION,
+        "snapshot_id": snapshot_id,
+        "base": base,
+        "changes": {
+            stype: {str(eid): sorted(weeks) for eid, weeks in entities.items()}
+            for stype, entities in change_set.items()
+        },
+    }
+    temp_path = path + ".temp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(temp_path, path)
+
+
+def load_change_set(path: str) -> tuple[int | None, str | None, ChangeSet | None]:
+    """
+    Загружает набор изменений. Возвращает (snapshot_id, имя поколения-основы, изменения)
+    или (None, None, None), если файла нет или он другой версии
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None, None, None
+
+    if data.get("version") != CHANGE_SET_VERSION:
+        return None, None, None
+
+    change_set = {
+        stype: {int(eid): set(weeks) for eid, weeks in entities.items()}
+        for stype, entities in data["changes"].items()
+    }
+    return data["snapshot_id"], data.get("base"), change_set
+
+
+def summarize_change_set(change_set: ChangeSet) -> str:
+    return ", ".join(
+        f"{stype}: {len(entities)} (недель: {sum(len(w) for w in entities.values())})"
+        for stype, entities in change_set.items()
+    )
@@ -0,0 +1,170 @@
+import os
+import re
+import time
+import fcntl
+import sqlite3
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from dotenv import load_dotenv
+
+from db.snapshot_diff import changes_path
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# SQLITE_PATH — указатель на текущее поколение (симлинк на файл в SNAPSHOT_DIR).
+# Каждый снапшот хранится отдельным неизменяемым файлом schedule-<snapshot_id>.db.
+DB_PATH = os.getenv("SQLITE_PATH")
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR") or os.path.join(os.path.dirname(os.path.abspath(DB_PATH or ".")), "snapshots")
+# Сколько предыдущих поколений хранить, даже если их никто не читает
+SNAPSHOT_KEEP = int(os.getenv("SNAPSHOT_KEEP", "1"))
+
+VERSION_PATTERN = re.compile(r"^schedule-(\d+)\.db$")
+
+_pinned_path: ContextVar[str | None] = ContextVar("pinned_snapshot_path", default=None)
+
+
+def version_path(snapshot_id: int) -> str:
+    return os.path.join(SNAPSHOT_DIR, f"schedule-{snapshot_id}.db")
+
+
+def current_db_path() -> str:
+    """Путь к снапшоту, закреплённому за текущим запросом, иначе — указатель на текущее поколение"""
+    return _pinned_path.get() or DB_PATH
+
+
+def current_generation() -> str:
+    """Файл текущего поколения (куда указывает SQLITE_PATH)"""
+    return os.path.realpath(DB_PATH)
+
+
+@contextmanager
+def pinned_snapshot():
+    """
+    Закрепляет текущее поколение снапшота на время запроса.
+    Пока закрепление держится (разделяемый flock), файл поколения не будет удалён сборщиком,
+    а все чтения через current_db_path() идут в один и тот же файл, даже если указатель переключили.
+    """
+    try:
+        fd, path = _open_generation()
+    except FileNotFoundError:
+        # Снапшот ещё не скачан — закреплять нечего, обработчики сами сообщат об ошибке чтения
+        logger.warning(f"Снапшот {DB_PATH} не найден, чтение без закрепления поколения")
+        yield DB_PATH
+        return
+
+    token = _pinned_path.set(path)
+    try:
+        yield path
+    finally:
+        _pinned_path.reset(token)
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+def _open_generation(attempts: int = 3) -> tuple[int, str]:
+    for _ in range(attempts):
+        path = current_generation()
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            continue
+
+        fcntl.flock(fd, fcntl.LOCK_SH)
+        # Сборщик мог удалить файл между open и flock — тогда берём новое текущее поколение
+        if os.path.exists(path) and os.stat(path).st_ino == os.fstat(fd).st_ino:
+            return fd, path
+
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    raise FileNotFoundError(f"Не удалось закрепить снапшот {DB_PATH}")
+
+
+def prepare_snapshot(path: str):
+    """
+    Готовит скачанный снапшот к чтению до публикации:
+    полнотекстовый индекс FTS5 по названиям дисциплин (ё приводится к е) и индекс занятий по дисциплине.
+    """
+    started = time.monotonic()
+    conn = sqlite3.connect(path)
+    try:
+        conn.executescript("""
+            BEGIN;
+            DROP TABLE IF EXISTS discipline_fts;
+            CREATE VIRTUAL TABLE discipline_fts USING fts5(
+                title,
+                tokenize = 'unicode61 remove_diacritics 2'
+            );
+            INSERT INTO discipline_fts(rowid, title)
+                SELECT id, replace(replace(title, 'ё', 'е'), 'Ё', 'Е') FROM discipline;
+            INSERT INTO discipline_fts(discipline_fts) VALUES ('optimize');
+            CREATE INDEX IF NOT EXISTS idx_lesson_discipline_start ON lesson(discipline_id, start);
+            COMMIT;
+        """)
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    logger.info(f"Снапшот подготовлен за {time.monotonic() - started:.2f} с")
+
+
+def publish_snapshot(path: str):
+    """Атомарно переключает указатель SQLITE_PATH на файл нового поколения"""
+    link_tmp = DB_PATH + ".link.temp"
+    if os.path.lexists(link_tmp):
+        os.remove(link_tmp)
+
+    os.symlink(os.path.relpath(path, os.path.dirname(os.path.abspath(DB_PATH))), link_tmp)
+    os.replace(link_tmp, DB_PATH)
+
+    dir_fd = os.open(os.path.dirname(os.path.abspath(DB_PATH)), os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+    logger.info(f"Текущее поколение снапшота: {os.path.basename(path)}")
+
+
+def collect_garbage(keep: int = SNAPSHOT_KEEP) -> list[str]:
+    """
+    Удаляет старые поколения, которые никто не читает.
+    Поколение удаляется, только если на нём удалось взять эксклюзивный flock без ожидания.
+    """
+    current = current_generation()
+    versions = sorted(
+        (int(m.group(1)), name)
+        for name in os.listdir(SNAPSHOT_DIR)
+        if (m := VERSION_PATTERN.match(name))
+    )
+    candidates = [
+        os.path.join(SNAPSHOT_DIR, name) for _, name in versions
+        if os.path.join(SNAPSHOT_DIR, name) != current
+    ]
+    if keep:
+        candidates = candidates[:-keep]
+
+    removed = []
+    for path in candidates:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                logger.info(f"Поколение {os.path.basename(path)} ещё читается, удаление отложено")
+                continue
+
+            for sidecar in (path, changes_path(path)):
+                if os.path.exists(sidecar):
+                    os.remove(sidecar)
+            removed.append(path)
+        finally:
+            os.close(fd)
+
+    if removed:
+        logger.info(f"Удалены старые поколения снапшота: {', '.join(os.path.basename(p) for p in removed)}")
+    return removed
@@ -7,7 +7,7 @@ until pg_isready -h postgres_max -p 5432 -U max_bot; do
 done
 
 echo "Running migrations"
-alembic upgrade head
+alembic upgrade heads
 
 echo "Starting process"
 
@@ -0,0 +1,186 @@
+import struct
+from typing import Iterator, Mapping
+from urllib.parse import unquote
+
+# Кадрирование gRPC-Web: флаг (1 байт) + длина (4 байта, big-endian) + полезная нагрузка.
+# Флаг 0x00 — сообщение, 0x80 — трейлеры ("ключ: значение\r\n"), бит 0x01 — сжатие.
+FRAME_HEADER = struct.Struct(">BI")
+DATA_FRAME = 0x00
+TRAILER_FLAG = 0x80
+COMPRESSED_FLAG = 0x01
+
+GRPC_UNAUTHENTICATED = 16
+# Статусы, означающие проблемы самого сервиса, а не конкретного запроса
+GRPC_UNAVAILABLE_STATUSES = frozenset({4, 8, 13, 14})
+
+GRPC_STATUS_NAMES = {
+    0: "OK",
+    1: "CANCELLED",
+    2: "UNKNOWN",
+    3: "INVALID_ARGUMENT",
+    4: "DEADLINE_EXCEEDED",
+    5: "NOT_FOUND",
+    6: "ALREADY_EXISTS",
+    7: "PERMISSION_DENIED",
+    8: "RESOURCE_EXHAUSTED",
+    9: "FAILED_PRECONDITION",
+    10: "ABORTED",
+    11: "OUT_OF_RANGE",
+    12: "UNIMPLEMENTED",
+    13: "INTERNAL",
+    14: "UNAVAILABLE",
+    15: "DATA_LOSS",
+    16: "UNAUTHENTICATED",
+}
+
+
+class GrpcWebError(Exception):
+    """Ответ сервера с ненулевым grpc-status"""
+
+    def __init__(self, status: int, message: str = ""):
+        self.status = status
+        self.message = message
+        super().__init__(f"gRPC {GRPC_STATUS_NAMES.get(status, status)}: {message}")
+
+
+class GrpcWebHttpError(Exception):
+    """Шлюз ответил HTTP-статусом, отличным от 200"""
+
+    def __init__(self, status: int, text: str = ""):
+        self.status = status
+        self.text = text
+        super().__init__(f"HTTP {status}: {text}")
+
+
+class GrpcWebFrameError(ValueError):
+    """Тело ответа не соответствует кадрированию gRPC-Web"""
+
+
+def encode_frame(payload: bytes, flag: int = DATA_FRAME) -> bytes:
+    return FRAME_HEADER.pack(flag, len(payload)) + payload
+
+
+def encode_trailers(status: int = 0, message: str = "") -> bytes:
+    return encode_frame(f"grpc-status:{status}\r\ngrpc-message:{message}\r\n".encode(), TRAILER_FLAG)
+
+
+def _next_frame(view: memoryview, offset: int) -> tuple[int, memoryview, int] | None:
+    """Кадр с позиции offset: (флаг, нагрузка, позиция следующего кадра) или None, если кадр ещё не пришёл целиком"""
+    if len(view) - offset < FRAME_HEADER.size:
+        return None
+
+    flag, length = FRAME_HEADER.unpack_from(view, offset)
+    start = offset + FRAME_HEADER.size
+    end = start + length
+    if end > len(view):
+        return None
+
+    if flag & COMPRESSED_FLAG:
+        raise GrpcWebFrameError("Сжатые кадры gRPC-Web не поддерживаются")
+    if flag & ~(TRAILER_FLAG | COMPRESSED_FLAG):
+        raise GrpcWebFrameError(f"Неизвестный флаг кадра gRPC-Web: {flag:#04x}")
+    return flag, view[start:end], end
+
+
+def iter_frames(data) -> Iterator[tuple[int, memoryview]]:
+    """Обходит все кадры тела без копирования: нагрузка отдаётся срезами memoryview"""
+    view = memoryview(data)
+    offset = 0
+    while offset < len(view):
+        frame = _next_frame(view, offset)
+        if frame is None:
+            raise GrpcWebFrameError(f"Обрезанный кадр gRPC-Web на позиции {offset} из {len(view)}")
+        flag, payload, offset = frame
+        yield flag, payload
+
+
+def parse_trailers(payload) -> dict[str, str]:
+    trailers = {}
+    for line in bytes(payload).decode("utf-8", errors="replace").split("\r\n"):
+        if ":" in line:
+            key, value = line.split(":", 1)
+            trailers[key.strip().lower()] = value.strip()
+    return trailers
+
+
+def check_status(trailers: Mapping[str, str]):
+    """Бросает GrpcWebError, если в трейлерах (или заголовках ответа) ненулевой grpc-status"""
+    status = trailers.get("grpc-status")
+    if status is None:
+        return
+    try:
+        code = int(status)
+    except ValueError:
+        raise GrpcWebFrameError(f"Некорректный grpc-status: {status!r}")
+    if code != 0:
+        raise GrpcWebError(code, unquote(trailers.get("grpc-message", "")))
+
+
+def decode_unary(body, headers: Mapping[str, str] | None = None) -> memoryview:
+    """
+    Разбирает ответ унарного вызова: ровно одно сообщение и трейлеры.
+    Учитывает ответы trailers-only, где grpc-status приходит в заголовках HTTP.
+    Возвращает сообщение срезом memoryview над body.
+    """
+    if headers is not None:
+        check_status({k.lower(): v for k, v in headers.items() if k.lower().startswith("grpc-")})
+
+    message = None
+    trailers = None
+    for flag, payload in iter_frames(body):
+        if flag & TRAILER_FLAG:
+            trailers = parse_trailers(payload)
+            check_status(trailers)
+        elif trailers is not None:
+            raise GrpcWebFrameError("Сообщение после трейлеров gRPC-Web")
+        elif message is not None:
+            raise GrpcWebFrameError("Унарный ответ содержит больше одного сообщения")
+        else:
+            message = payload
+
+    if message is None:
+        raise GrpcWebFrameError("Ответ gRPC-Web не содержит сообщения")
+    return message
+
+
+class GrpcWebDecoder:
+    """
+    Инкрементальный разбор тела, приходящего частями.
+    feed() возвращает сообщения, пришедшие целиком, finish() проверяет трейлеры и остаток.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self.trailers: dict[str, str] | None = None
+
+    def feed(self, chunk: bytes) -> list[memoryview]:
+        self._buffer += chunk
+        # Готовые кадры отрезаются одной копией, сообщения — срезы этой копии
+        view = memoryview(self._buffer)
+        offset = 0
+        while (frame := _next_frame(view, offset)) is not None:
+            offset = frame[2]
+        view.release()
+        if not offset:
+            return []
+
+        complete = bytes(self._buffer[:offset])
+        del self._buffer[:offset]
+
+        messages = []
+        for flag, payload in iter_frames(complete):
+            if self.trailers is not None:
+                raise GrpcWebFrameError("Кадр после трейлеров gRPC-Web")
+            if flag & TRAILER_FLAG:
+                self.trailers = parse_trailers(payload)
+                check_status(self.trailers)
+            else:
+                messages.append(payload)
+        return messages
+
+    def finish(self) -> dict[str, str]:
+        if self._buffer:
+            raise GrpcWebFrameError(f"Тело оборвано: осталось {len(self._buffer)} байт неполного кадра")
+        if self.trailers is None:
+            raise GrpcWebFrameError("Ответ gRPC-Web без трейлеров")
+        return self.trailers
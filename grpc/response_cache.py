@@ -0,0 +1,138 @@
+import os
+import shutil
+import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+from dotenv import load_dotenv
+
+from utils.metrics import Counter, Gauge
+from utils.singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Ответы GetScheduleTitle / GetWrappedSchedule меняются только вместе со снапшотом
+SCHEDULE_CACHE_MAX_BYTES = int(os.getenv("SCHEDULE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Каталог для сохранения ответов между перезапусками; пусто — только память
+SCHEDULE_CACHE_DIR = os.getenv("SCHEDULE_CACHE_DIR", "")
+
+CacheKey = tuple[str, int, int, str]
+
+cache_events_total = Counter("bot_schedule_cache_events_total", "Попадания, промахи и вытеснения кэша ответов",
+                             ["event"])
+cache_bytes = Gauge("bot_schedule_cache_bytes", "Размер ответов в памяти кэша")
+
+
+class ResponseCache:
+    """
+    Кэш сериализованных protobuf-ответов по ключу (метод, тип расписания, id, snapshot_id).
+    В памяти — LRU с ограничением по суммарному размеру, на диске — файл на ответ в каталоге снапшота.
+    Одновременные одинаковые запросы выполняются один раз.
+    """
+
+    def __init__(self, max_bytes: int = SCHEDULE_CACHE_MAX_BYTES, directory: str = SCHEDULE_CACHE_DIR):
+        self.max_bytes = max_bytes
+        self.directory = directory or None
+        self._entries: OrderedDict[CacheKey, bytes] = OrderedDict()
+        self._size = 0
+        self._flight = SingleFlight("schedule_cache")
+        self._snapshot_id: str | None = None
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0, "evictions": 0}
+
+    async def get_or_fetch(self, method: str, schedule_id, snapshot_id, fetch: Callable[[], Awaitable]) -> bytes:
+        """Сериализованный ответ из кэша или результат fetch() (protobuf-сообщение), сохранённый в кэш"""
+        snapshot_id = str(snapshot_id)
+        key = (method, schedule_id.schedule_type, schedule_id.schedule_id, snapshot_id)
+        self._switch_snapshot(snapshot_id)
+
+        data = self._entries.get(key)
+        if data is not None:
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return data
+
+        data = self._read_disk(key)
+        if data is not None:
+            self.stats["disk_hits"] += 1
+            self._store(key, data)
+            return data
+
+        if key in self._flight:
+            self.stats["coalesced"] += 1
+        return await self._flight.do(key, lambda: self._fetch(key, fetch))
+
+    async def _fetch(self, key: CacheKey, fetch: Callable[[], Awaitable]) -> bytes:
+        self.stats["misses"] += 1
+        data = (await fetch()).SerializeToString()
+        self._store(key, data)
+        self._write_disk(key, data)
+        return data
+
+    def clear(self):
+        self._entries.clear()
+        self._size = 0
+
+    def _switch_snapshot(self, snapshot_id: str):
+        """Новый снапшот делает старые ответы ненужными: память и каталоги прошлых снапшотов очищаются"""
+        if self._snapshot_id == snapshot_id:
+            return
+        if self._snapshot_id is not None:
+            logger.info(f"Кэш расписаний сброшен: snapshot {self._snapshot_id} -> {snapshot_id}")
+        self._snapshot_id = snapshot_id
+        self.clear()
+        self._prune_disk(snapshot_id)
+
+    def _store(self, key: CacheKey, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._size -= len(previous)
+        self._entries[key] = data
+        self._size += len(data)
+
+        while self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+            self.stats["evictions"] += 1
+
+    # === Хранение на диске ===
+    def _path(self, key: CacheKey) -> str:
+        method, schedule_type, schedule_id, snapshot_id = key
+        return os.path.join(self.directory, snapshot_id, f"{method}-{schedule_type}-{schedule_id}.pb")
+
+    def _read_disk(self, key: CacheKey) -> bytes | None:
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write_disk(self, key: CacheKey, data: bytes):
+        if not self.directory:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = path + ".temp"
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.error(f"Не удалось сохранить ответ в кэш на диске: {e}")
+
+    def _prune_disk(self, snapshot_id: str):
+        if not self.directory or not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if name != snapshot_id:
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+
+schedule_cache = ResponseCache()
+cache_events_total.track_stats(schedule_cache.stats)
+cache_bytes.track(lambda: schedule_cache._size)
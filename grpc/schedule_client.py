@@ -1,60 +1,126 @@
+import os
+import time
+import asyncio
 import aiohttp
 from grpc import personal_schedule_pb2 as pb2
-import struct
+from grpc.grpc_web import (GRPC_UNAUTHENTICATED, GRPC_UNAVAILABLE_STATUSES, GrpcWebError, GrpcWebHttpError,
+                           decode_unary, encode_frame)
+from grpc.response_cache import ResponseCache, schedule_cache
+from grpc.transport import get_shared_session
+from utils.auth import TokenProvider
+from utils.metrics import Counter, Histogram
+from utils.resilience import CircuitOpenError, Upstream, is_http_failure
+
+SCHEDULE_GRPC_URL = os.getenv("SCHEDULE_GRPC_URL", "https://schedule-of.mirea.ru")
+
+
+def is_upstream_failure(error: BaseException) -> bool:
+    """Ошибка говорит о перегрузке или недоступности сервиса (а не о неверном запросе)"""
+    if isinstance(error, GrpcWebError):
+        return error.status in GRPC_UNAVAILABLE_STATUSES
+    if isinstance(error, GrpcWebHttpError):
+        return error.status >= 500 or error.status == 429
+    return is_http_failure(error)
+
+
+grpc_requests_total = Counter("bot_grpc_requests_total", "Вызовы PersonalScheduleService по методу и результату",
+                              ["method", "outcome"])
+grpc_request_seconds = Histogram("bot_grpc_request_seconds", "Время вызова PersonalScheduleService (с повтором)",
+                                 ["method"])
+
+
+def rpc_outcome(error: BaseException | None) -> str:
+    if error is None:
+        return "ok"
+    if isinstance(error, CircuitOpenError):
+        return "circuit_open"
+    if isinstance(error, GrpcWebError):
+        return f"grpc_{error.status}"
+    if isinstance(error, GrpcWebHttpError):
+        return f"http_{error.status}"
+    if isinstance(error, (asyncio.TimeoutError, asyncio.CancelledError)):
+        return "timeout"
+    return "error"
+
+
+# Общие для процесса автомат и лимит параллельности вызовов PersonalScheduleService
+schedule_upstream = Upstream("PersonalScheduleService", is_upstream_failure)
 
 
 class ScheduleWebClient:
-    def __init__(self, token: str):
-        self.base_url = "https://schedule-of.mirea.ru"
-        self.token = token
-        self.session = None
+    """
+    gRPC-Web клиент PersonalScheduleService.
+    По умолчанию работает через общий keep-alive транспорт процесса и не закрывает его при выходе.
+    """
+    def __init__(self, token_provider: TokenProvider, session: aiohttp.ClientSession | None = None,
+                 base_url: str = SCHEDULE_GRPC_URL, cache: ResponseCache | None = schedule_cache,
+                 upstream: Upstream | None = schedule_upstream):
+        self.base_url = base_url
+        self.token_provider = token_provider
+        self.session = session
+        self.cache = cache
+        self.upstream = upstream
 
     async def __aenter__(self):
-        self.session = aiohttp.ClientSession()
+        if self.session is None:
+            self.session = get_shared_session()
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        if self.session:
-            await self.session.close()
+        pass
 
-    def _get_headers(self):
+    def _get_headers(self, token: str):
         return {
-            "Authorization": f"Bearer {self.token}",
+            "Authorization": f"Bearer {token}",
             "Content-Type": "application/grpc-web+proto",
             "X-Grpc-Web": "1",
         }
 
-    def _encode_grpc_web_message(self, message_data):
-        """Кодирует сообщение в gRPC-Web формат"""
-        message_length = len(message_data)
-        prefix = struct.pack('>BI', 0x00, message_length)
-        return prefix + message_data
-
-    def _decode_grpc_web_message(self, response_data):
-        """Декодирует gRPC-Web ответ"""
-        if len(response_data) < 5 or response_data[0] != 0x00:
-            return response_data
-
-        message_length = struct.unpack('>I', response_data[1:5])[0]
-        if len(response_data) >= 5 + message_length:
-            return response_data[5:5 + message_length]
-
-        return response_data[5:]
-
     async def _make_grpc_web_request(self, method_name: str, request_msg):
-        """Универсальный метод для gRPC-Web запросов"""
+        """
+        Универсальный метод для gRPC-Web запросов.
+        Каждая попытка проходит через автомат и адаптивный лимит upstream: при разомкнутом автомате — CircuitOpenError
+        """
         url = f"{self.base_url}/rtu.schedule.api.PersonalScheduleService/{method_name}"
 
-        request_data = request_msg.SerializeToString()
-        grpc_web_data = self._encode_grpc_web_message(request_data)
-
-        async with self.session.post(url, data=grpc_web_data, headers=self._get_headers()) as response:
+        grpc_web_data = encode_frame(request_msg.SerializeToString())
+
+        started = time.perf_counter()
+        error = None
+        try:
+            return await self._call_with_reauth(url, grpc_web_data)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            grpc_requests_total.inc(method=method_name, outcome=rpc_outcome(error))
+            grpc_request_seconds.observe(time.perf_counter() - started, method=method_name)
+
+    async def _call_with_reauth(self, url: str, grpc_web_data: bytes):
+        for attempt in range(2):
+            token = await self.token_provider.get_token(self.session)
+            try:
+                if self.upstream is None:
+                    return await self._post(url, grpc_web_data, token)
+                async with self.upstream.call():
+                    return await self._post(url, grpc_web_data, token)
+            except (GrpcWebHttpError, GrpcWebError) as e:
+                # Токен мог быть отозван раньше expires_in — обновляем его и повторяем запрос один раз.
+                # Шлюз сообщает об этом либо HTTP 401, либо grpc-status UNAUTHENTICATED
+                unauthenticated = (e.status == 401 if isinstance(e, GrpcWebHttpError)
+                                   else e.status == GRPC_UNAUTHENTICATED)
+                if unauthenticated and attempt == 0:
+                    self.token_provider.invalidate(token)
+                    continue
+                raise
+
+    async def _post(self, url: str, data: bytes, token: str) -> memoryview:
+        async with self.session.post(url, data=data, headers=self._get_headers(token)) as response:
             if response.status != 200:
-                text = await response.text()
-                raise Exception(f"HTTP {response.status}: {text}")
+                raise GrpcWebHttpError(response.status, await response.text())
 
             raw_data = await response.read()
-            return self._decode_grpc_web_message(raw_data)
+            return decode_unary(raw_data, response.headers)
 
     async def get_subscribed_schedules(self):
         """Получение расписаний, на которые есть подписка"""
@@ -97,22 +163,29 @@ class ScheduleWebClient:
         response.ParseFromString(response_data)
         return response
 
-    async def get_schedule_title(self, schedule_id):
-        """Получение названия расписания"""
+    async def get_schedule_title(self, schedule_id, snapshot_id=None):
+        """Получение названия расписания. С snapshot_id ответ берётся из кэша снапшота"""
         request = pb2.GetScheduleTitleRequest(schedule_id=schedule_id)
-        response_data = await self._make_grpc_web_request("GetScheduleTitle", request)
-
-        response = pb2.GetScheduleTitleResponse()
-        response.ParseFromString(response_data)
-        return response
+        return await self._cached_request("GetScheduleTitle", request, pb2.GetScheduleTitleResponse, snapshot_id)
 
-    async def get_wrapped_schedule(self, schedule_id):
-        """Получение полного расписания"""
+    async def get_wrapped_schedule(self, schedule_id, snapshot_id=None):
+        """Получение полного расписания. С snapshot_id ответ берётся из кэша снапшота"""
         request = pb2.GetWrappedScheduleRequest(schedule_id=schedule_id)
-        response_data = await self._make_grpc_web_request("GetWrappedSchedule", request)
+        return await self._cached_request("GetWrappedSchedule", request, pb2.GetWrappedScheduleResponse, snapshot_id)
 
-        response = pb2.GetWrappedScheduleResponse()
-        response.ParseFromString(response_data)
+    async def _cached_request(self, method_name: str, request_msg, response_cls, snapshot_id=None):
+        async def fetch():
+            response = response_cls()
+            response.ParseFromString(await self._make_grpc_web_request(method_name, request_msg))
+            return response
+
+        if snapshot_id is None or self.cache is None:
+            return await fetch()
+
+        data = await self.cache.get_or_fetch(method_name, request_msg.schedule_id, snapshot_id, fetch)
+        # Каждый вызов получает свою копию сообщения: кэш хранит только байты
+        response = response_cls()
+        response.ParseFromString(data)
         return response
 
 
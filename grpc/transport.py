@@ -0,0 +1,56 @@
+import os
+import asyncio
+import logging
+
+import aiohttp
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Общий транспорт gRPC-Web: одна сессия и один пул keep-alive соединений на процесс.
+# HTTP/2 aiohttp не поддерживает, поэтому соединения переиспользуются через HTTP/1.1 keep-alive.
+GRPC_CONNECTION_LIMIT = int(os.getenv("GRPC_CONNECTION_LIMIT", "32"))
+GRPC_KEEPALIVE_TIMEOUT = float(os.getenv("GRPC_KEEPALIVE_TIMEOUT", "60"))
+GRPC_DNS_CACHE_TTL = int(os.getenv("GRPC_DNS_CACHE_TTL", "300"))
+GRPC_CONNECT_TIMEOUT = float(os.getenv("GRPC_CONNECT_TIMEOUT", "5"))
+GRPC_READ_TIMEOUT = float(os.getenv("GRPC_READ_TIMEOUT", "30"))
+
+_session: aiohttp.ClientSession | None = None
+_session_loop: asyncio.AbstractEventLoop | None = None
+
+
+def create_session() -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(
+        limit=GRPC_CONNECTION_LIMIT,
+        limit_per_host=GRPC_CONNECTION_LIMIT,
+        keepalive_timeout=GRPC_KEEPALIVE_TIMEOUT,
+        ttl_dns_cache=GRPC_DNS_CACHE_TTL,
+        use_dns_cache=True,
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=None,
+        connect=GRPC_CONNECT_TIMEOUT,
+        sock_read=GRPC_READ_TIMEOUT,
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+
+def get_shared_session() -> aiohttp.ClientSession:
+    """Общая сессия процесса. Создаётся при первом обращении внутри работающего event loop"""
+    global _session, _session_loop
+    loop = asyncio.get_running_loop()
+    if _session is None or _session.closed or _session_loop is not loop:
+        _session = create_session()
+        _session_loop = loop
+        logger.info(f"Создан общий транспорт gRPC-Web (соединений до {GRPC_CONNECTION_LIMIT})")
+    return _session
+
+
+async def close_shared_session():
+    """Закрывает общую сессию при остановке процесса"""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
@@ -1,17 +1,19 @@
-import os
 from maxapi import Router, F
 from maxapi.types import MessageCreated, MessageCallback, CallbackButton, ButtonsPayload, Command, NewMessageLink
-from maxapi.context.context import MemoryContext
 from datetime import datetime, timedelta
+import os
+import asyncio
 
-from db.db_operations import get_user_subscriptions, find_entity_by_name, get_campus_by_place_id, \
-    get_entity_name_by_type, get_lessons, send_schedule_message
+from db.db_operations import ENTITY_TITLES, get_user_subscriptions, find_entity_by_name, get_campus_by_place_id, \
+    get_entity_names, render_schedule, send_rendered_schedule
+from db.lesson_cache import week_cache
+from db.snapshot_store import current_db_path
 from utils.detect import detect_subscribe_type
-
-DB_PATH = os.getenv("SQLITE_PATH")
+from utils.singleflight import SingleFlight
+from utils.fsm import get_context
 
 day_handler = Router()
-user_contexts: dict[int, MemoryContext] = {}
+schedule_flight = SingleFlight("schedule")
 
 
 def to_unix_timestamp(dt: datetime.date, end_of_day=False):
@@ -19,12 +21,6 @@ def to_unix_timestamp(dt: datetime.date, end_of_day=False):
     return int(dt_time.timestamp())
 
 
-def get_context(chat_id: int) -> MemoryContext:
-    if chat_id not in user_contexts:
-        user_contexts[chat_id] = MemoryContext(chat_id, chat_id)
-    return user_contexts[chat_id]
-
-
 @day_handler.message_created(Command("today"))
 async def cmd_today(event: MessageCreated):
     await handle_schedule_command(event, "today")
@@ -42,7 +38,7 @@ async def cmd_week(event: MessageCreated):
 
 async def handle_schedule_command(event: MessageCreated, day_type: str):
     chat_id = event.message.recipient.chat_id
-    ctx = get_context(chat_id)
+    ctx = get_context(chat_id, "days")
 
     text = event.message.body.text.strip()
     args = text.split(maxsplit=1)
@@ -110,7 +106,7 @@ async def _show_type_selection(event_or_callback, day_type: str):
 async def handle_callback(callback: MessageCallback):
     payload = callback.callback.payload
     chat_id = callback.message.recipient.chat_id
-    ctx = get_context(chat_id)
+    ctx = get_context(chat_id, "days")
 
     if payload.startswith("back_to_"):
         day_type = payload.split("_")[2]
@@ -126,9 +122,10 @@ async def handle_callback(callback: MessageCallback):
             await callback.answer()
             return
 
+        names = get_entity_names(current_db_path(), {stype: subs[stype]})[stype]
         buttons = []
         for eid in subs[stype]:
-            title = await get_entity_name_by_type(DB_PATH, stype, eid)
+            title, _ = names[eid]
             emoji = "👥" if stype == "group" else "👨‍🏫" if stype == "teacher" else "🏫"
             buttons.append([CallbackButton(text=f"{emoji} {title}", payload=f"{day_type}_schedule_{stype}_{eid}")])
         buttons.append([CallbackButton(text="⬅️ Назад", payload=f"back_to_{day_type}_main")])
@@ -169,20 +166,24 @@ async def _send_schedule(event_or_callback, schedule_id: int, stype: str, day_ty
         date_start = monday
         date_end = monday + timedelta(days=6)
 
-    start_ts = to_unix_timestamp(date_start)
-    end_ts = to_unix_timestamp(date_end, end_of_day=True)
-
-    if stype == "teacher":
-        lessons = get_lessons(DB_PATH, teacher_id=schedule_id, start_ts=start_ts, end_ts=end_ts)
-    elif stype == "group":
-        lessons = get_lessons(DB_PATH, group_id=schedule_id, start_ts=start_ts, end_ts=end_ts)
-    elif stype == "place":
-        lessons = get_lessons(DB_PATH, place_id=schedule_id, start_ts=start_ts, end_ts=end_ts)
-    else:
-        lessons = []
-
     title_map = {"today": "сегодня", "tomorrow": "завтра", "week": "на неделю"}
-    await send_schedule_message(event_or_callback, lessons, f"📅 Расписание {title_map[day_type]}", schedule_type=stype)
+    title = f"📅 Расписание {title_map[day_type]}"
+
+    # Одинаковые одновременные запросы (вся группа открыла «сегодня» по ссылке) считаются и рендерятся один раз.
+    # SQLite читается в пуле потоков, чтобы не блокировать цикл событий, пока остальные ждут
+    db_path = current_db_path()
+    key = (stype, schedule_id, date_start, date_end, os.path.realpath(db_path))
+    text = await schedule_flight.do(
+        key, lambda: asyncio.to_thread(_render_schedule, db_path, schedule_id, stype, date_start, date_end, title)
+    )
+    await send_rendered_schedule(event_or_callback, text, title)
+
+
+def _render_schedule(db_path: str, schedule_id: int, stype: str, date_start, date_end, title: str) -> str | None:
+    if stype not in ENTITY_TITLES:
+        return None
+    lessons = week_cache.lessons(db_path, stype, schedule_id, date_start, date_end)
+    return render_schedule(lessons, title, stype)
 
 
 @day_handler.message_callback(F.callback.payload.regexp(r"^back_to_"))
@@ -0,0 +1,83 @@
+import os
+import re
+from datetime import datetime, timedelta
+
+from maxapi import Router
+from maxapi.types import MessageCreated, Command
+
+from db.db_operations import get_user_subscriptions, search_lessons_by_discipline, send_schedule_message
+from db.snapshot_store import current_db_path
+from handlers.days_handler import to_unix_timestamp
+
+# Период поиска по умолчанию: с сегодняшнего дня на FIND_DAYS_AHEAD дней вперёд
+FIND_DAYS_AHEAD = int(os.getenv("FIND_DAYS_AHEAD", "180"))
+FIND_LIMIT = int(os.getenv("FIND_LIMIT", "20"))
+
+# Необязательный период в конце запроса: 20.12 или 20.12-30.12 (год можно указать: 20.12.2025)
+PERIOD_PATTERN = re.compile(r"\s+(\d{1,2}\.\d{1,2}(?:\.\d{4})?)(?:\s*-\s*(\d{1,2}\.\d{1,2}(?:\.\d{4})?))?$")
+
+find_handler = Router()
+
+
+@find_handler.message_created(Command("find"))
+async def cmd_find(event: MessageCreated):
+    chat_id = event.message.recipient.chat_id
+
+    args = event.message.body.text.strip().split(maxsplit=1)
+    if len(args) < 2:
+        await event.message.answer(
+            "🔍 Укажите название дисциплины, например:\n"
+            "/find линейная алгебра\n"
+            "/find алгебра 20.12-30.12"
+        )
+        return
+
+    try:
+        query, date_from, date_to = parse_find_query(args[1])
+    except ValueError:
+        await event.message.answer("❌ Не удалось разобрать даты. Формат: дд.мм или дд.мм-дд.мм")
+        return
+
+    subs = await get_user_subscriptions(chat_id)
+    lessons = search_lessons_by_discipline(
+        current_db_path(),
+        query,
+        start_ts=to_unix_timestamp(date_from),
+        end_ts=to_unix_timestamp(date_to, end_of_day=True),
+        subscriptions=subs if subs and any(subs.values()) else None,
+        limit=FIND_LIMIT,
+    )
+
+    scope = "в ваших подписках" if subs and any(subs.values()) else "во всех расписаниях"
+    period = f"{date_from.strftime('%d.%m')}–{date_to.strftime('%d.%m')}"
+    if not lessons:
+        await event.message.answer(f"❌ «{query}» {scope} за {period} не найдено.")
+        return
+
+    await send_schedule_message(event, lessons, f"🔍 {query} ({scope}, {period})", "discipline")
+
+
+def parse_find_query(text: str):
+    """Отделяет от запроса необязательный период. Возвращает (запрос, дата начала, дата конца)"""
+    today = datetime.now().date()
+    match = PERIOD_PATTERN.search(text)
+    if not match:
+        return text.strip(), today, today + timedelta(days=FIND_DAYS_AHEAD)
+
+    date_from = _parse_date(match.group(1), today)
+    date_to = _parse_date(match.group(2), today) if match.group(2) else date_from
+    if date_to < date_from:
+        date_to = date_to.replace(year=date_to.year + 1)
+    return text[:match.start()].strip(), date_from, date_to
+
+
+def _parse_date(value: str, today):
+    parts = value.split(".")
+    if len(parts) == 3:
+        return datetime.strptime(value, "%d.%m.%Y").date()
+
+    date = datetime.strptime(f"{value}.{today.year}", "%d.%m.%Y").date()
+    # Дата без года, которая уже давно прошла, относится к следующему году (поиск в декабре на январь)
+    if date < today - timedelta(days=180):
+        date = date.replace(year=today.year + 1)
+    return date
@@ -1,12 +1,10 @@
 from maxapi import Router
 from maxapi.types import MessageCreated, Command
-import os
 
-from db.db_operations import get_user_subscriptions, get_entity_name_by_type, get_campus_by_place_id
+from db.db_operations import get_user_subscriptions, get_entity_names
+from db.snapshot_store import current_db_path
 
 
-DB_PATH = os.getenv("SQLITE_PATH")
-
 schedule_handler = Router()
 
 
@@ -19,18 +17,16 @@ async def cmd_schedules(event: MessageCreated):
         await event.message.answer("❌ У вас нет активных подписок.")
         return
 
+    names = get_entity_names(current_db_path(), subs)
     text = "📅 Ваши подписки:\n\n"
     for stype, ids in subs.items():
         if not ids:
             continue
         for eid in ids:
-            title = await get_entity_name_by_type(DB_PATH, stype, eid)
+            title, campus = names[stype][eid]
             emoji = "👥" if stype == "group" else "👨‍🏫" if stype == "teacher" else "🏫"
-            if stype == "place":
-                campus = get_campus_by_place_id(eid)
-                if campus:
-                    text += f"{emoji} {title} ({campus})"
-            else:
-                text += f"{emoji} {title}\n"
+            if campus:
+                title = f"{title} ({campus})"
+            text += f"{emoji} {title}\n"
 
     await event.message.answer(text)
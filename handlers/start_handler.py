@@ -14,9 +14,11 @@ async def cmd_start(event: MessageCreated):
         "/week - На неделю\n"
         "/today - На сегодня\n"
         "/tomorrow - На завтра\n"
+        "/find - Поиск занятий по дисциплине\n"
         "/subscribe - Подписаться на выбранный тип\n"
         "/unsubscribe - Отписаться\n"
         "/daily - Управление ежедневной подпиской\n\n"
         "💡 Также можно использовать:\n"
-        "/subscribe ИКБО-01-17 или /subscribe Акатьев Я. А."
+        "/subscribe ИКБО-01-17 или /subscribe Акатьев Я. А.\n"
+        "/find линейная алгебра 20.12-30.12"
     )
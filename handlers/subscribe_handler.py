@@ -1,22 +1,14 @@
 from maxapi import Router, F
 from maxapi.types import MessageCreated, MessageCallback, Command, CallbackButton, ButtonsPayload
 from maxapi.context.state_machine import StatesGroup, State
-from maxapi.context.context import MemoryContext
 
 from db.db_operations import add_subscription, find_entity_by_name, get_campus_by_place_id
 from utils.detect import detect_subscribe_type
 from utils.keyboards import get_subscribe_type_kb
+from utils.fsm import get_context
 
 subscribe_handler = Router()
 
-user_contexts: dict[int, MemoryContext] = {}
-
-
-def get_context(chat_id: int) -> MemoryContext:
-    if chat_id not in user_contexts:
-        user_contexts[chat_id] = MemoryContext(chat_id, chat_id)
-    return user_contexts[chat_id]
-
 
 class SubscribeStates(StatesGroup):
     choosing_type = State()
@@ -27,7 +19,7 @@ class SubscribeStates(StatesGroup):
 @subscribe_handler.message_created(Command("subscribe"))
 async def subscribe_start(event: MessageCreated):
     chat_id = event.message.recipient.chat_id
-    ctx = get_context(chat_id)
+    ctx = get_context(chat_id, "subscribe")
 
     text = event.message.body.text or ""
     args = text.split(maxsplit=1)
@@ -77,7 +69,7 @@ async def subscribe_start(event: MessageCreated):
 @subscribe_handler.message_callback(F.callback.payload.startswith("subscribe_"))
 async def choose_type(callback: MessageCallback):
     chat_id = callback.message.recipient.chat_id
-    ctx = get_context(chat_id)
+    ctx = get_context(chat_id, "subscribe")
 
     sub_type = callback.callback.payload.split("_")[1]
     await ctx.update_data(sub_type=sub_type)
@@ -95,7 +87,7 @@ async def choose_type(callback: MessageCallback):
 @subscribe_handler.message_created(F.message.body.text & ~F.message.body.text.startswith("/"))
 async def process_name_or_number(event: MessageCreated):
     chat_id = event.message.recipient.chat_id
-    ctx = get_context(chat_id)
+    ctx = get_context(chat_id, "subscribe")
 
     text = event.message.body.text.strip()
     current_state = await ctx.get_state()
@@ -172,7 +164,7 @@ async def process_name_or_number(event: MessageCreated):
 @subscribe_handler.message_callback(F.callback.payload == "cancel_search")
 async def cancel_search(callback: MessageCallback):
     chat_id = callback.message.recipient.chat_id
-    ctx = get_context(chat_id)
+    ctx = get_context(chat_id, "subscribe")
     await callback.message.delete()
     await ctx.clear()
     await callback.message.answer("❌ Поиск отменен.")
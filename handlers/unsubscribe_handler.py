@@ -1,27 +1,19 @@
 from maxapi import Router, F
 from maxapi.types import MessageCreated, MessageCallback, CallbackButton, ButtonsPayload, Command
-from maxapi.context.context import MemoryContext
-from db.db_operations import get_user_subscriptions, remove_subscription, get_entity_name_by_type, find_entity_by_name
+from db.db_operations import get_user_subscriptions, remove_subscription, get_entity_name_by_type, \
+    find_entity_by_name, get_entity_names
+from db.snapshot_store import current_db_path
 from utils.detect import detect_subscribe_type
-import os
-
-DB_PATH = os.getenv("SQLITE_PATH")
+from utils.fsm import get_context
 
 unsubscribe_handler = Router()
-user_contexts: dict[int, MemoryContext] = {}
-
-
-def get_context(chat_id: int) -> MemoryContext:
-    if chat_id not in user_contexts:
-        user_contexts[chat_id] = MemoryContext(chat_id, chat_id)
-    return user_contexts[chat_id]
 
 
 @unsubscribe_handler.message_created(Command("unsubscribe"))
 async def unsubscribe_start(event: MessageCreated):
     message = event.message
     chat_id = message.recipient.chat_id
-    ctx = get_context(chat_id)
+    ctx = get_context(chat_id, "unsubscribe")
 
     args = message.body.text.split(maxsplit=1)
     subs = await get_user_subscriptions(chat_id)
@@ -61,7 +53,7 @@ async def unsubscribe_start(event: MessageCreated):
 @unsubscribe_handler.message_callback(F.callback.payload.regexp(r"^unsubscribe_(group|teacher|place)$"))
 async def choose_unsubscribe_type(callback: MessageCallback):
     chat_id = callback.message.recipient.chat_id
-    ctx = get_context(chat_id)
+    ctx = get_context(chat_id, "unsubscribe")
     sub_type = callback.callback.payload.split("_")[1]
 
     subs = await get_user_subscriptions(chat_id)
@@ -70,9 +62,10 @@ async def choose_unsubscribe_type(callback: MessageCallback):
         await callback.answer()
         return
 
+    names = get_entity_names(current_db_path(), {sub_type: subs[sub_type]})[sub_type]
     buttons = []
     for eid in subs[sub_type]:
-        title = await get_entity_name_by_type(DB_PATH, sub_type, eid)
+        title, _ = names[eid]
         emoji = "👥" if sub_type == "group" else "👨‍🏫" if sub_type == "teacher" else "🏫"
         buttons.append([CallbackButton(text=f"{emoji} {title}", payload=f"unsubscribe_item_{sub_type}_{eid}")])
     buttons.append([CallbackButton(text="❌ Отмена", payload="cancel_unsubscribe")])
@@ -86,12 +79,12 @@ async def choose_unsubscribe_type(callback: MessageCallback):
 @unsubscribe_handler.message_callback(F.callback.payload.regexp(r"^unsubscribe_item_"))
 async def handle_unsubscribe_item(callback: MessageCallback):
     chat_id = callback.message.recipient.chat_id
-    ctx = get_context(chat_id)
+    ctx = get_context(chat_id, "unsubscribe")
     parts = callback.callback.payload.split("_")
     sub_type = parts[2]
     entity_id = int(parts[3])
 
-    title = await get_entity_name_by_type(DB_PATH, sub_type, entity_id)
+    title = await get_entity_name_by_type(current_db_path(), sub_type, entity_id)
     success = await remove_subscription(chat_id, sub_type, entity_id)
 
     if success:
@@ -106,7 +99,7 @@ async def handle_unsubscribe_item(callback: MessageCallback):
 @unsubscribe_handler.message_callback(F.callback.payload == "cancel_unsubscribe")
 async def cancel_unsubscribe(callback: MessageCallback):
     chat_id = callback.message.recipient.chat_id
-    ctx = get_context(chat_id)
+    ctx = get_context(chat_id, "unsubscribe")
     await callback.message.delete()
     await callback.message.answer("❌ Отмена операции отписки.")
     await ctx.clear()
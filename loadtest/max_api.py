@@ -0,0 +1,83 @@
+"""
+Локальные заглушки Max API (/messages) и OAuth (/token).
+
+/messages ограничивает частоту запросов (общую и на чат) и отвечает 429 с Retry-After,
+а также может отвечать ошибками 500 с заданной вероятностью.
+"""
+import time
+import random
+import asyncio
+from dataclasses import dataclass, field
+
+from aiohttp import web
+
+from utils.ratelimit import TokenBucket
+
+
+@dataclass
+class MaxApiConfig:
+    # Запросов в секунду на весь бот и на один чат; 0 — без ограничения
+    global_rps: float = 30.0
+    per_chat_rps: float = 1.0
+    latency_ms: float = 30.0
+    jitter_ms: float = 15.0
+    error_rate: float = 0.0
+    token_expires_in: int = 3600
+    seed: int = 42
+
+
+@dataclass
+class MaxApiStats:
+    delivered: int = 0
+    rate_limited: int = 0
+    errors: int = 0
+    tokens_issued: int = 0
+    chats: set[int] = field(default_factory=set)
+    latencies: list[float] = field(default_factory=list)
+
+
+def build_max_app(config: MaxApiConfig) -> web.Application:
+    app = web.Application()
+    stats = MaxApiStats()
+    rnd = random.Random(config.seed)
+    global_bucket = TokenBucket(config.global_rps) if config.global_rps else None
+    chat_buckets: dict[int, TokenBucket] = {}
+    app["stats"] = stats
+
+    async def messages(request: web.Request) -> web.Response:
+        received = time.monotonic()
+        chat_id = int(request.query.get("chat_id", 0))
+        await request.read()
+
+        wait = global_bucket.take() if global_bucket else 0.0
+        if not wait and config.per_chat_rps:
+            bucket = chat_buckets.setdefault(chat_id, TokenBucket(config.per_chat_rps))
+            wait = bucket.take()
+        if wait:
+            stats.rate_limited += 1
+            return web.json_response({"code": "too.many.requests", "message": "Rate limit exceeded"},
+                                     status=429, headers={"Retry-After": f"{wait:.3f}"})
+
+        await asyncio.sleep(max(config.latency_ms + rnd.uniform(-config.jitter_ms, config.jitter_ms), 0) / 1000)
+
+        if rnd.random() < config.error_rate:
+            stats.errors += 1
+            return web.json_response({"code": "internal.error", "message": "injected"}, status=500)
+
+        stats.delivered += 1
+        stats.chats.add(chat_id)
+        stats.latencies.append(time.monotonic() - received)
+        return web.json_response({"message": {"recipient": {"chat_id": chat_id}, "body": {"mid": str(stats.delivered)}}})
+
+    async def token(request: web.Request) -> web.Response:
+        await request.post()
+        stats.tokens_issued += 1
+        return web.json_response({
+            "access_token": f"loadtest-{stats.tokens_issued}",
+            "token_type": "Bearer",
+            "expires_in": config.token_expires_in,
+        })
+
+    app.router.add_post("/messages", messages)
+    app.router.add_post("/token", token)
+    return app
@@ -0,0 +1,36 @@
+import os
+import hashlib
+
+
+class RecordingStore:
+    """
+    Записанные ответы настоящих сервисов: файл на пару (метод, тело запроса).
+    Ключ — sha256 тела запроса, поэтому воспроизводятся ровно те запросы, что были записаны.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _path(self, method: str, request_body: bytes) -> str:
+        digest = hashlib.sha256(request_body).hexdigest()
+        return os.path.join(self.directory, method, f"{digest}.bin")
+
+    def save(self, method: str, request_body: bytes, response: bytes):
+        path = self._path(method, request_body)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = path + ".temp"
+        with open(temp_path, "wb") as f:
+            f.write(response)
+        os.replace(temp_path, path)
+
+    def load(self, method: str, request_body: bytes) -> bytes | None:
+        try:
+            with open(self._path(method, request_body), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def count(self) -> int:
+        if not os.path.isdir(self.directory):
+            return 0
+        return sum(len(files) for _, _, files in os.walk(self.directory))
@@ -0,0 +1,210 @@
+"""
+Прогон крон-задач против локальных заглушек: PersonalScheduleService, OAuth и Max API.
+
+PostgreSQL остаётся настоящим (подписки, состояние рассылки), поэтому запускать только на тестовой базе:
+с --seed-chats раннер создаёт синтетические чаты с подписками и удаляет их после прогона.
+
+Примеры:
+    python -m loadtest.run send_updates --seed-chats 500 --updated-ratio 0.3
+    python -m loadtest.run daily --seed-chats 200 --per-chat-rps 1 --global-rps 30
+    python -m loadtest.run send_updates --record captures/ --upstream https://schedule-of.mirea.ru
+    python -m loadtest.run send_updates --replay captures/
+"""
+import os
+import time
+import random
+import asyncio
+import logging
+import argparse
+import sqlite3
+import statistics
+
+from aiohttp import web
+
+from grpc import personal_schedule_pb2 as pb2
+from loadtest.max_api import MaxApiConfig, build_max_app
+from loadtest.recording import RecordingStore
+from loadtest.schedule_service import ScheduleServiceConfig, build_schedule_app
+
+logger = logging.getLogger(__name__)
+
+# Синтетические чаты создаются с id от этого значения, чтобы не пересекаться с настоящими
+LOADTEST_CHAT_BASE = 10 ** 12
+
+SNAPSHOT_TABLES = {
+    pb2.SCHEDULE_TYPE_GROUP: "academic_group",
+    pb2.SCHEDULE_TYPE_TEACHER: "teacher",
+    pb2.SCHEDULE_TYPE_AUDITORIUM: "place",
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон крон-задач на локальных заглушках")
+    parser.add_argument("scenario", choices=["send_updates", "daily"])
+    parser.add_argument("--schedules", type=int, default=300, help="расписаний каждого типа (без снапшота)")
+    parser.add_argument("--updated-ratio", type=float, default=0.2)
+    parser.add_argument("--diff-slots", type=int, default=10)
+    parser.add_argument("--diff-events", type=int, default=3)
+    parser.add_argument("--grpc-latency-ms", type=float, default=20)
+    parser.add_argument("--grpc-error-rate", type=float, default=0.0)
+    parser.add_argument("--global-rps", type=float, default=30)
+    parser.add_argument("--per-chat-rps", type=float, default=1)
+    parser.add_argument("--max-latency-ms", type=float, default=30)
+    parser.add_argument("--max-error-rate", type=float, default=0.0)
+    parser.add_argument("--seed-chats", type=int, default=0, help="создать синтетические чаты с подписками")
+    parser.add_argument("--subs-per-chat", type=int, default=3)
+    parser.add_argument("--keep-seed", action="store_true", help="не удалять синтетические чаты после прогона")
+    parser.add_argument("--with-locks", action="store_true", help="запускать задачу с advisory-блокировками")
+    parser.add_argument("--record", metavar="DIR", help="записывать ответы настоящего сервиса в DIR")
+    parser.add_argument("--upstream", help="адрес настоящего сервиса для --record")
+    parser.add_argument("--replay", metavar="DIR", help="отвечать записанными ответами из DIR")
+    return parser.parse_args()
+
+
+def snapshot_schedule_ids(limit: int) -> dict[int, list[int]] | None:
+    """id расписаний из текущего SQLite-снапшота, чтобы daily_notifier находил занятия"""
+    db_path = os.getenv("SQLITE_PATH")
+    if not db_path or not os.path.exists(db_path):
+        return None
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        return {
+            stype: [row[0] for row in conn.execute(f'SELECT id FROM "{table}" ORDER BY id LIMIT ?', (limit,))]
+            for stype, table in SNAPSHOT_TABLES.items()
+        }
+    finally:
+        conn.close()
+
+
+async def start_app(app: web.Application) -> tuple[web.AppRunner, str]:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+async def seed_chats(count: int, per_chat: int, schedule_ids: dict[int, list[int]]) -> list[int]:
+    from sqlalchemy import text
+    from db.db_operations import get_db_session
+
+    rnd = random.Random(7)
+    columns = {
+        pb2.SCHEDULE_TYPE_GROUP: "group_ids",
+        pb2.SCHEDULE_TYPE_TEACHER: "teacher_ids",
+        pb2.SCHEDULE_TYPE_AUDITORIUM: "auditorium_ids",
+    }
+    rows = []
+    for i in range(count):
+        subs = {column: [] for column in columns.values()}
+        for _ in range(per_chat):
+            stype = rnd.choice(list(columns))
+            subs[columns[stype]].append(str(rnd.choice(schedule_ids[stype])))
+        rows.append({"chat_id": LOADTEST_CHAT_BASE + i, **{k: ",".join(v) or None for k, v in subs.items()}})
+
+    async with get_db_session() as session:
+        await session.execute(text("""
+            INSERT INTO max_subscribes (chat_id, teacher_ids, group_ids, auditorium_ids, everyday_nots)
+            VALUES (:chat_id, :teacher_ids, :group_ids, :auditorium_ids, TRUE)
+            ON CONFLICT (chat_id) DO UPDATE SET teacher_ids = EXCLUDED.teacher_ids,
+                group_ids = EXCLUDED.group_ids, auditorium_ids = EXCLUDED.auditorium_ids, everyday_nots = TRUE
+        """), rows)
+    return [row["chat_id"] for row in rows]
+
+
+async def remove_seeded_chats():
+    from sqlalchemy import text
+    from db.db_operations import get_db_session
+
+    async with get_db_session() as session:
+        await session.execute(text("DELETE FROM max_subscribes WHERE chat_id >= :base"), {"base": LOADTEST_CHAT_BASE})
+
+
+async def run_scenario(scenario: str, with_locks: bool):
+    # Модули крон-задач читают адреса сервисов при импорте — импортируются после настройки окружения
+    from cronjobs.main import run_send_updates, run_daily_notifier
+
+    job = run_send_updates if scenario == "send_updates" else run_daily_notifier
+    if not with_locks:
+        job = job.__wrapped__
+    await job()
+
+
+def print_report(scenario: str, elapsed: float, schedule_app: web.Application, max_app: web.Application):
+    grpc_state, max_stats = schedule_app["state"], max_app["stats"]
+    rpc_total = sum(grpc_state.calls.values())
+    print(f"\n=== {scenario}: {elapsed:.2f} с ===")
+    print(f"gRPC: {rpc_total} вызовов ({rpc_total / elapsed:.1f}/с), внедрённых ошибок: {grpc_state.errors}")
+    for method, calls in sorted(grpc_state.calls.items()):
+        print(f"  {method:<28} {calls}")
+
+    sent = max_stats.delivered + max_stats.rate_limited + max_stats.errors
+    print(f"Max API: {sent} запросов, доставлено {max_stats.delivered} в {len(max_stats.chats)} чатов, "
+          f"429: {max_stats.rate_limited}, 500: {max_stats.errors}")
+    if len(max_stats.latencies) >= 2:
+        latencies = sorted(max_stats.latencies)
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(f"  задержка ответа: p50 {statistics.median(latencies) * 1000:.0f} мс, p99 {p99 * 1000:.0f} мс")
+    print(f"OAuth: выдано токенов {max_stats.tokens_issued}")
+
+    from grpc.schedule_client import schedule_upstream
+    print(f"Upstream {schedule_upstream.describe()}")
+
+
+async def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    store = RecordingStore(args.record or args.replay) if (args.record or args.replay) else None
+    if args.record and not args.upstream:
+        raise SystemExit("--record требует --upstream")
+
+    schedule_ids = snapshot_schedule_ids(args.schedules)
+    schedule_app = build_schedule_app(ScheduleServiceConfig(
+        schedules=args.schedules,
+        schedule_ids=schedule_ids,
+        updated_ratio=args.updated_ratio,
+        diff_slots=args.diff_slots,
+        diff_events=args.diff_events,
+        latency_ms=args.grpc_latency_ms,
+        error_rate=args.grpc_error_rate,
+    ), store=store, upstream=args.upstream if args.record else None)
+    max_app = build_max_app(MaxApiConfig(
+        global_rps=args.global_rps,
+        per_chat_rps=args.per_chat_rps,
+        latency_ms=args.max_latency_ms,
+        error_rate=args.max_error_rate,
+    ))
+
+    schedule_runner, schedule_url = await start_app(schedule_app)
+    max_runner, max_url = await start_app(max_app)
+
+    os.environ["SCHEDULE_GRPC_URL"] = schedule_url
+    os.environ["MAX_API_URL"] = f"{max_url}/messages"
+    os.environ["MAX_BOT_TOKEN"] = "loadtest"
+    if not args.record:
+        # При записи токен нужен настоящий — его выдаёт настоящий OAuth
+        os.environ["TOKEN_URL"] = f"{max_url}/token"
+
+    try:
+        if args.seed_chats:
+            ids = schedule_ids or {stype: list(range(1, args.schedules + 1)) for stype in SNAPSHOT_TABLES}
+            await seed_chats(args.seed_chats, args.subs_per_chat, ids)
+
+        started = time.monotonic()
+        await run_scenario(args.scenario, args.with_locks)
+        print_report(args.scenario, time.monotonic() - started, schedule_app, max_app)
+        if args.record:
+            print(f"Записано ответов: {store.count()} в {args.record}")
+    finally:
+        if args.seed_chats and not args.keep_seed:
+            await remove_seeded_chats()
+        from grpc.transport import close_shared_session
+        await close_shared_session()
+        await schedule_runner.cleanup()
+        await max_runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
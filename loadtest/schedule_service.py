@@ -0,0 +1,213 @@
+"""
+Локальная заглушка PersonalScheduleService (gRPC-Web поверх aiohttp).
+
+Режимы:
+- синтетика: расписания 1..N каждого типа, доля обновлённых, дифф заданного размера, задержка и ошибки;
+- запись: запросы проксируются в настоящий сервис, ответы сохраняются в RecordingStore;
+- воспроизведение: ответы берутся из RecordingStore.
+"""
+import random
+import asyncio
+import logging
+from dataclasses import dataclass, field
+
+import aiohttp
+from aiohttp import web
+
+from grpc import personal_schedule_pb2 as pb2
+from grpc.grpc_web import GrpcWebError, GrpcWebFrameError, decode_unary, encode_frame, encode_trailers
+from loadtest.recording import RecordingStore
+from loadtest.synthetic import build_synthetic_diff
+
+logger = logging.getLogger(__name__)
+
+SERVICE_PATH = "/rtu.schedule.api.PersonalScheduleService"
+
+SCHEDULE_TYPES = {
+    pb2.SCHEDULE_TYPE_GROUP: "Группа",
+    pb2.SCHEDULE_TYPE_TEACHER: "Преподаватель",
+    pb2.SCHEDULE_TYPE_AUDITORIUM: "Аудитория",
+}
+
+
+@dataclass
+class ScheduleServiceConfig:
+    # id расписаний каждого типа; по умолчанию 1..schedules
+    schedules: int = 300
+    schedule_ids: dict[int, list[int]] | None = None
+    updated_ratio: float = 0.2
+    diff_slots: int = 10
+    diff_events: int = 3
+    snapshot_id: str = "1000"
+    latency_ms: float = 20.0
+    jitter_ms: float = 10.0
+    # Доля запросов, на которые отвечаем grpc-status UNAVAILABLE
+    error_rate: float = 0.0
+    seed: int = 42
+
+
+@dataclass
+class ScheduleServiceState:
+    subscribed: set[tuple[int, int]] = field(default_factory=set)
+    updated: set[tuple[int, int]] = field(default_factory=set)
+    diffs: dict[tuple[int, int], bytes] = field(default_factory=dict)
+    calls: dict[str, int] = field(default_factory=dict)
+    errors: int = 0
+
+
+def build_state(config: ScheduleServiceConfig) -> ScheduleServiceState:
+    rnd = random.Random(config.seed)
+    ids = config.schedule_ids or {stype: list(range(1, config.schedules + 1)) for stype in SCHEDULE_TYPES}
+
+    state = ScheduleServiceState()
+    state.subscribed = {(stype, sid) for stype, sids in ids.items() for sid in sids}
+    state.updated = {key for key in state.subscribed if rnd.random() < config.updated_ratio}
+
+    # Все обновлённые расписания получают один и тот же дифф: важен размер ответа, а не содержимое
+    diff = build_synthetic_diff(config.diff_slots, config.diff_events)
+    diff.snapshot_id = config.snapshot_id
+    response = pb2.GetPersonalScheduleUpdatesResponse(exists=diff).SerializeToString()
+    state.diffs = {key: response for key in state.updated}
+    return state
+
+
+def _title(key: tuple[int, int]) -> str:
+    stype, sid = key
+    return f"{SCHEDULE_TYPES.get(stype, 'Расписание')} {sid}"
+
+
+def _schedule_key(request) -> tuple[int, int]:
+    return request.schedule_id.schedule_type, request.schedule_id.schedule_id
+
+
+def handle_rpc(state: ScheduleServiceState, config: ScheduleServiceConfig, method: str, body: memoryview) -> bytes:
+    """Синтетический ответ метода (сериализованное сообщение)"""
+    if method == "GetSubscribedSchedules":
+        response = pb2.GetSubscribedSchedulesResponse()
+        for key in sorted(state.subscribed):
+            entity = response.schedules.add()
+            entity.schedule_id.schedule_type, entity.schedule_id.schedule_id = key
+            entity.long_title = entity.short_title = _title(key)
+            entity.is_updated = key in state.updated
+        return response.SerializeToString()
+
+    if method == "UpdateSubscribedSchedules":
+        request = pb2.UpdateSubscribedSchedulesRequest()
+        request.ParseFromString(body)
+        state.subscribed.update((s.schedule_type, s.schedule_id) for s in request.schedule_id)
+        return pb2.UpdateSubscribedSchedulesResponse(
+            state=pb2.UpdateSubscribedSchedulesResponse.UPDATE_SUBSCRIBED_SCHEDULES_RESPONSE_OK
+        ).SerializeToString()
+
+    if method == "GetPersonalScheduleUpdates":
+        request = pb2.GetPersonalScheduleUpdatesRequest()
+        request.ParseFromString(body)
+        key = _schedule_key(request)
+        if key in state.updated:
+            return state.diffs[key]
+        response = pb2.GetPersonalScheduleUpdatesResponse(long_title=_title(key))
+        response.no_updates.SetInParent()
+        return response.SerializeToString()
+
+    if method == "AcceptScheduleUpdates":
+        request = pb2.AcceptScheduleUpdatesRequest()
+        request.ParseFromString(body)
+        state.updated.discard(_schedule_key(request))
+        return pb2.AcceptScheduleUpdatesResponse(
+            status=pb2.AcceptScheduleUpdatesResponse.ACCEPT_SCHEDULE_UPDATES_RESPONSE_STATUS_OK
+        ).SerializeToString()
+
+    if method == "GetScheduleTitle":
+        request = pb2.GetScheduleTitleRequest()
+        request.ParseFromString(body)
+        title = _title(_schedule_key(request))
+        return pb2.GetScheduleTitleResponse(long_title=title, short_title=title).SerializeToString()
+
+    if method == "GetWrappedSchedule":
+        request = pb2.GetWrappedScheduleRequest()
+        request.ParseFromString(body)
+        title = _title(_schedule_key(request))
+        response = pb2.GetWrappedScheduleResponse(long_title=title, short_title=title)
+        for day in range(1, 7):
+            for number in range(1, 4):
+                event = response.events.add()
+                event.time_slot.day_of_week = day
+                event.time_slot.number_in_day = number
+                event.time_slot.week_parity = pb2.WEEK_PARITY_WEEKLY
+                lesson = event.lessons.add(discipline=f"Дисциплина {day}-{number}", begin_time=540, end_time=630)
+                lesson.lesson_type.value = "ПР"
+                lesson.groups.append(title)
+                lesson.time_details.weeks_include.extend(range(1, 17))
+        return response.SerializeToString()
+
+    raise KeyError(method)
+
+
+def build_schedule_app(config: ScheduleServiceConfig, store: RecordingStore | None = None,
+                       upstream: str | None = None) -> web.Application:
+    """
+    Приложение заглушки. С upstream — режим записи (прокси с сохранением ответов в store),
+    со store без upstream — воспроизведение, иначе — синтетика.
+    """
+    app = web.Application()
+    state = build_state(config)
+    rnd = random.Random(config.seed)
+    app["state"] = state
+
+    async def rpc(request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        body = await request.read()
+        state.calls[method] = state.calls.get(method, 0) + 1
+
+        if upstream:
+            return await _proxy(request, method, body)
+
+        delay = max(config.latency_ms + rnd.uniform(-config.jitter_ms, config.jitter_ms), 0) / 1000
+        await asyncio.sleep(delay)
+
+        if rnd.random() < config.error_rate:
+            state.errors += 1
+            return web.Response(headers={"grpc-status": "14", "grpc-message": "injected"},
+                                content_type="application/grpc-web+proto")
+
+        if store is not None:
+            message = store.load(method, body)
+            if message is None:
+                return web.Response(headers={"grpc-status": "5", "grpc-message": "not recorded"},
+                                    content_type="application/grpc-web+proto")
+        else:
+            try:
+                message = handle_rpc(state, config, method, decode_unary(body))
+            except KeyError:
+                return web.Response(headers={"grpc-status": "12"}, content_type="application/grpc-web+proto")
+
+        return web.Response(body=encode_frame(message) + encode_trailers(),
+                            content_type="application/grpc-web+proto")
+
+    async def _proxy(request: web.Request, method: str, body: bytes) -> web.Response:
+        headers = {k: v for k, v in request.headers.items()
+                   if k.lower() in ("authorization", "content-type", "x-grpc-web")}
+        async with app["upstream_session"].post(f"{upstream}{SERVICE_PATH}/{method}", data=body,
+                                               headers=headers) as resp:
+            raw = await resp.read()
+            if resp.status == 200:
+                try:
+                    store.save(method, body, bytes(decode_unary(raw, resp.headers)))
+                except (GrpcWebError, GrpcWebFrameError) as e:
+                    logger.warning(f"Ответ {method} не записан: {e}")
+            return web.Response(status=resp.status, body=raw, headers={
+                k: v for k, v in resp.headers.items() if k.lower().startswith("grpc-") or k.lower() == "content-type"
+            })
+
+    async def upstream_session(app: web.Application):
+        app["upstream_session"] = aiohttp.ClientSession()
+        yield
+        await app["upstream_session"].close()
+
+    if upstream:
+        if store is None:
+            raise ValueError("Для записи ответов нужен RecordingStore")
+        app.cleanup_ctx.append(upstream_session)
+
+    app.router.add_post(SERVICE_PATH + "/{method}", rpc)
+    return app
@@ -0,0 +1,38 @@
+from grpc import personal_schedule_pb2 as pb2
+from google.type import dayofweek_pb2
+
+
+def build_synthetic_diff(slots: int = 40, events: int = 10):
+    """Строит дифф одного расписания: slots слотов по 2 изменения и events изменений событий"""
+    diff = pb2.GetPersonalScheduleUpdatesResponse.GetPersonalScheduleUpdatesResponseExists(snapshot_id="42")
+    diff.previous_time.FromSeconds(1756670400)
+    diff.current_time.FromSeconds(1756756800)
+
+    for i in range(slots):
+        td = diff.timetable_diff.add()
+        td.time_slot.day_of_week = dayofweek_pb2.DayOfWeek.Value("MONDAY") + i % 6
+        td.time_slot.number_in_day = i % 7 + 1
+        td.time_slot.week_parity = pb2.WeekParity.Value("WEEK_PARITY_ODD")
+        for kind in ("previous", "current"):
+            cell = td.cells.add()
+            lesson = getattr(cell, kind)
+            lesson.discipline = f"Дисциплина {i}"
+            lesson.lesson_type.value = "ЛК"
+            lesson.groups.extend([f"ИКБО-{g:02d}-22" for g in range(5)])
+            lesson.teachers.extend(["Иванов И. И.", "Петров П. П."])
+            lesson.auditoriums.append(f"А-{i}")
+            lesson.time_details.weeks_include.extend(range(1, 17, 2))
+            lesson.begin_time, lesson.end_time = 540, 630
+
+    for i in range(events):
+        ed = diff.event_diff.add()
+        ed.time_slot.start.FromSeconds(1756670400 + i * 86400)
+        ed.time_slot.end.FromSeconds(1756670400 + i * 86400 + 5400)
+        element = ed.diff.add()
+        element.current.discipline = f"Экзамен {i}"
+        element.current.lesson_type = "Экзамен"
+        element.current.groups.append("ИКБО-01-22")
+        element.current.teachers.append("Иванов И. И.")
+        element.current.auditoriums.append("А-1")
+
+    return diff
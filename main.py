@@ -9,6 +9,12 @@ from handlers.schedule_handler import schedule_handler
 from handlers.days_handler import day_handler
 from handlers.unsubscribe_handler import unsubscribe_handler
 from handlers.daily_handler import daily_handler
+from handlers.find_handler import find_handler
+from utils.latency import report_latency
+from utils.metrics import METRICS_PORT, start_metrics_server
+from utils.middlewares import LatencyMiddleware, MetricsMiddleware, RateLimitMiddleware, SnapshotMiddleware
+from utils.sharding import BOT_SHARDS, run_sharded, serve_shard
+from utils.webhook import BOT_MODE, run_webhook
 
 logging.basicConfig(level=logging.INFO)
 
@@ -19,30 +25,59 @@ dp = Dispatcher()
 
 
 async def register_handlers():
+    dp.middleware(MetricsMiddleware())
+    dp.middleware(LatencyMiddleware())
+    dp.middleware(RateLimitMiddleware())
+    dp.middleware(SnapshotMiddleware())
     dp.include_routers(daily_handler)
     dp.include_routers(unsubscribe_handler)
     dp.include_routers(day_handler)
     dp.include_routers(main_handler)
     dp.include_routers(schedule_handler)
     dp.include_routers(subscribe_handler)
+    dp.include_routers(find_handler)
 
 
+def run_shard(index: int, shard_queue):
+    """Точка входа процесса-обработчика (BOT_SHARDS > 1): свои bot и dp, обновления — из очереди"""
+    logging.getLogger().handlers[0].setFormatter(
+        logging.Formatter(f"%(levelname)s:shard-{index}:%(name)s:%(message)s"))
+    asyncio.run(_shard_main(index, shard_queue))
 
-async def main():
+
+async def _shard_main(index: int, shard_queue):
     await register_handlers()
+    # Основной процесс занимает METRICS_PORT, обработчики — следующие порты
+    metrics = await start_metrics_server(METRICS_PORT + 1 + index if METRICS_PORT else 0)
+    reporter = asyncio.create_task(report_latency())
+    await serve_shard(dp, bot, shard_queue)
+
+
+async def main():
+    metrics = await start_metrics_server()
     await bot.change_info(
         commands=[
             BotCommand(name="start", description="Запустить бота"),
             BotCommand(name="today", description="Расписание на сегодня"),
             BotCommand(name="tomorrow", description="Расписание на завтра"),
             BotCommand(name="week", description="Расписание на неделю"),
+            BotCommand(name="find", description="Найти занятия по названию дисциплины"),
             BotCommand(name="schedules", description="Показать мои подписки"),
             BotCommand(name="subscribe", description="Подписаться на группу / преподавателя / аудиторию"),
             BotCommand(name="unsubscribe", description="Отписаться от подписки"),
             BotCommand(name="daily", description="Управление ежедневной рассылкой"),
         ]
     )
-    await dp.start_polling(bot)
+    if BOT_SHARDS > 1:
+        await run_sharded(bot, run_shard)
+        return
+
+    await register_handlers()
+    reporter = asyncio.create_task(report_latency())
+    if BOT_MODE == "webhook":
+        await run_webhook(dp, bot)
+    else:
+        await dp.start_polling(bot)
 
 if __name__ == '__main__':
     asyncio.run(main())
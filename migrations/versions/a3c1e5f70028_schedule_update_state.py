@@ -0,0 +1,44 @@
+"""schedule_update_state
+
+Revision ID: a3c1e5f70028
+Revises: 
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3c1e5f70028'
+down_revision: Union[str, Sequence[str], None] = None
+# Служебные таблицы — отдельная ветка: у установок уже есть своя корневая миграция init
+branch_labels: Union[str, Sequence[str], None] = ('service',)
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _table_exists(name: str) -> bool:
+    # В режиме --sql подключения к базе нет: таблица создаётся без проверки
+    return not op.get_context().as_sql and sa.inspect(op.get_bind()).has_table(name)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Таблица могла быть создана раньше через alembic revision --autogenerate
+    if _table_exists("schedule_update_state"):
+        return
+    op.create_table(
+        "schedule_update_state",
+        sa.Column("schedule_type", sa.Text(), nullable=False),
+        sa.Column("schedule_id", sa.BigInteger(), nullable=False),
+        sa.Column("sent_snapshot_id", sa.Text(), nullable=True),
+        sa.Column("accepted_snapshot_id", sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint("schedule_type", "schedule_id"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("schedule_update_state")
@@ -0,0 +1,40 @@
+"""cron_job_state
+
+Revision ID: b7d2f4a10032
+Revises: a3c1e5f70028
+Create Date: 2026-10-19 12:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7d2f4a10032'
+down_revision: Union[str, Sequence[str], None] = 'a3c1e5f70028'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _table_exists(name: str) -> bool:
+    # В режиме --sql подключения к базе нет: таблица создаётся без проверки
+    return not op.get_context().as_sql and sa.inspect(op.get_bind()).has_table(name)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if _table_exists("cron_job_state"):
+        return
+    op.create_table(
+        "cron_job_state",
+        sa.Column("job_id", sa.Text(), nullable=False),
+        sa.Column("last_scheduled_run_time", sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint("job_id"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("cron_job_state")
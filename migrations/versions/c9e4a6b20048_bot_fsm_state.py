@@ -0,0 +1,43 @@
+"""bot_fsm_state
+
+Revision ID: c9e4a6b20048
+Revises: b7d2f4a10032
+Create Date: 2026-10-19 12:20:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c9e4a6b20048'
+down_revision: Union[str, Sequence[str], None] = 'b7d2f4a10032'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _table_exists(name: str) -> bool:
+    # В режиме --sql подключения к базе нет: таблица создаётся без проверки
+    return not op.get_context().as_sql and sa.inspect(op.get_bind()).has_table(name)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if _table_exists("bot_fsm_state"):
+        return
+    op.create_table(
+        "bot_fsm_state",
+        sa.Column("namespace", sa.Text(), nullable=False),
+        sa.Column("chat_id", sa.BigInteger(), nullable=False),
+        sa.Column("state", sa.Text(), nullable=True),
+        sa.Column("data", postgresql.JSONB(astext_type=sa.Text()), server_default="{}", nullable=False),
+        sa.PrimaryKeyConstraint("namespace", "chat_id"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("bot_fsm_state")
@@ -0,0 +1,83 @@
+import os
+import time
+import asyncio
+import logging
+import aiohttp
+from dotenv import load_dotenv
+
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+TOKEN_URL = os.getenv("TOKEN_URL")
+CLIENT_ID = os.getenv("CLIENT_ID")
+CLIENT_SECRET = os.getenv("CLIENT_SECRET")
+TOKEN_REFRESH_MARGIN = float(os.getenv("TOKEN_REFRESH_MARGIN", "60"))
+
+TOKEN_DATA = {
+    "grant_type": os.getenv("TOKEN_GRANT_TYPE", "client_credentials"),
+    "scope": os.getenv("TOKEN_SCOPE", "openid"),
+    "client_id": CLIENT_ID,
+    "client_secret": CLIENT_SECRET,
+}
+
+
+class TokenProvider:
+    """
+    Общий источник OAuth access token.
+    Токен кэшируется до истечения expires_in (с запасом refresh_margin секунд),
+    при конкурентных запросах обновляется только один раз.
+    """
+
+    def __init__(self, token_url: str, token_data: dict, refresh_margin: float = TOKEN_REFRESH_MARGIN):
+        self.token_url = token_url
+        self.token_data = token_data
+        self.refresh_margin = refresh_margin
+        self._token: str | None = None
+        self._expires_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def _is_valid(self) -> bool:
+        return self._token is not None and time.monotonic() < self._expires_at
+
+    async def get_token(self, session: aiohttp.ClientSession | None = None) -> str:
+        """Возвращает действующий токен, при необходимости запрашивая новый"""
+        if self._is_valid():
+            return self._token
+
+        async with self._lock:
+            # Пока ждали блокировку, токен мог обновить другой запрос
+            if self._is_valid():
+                return self._token
+
+            if session is None:
+                async with aiohttp.ClientSession() as own_session:
+                    await self._refresh(own_session)
+            else:
+                await self._refresh(session)
+            return self._token
+
+    def invalidate(self, token: str | None = None):
+        """Сбрасывает кэш (например, после ответа 401). Если передан token — только если он всё ещё текущий"""
+        if token is None or token == self._token:
+            self._token = None
+            self._expires_at = 0.0
+
+    async def _refresh(self, session: aiohttp.ClientSession):
+        try:
+            async with session.post(self.token_url, data=self.token_data) as resp:
+                resp.raise_for_status()
+                data = await resp.json()
+        except Exception as e:
+            logger.error(f"Ошибка при получении access token: {e}")
+            raise
+
+        # Если сервер не сообщил срок жизни, токен живёт до первого 401
+        expires_in = float(data.get("expires_in") or "inf")
+        self._token = data["access_token"]
+        self._expires_at = time.monotonic() + max(expires_in - self.refresh_margin, 0)
+        logger.info(f"Получен новый access token (expires_in={expires_in:.0f} с)")
+
+
+token_provider = TokenProvider(TOKEN_URL, TOKEN_DATA)
@@ -0,0 +1,104 @@
+"""
+Состояния диалогов (FSM) обработчиков.
+
+По умолчанию состояние хранится в памяти процесса (MemoryContext maxapi). С FSM_STORAGE=postgres оно хранится
+в таблице bot_fsm_state и видно всем процессам бота: так состояние переживает перезапуск и смену числа
+процессов-обработчиков (BOT_SHARDS). Контексты разделены по пространствам имён — у каждого роутера своё.
+"""
+import os
+import json
+import logging
+from typing import Any, Optional, Union
+
+from dotenv import load_dotenv
+from maxapi.context.context import MemoryContext
+from maxapi.context.state_machine import State, StatesGroup
+from sqlalchemy import text
+
+from db.db_operations import get_db_session
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# memory | postgres
+FSM_STORAGE = os.getenv("FSM_STORAGE", "memory")
+
+_memory_contexts: dict[tuple[str, int], MemoryContext] = {}
+
+
+def _resolve_state(name: str | None) -> State | str | None:
+    """Строку из базы обратно в State: обработчики сравнивают состояния по объекту"""
+    if name is None:
+        return None
+    for group in StatesGroup.__subclasses__():
+        for value in vars(group).values():
+            if isinstance(value, State) and value.name == name:
+                return value
+    return name
+
+
+class PostgresContext:
+    """
+    Совместимый с MemoryContext контекст, хранящий состояние и данные в bot_fsm_state.
+    Ошибки БД пробрасываются в обработчик: молча потерянное состояние сбрасывало бы диалог незаметно.
+    """
+
+    def __init__(self, namespace: str, chat_id: int):
+        self.namespace = namespace
+        self.chat_id = chat_id
+        self.user_id = chat_id
+
+    @property
+    def _key(self) -> dict:
+        return {"namespace": self.namespace, "chat_id": self.chat_id}
+
+    async def _row(self):
+        async with get_db_session(reraise=True) as session:
+            result = await session.execute(text("""
+                SELECT state, data::text AS data FROM bot_fsm_state
+                WHERE namespace = :namespace AND chat_id = :chat_id
+            """), self._key)
+            return result.first()
+
+    async def _execute(self, sql: str, **params):
+        async with get_db_session(reraise=True) as session:
+            await session.execute(text(sql), {**self._key, **params})
+
+    async def get_data(self) -> dict[str, Any]:
+        row = await self._row()
+        return json.loads(row.data) if row else {}
+
+    async def set_data(self, data: dict[str, Any]):
+        await self._execute("""
+            INSERT INTO bot_fsm_state (namespace, chat_id, data) VALUES (:namespace, :chat_id, CAST(:data AS jsonb))
+            ON CONFLICT (namespace, chat_id) DO UPDATE SET data = EXCLUDED.data
+        """, data=json.dumps(data, ensure_ascii=False))
+
+    async def update_data(self, **kwargs: Any) -> None:
+        await self._execute("""
+            INSERT INTO bot_fsm_state (namespace, chat_id, data) VALUES (:namespace, :chat_id, CAST(:data AS jsonb))
+            ON CONFLICT (namespace, chat_id) DO UPDATE SET data = bot_fsm_state.data || EXCLUDED.data
+        """, data=json.dumps(kwargs, ensure_ascii=False))
+
+    async def set_state(self, state: Optional[Union[State, str]] = None):
+        await self._execute("""
+            INSERT INTO bot_fsm_state (namespace, chat_id, state) VALUES (:namespace, :chat_id, :state)
+            ON CONFLICT (namespace, chat_id) DO UPDATE SET state = EXCLUDED.state
+        """, state=None if state is None else str(state))
+
+    async def get_state(self) -> Optional[State | str]:
+        row = await self._row()
+        return _resolve_state(row.state) if row else None
+
+    async def clear(self):
+        await self._execute("DELETE FROM bot_fsm_state WHERE namespace = :namespace AND chat_id = :chat_id")
+
+
+def get_context(chat_id: int, namespace: str) -> MemoryContext | PostgresContext:
+    if FSM_STORAGE == "postgres":
+        return PostgresContext(namespace, chat_id)
+    key = (namespace, chat_id)
+    if key not in _memory_contexts:
+        _memory_contexts[key] = MemoryContext(chat_id, chat_id)
+    return _memory_contexts[key]
@@ -0,0 +1,58 @@
+import os
+import asyncio
+import logging
+from collections import deque
+
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Сколько последних замеров учитывать в перцентилях
+LATENCY_WINDOW = int(os.getenv("LATENCY_WINDOW", "5000"))
+# Период записи p50/p99 в лог, секунды; 0 — не писать
+LATENCY_REPORT_INTERVAL = float(os.getenv("LATENCY_REPORT_INTERVAL", "60"))
+
+
+class LatencyWindow:
+    """Скользящее окно последних замеров задержки (в секундах) с перцентилями"""
+
+    registry: list["LatencyWindow"] = []
+
+    def __init__(self, name: str, size: int = LATENCY_WINDOW):
+        self.name = name
+        self._samples: deque[float] = deque(maxlen=size)
+        self.count = 0
+        LatencyWindow.registry.append(self)
+
+    def observe(self, seconds: float):
+        self._samples.append(max(seconds, 0.0))
+        self.count += 1
+
+    def percentile(self, q: float) -> float | None:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+    def describe(self) -> str:
+        if not self._samples:
+            return f"{self.name}: нет замеров"
+        return (f"{self.name}: p50 {self.percentile(0.5) * 1000:.1f} мс, "
+                f"p99 {self.percentile(0.99) * 1000:.1f} мс (n={len(self._samples)}, всего {self.count})")
+
+
+# От времени события на стороне Max (Update.timestamp) до начала обработки в диспетчере
+update_latency = LatencyWindow("update→handler")
+
+
+async def report_latency(interval: float = LATENCY_REPORT_INTERVAL):
+    """Периодически пишет в лог перцентили всех окон, в которых были замеры"""
+    if interval <= 0:
+        return
+    while True:
+        await asyncio.sleep(interval)
+        for window in LatencyWindow.registry:
+            if window.count:
+                logger.info(f"⏱ {window.describe()}")
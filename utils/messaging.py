@@ -1,29 +1,42 @@
 import logging
 import aiohttp
 import os
+import time
+
+from utils.metrics import Counter, Histogram
 
 
 MAX_TOKEN = os.getenv("MAX_BOT_TOKEN")
 MAX_API_URL = os.getenv("MAX_API_URL", "https://platform-api.max.ru/messages")
 
+messages_total = Counter("bot_messages_sent_total", "Сообщения, отправленные через Max API /messages",
+                         ["result"])
+message_send_seconds = Histogram("bot_message_send_seconds", "Время отправки сообщения через Max API")
+
 
 async def send_message(chat_id: int, text: str) -> bool:
     if not chat_id:
         logging.error("❌ chat_id is required")
+        messages_total.inc(result="invalid")
         return False
 
     params = {"access_token": MAX_TOKEN, "chat_id": chat_id}
     body = {"text": text, "attachments": None, "link": None, "format": "html"}
 
+    started = time.perf_counter()
     async with aiohttp.ClientSession() as session:
         try:
             async with session.post(MAX_API_URL, params=params, json=body, timeout=20) as resp:
                 resp_text = await resp.text()
                 logging.info(f"📤 Sent to {chat_id}: {resp.status} — {resp_text[:200]}")
+                messages_total.inc(result="sent" if resp.status == 200 else f"http_{resp.status}")
                 return resp.status == 200
         except Exception as e:
             logging.exception(f"⚠️ Error sending to {chat_id}: {e}")
+            messages_total.inc(result="error")
             return False
+        finally:
+            message_send_seconds.observe(time.perf_counter() - started)
 
 
 def split_long_message(text: str, limit: int = 4000) -> list[str]:
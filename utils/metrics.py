@@ -0,0 +1,206 @@
+"""
+Метрики в формате Prometheus (text exposition 0.0.4) без сторонних библиотек.
+
+Счётчики, датчики и гистограммы с метками объявляются в модулях, которые они описывают, и попадают в общий
+реестр процесса. Значения можно не только записывать, но и читать при каждом снятии метрик из уже
+существующих словарей stats (кэши, single-flight, очередь webhook) и функций (состояние автомата).
+GET /metrics на METRICS_PORT отдаёт все метрики процесса.
+"""
+import os
+import time
+import asyncio
+import logging
+import functools
+import threading
+from contextlib import contextmanager
+from typing import Callable, Iterable
+
+from aiohttp import web
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+# Порт /metrics; 0 — не поднимать сервер
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800)
+
+REGISTRY: dict[str, "_Metric"] = {}
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        if name in REGISTRY:
+            raise ValueError(f"Метрика {name} уже объявлена")
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple, float] = {}
+        self._tracked: list[tuple[tuple, Callable[[], float]]] = []
+        # Часть кода пишет метрики из пула потоков (asyncio.to_thread)
+        self._lock = threading.Lock()
+        REGISTRY[name] = self
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: ожидались метки {self.labelnames}, получены {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def track(self, func: Callable[[], float], **labels):
+        """Значение с этими метками вычисляется func() при каждом снятии метрик"""
+        self._tracked.append((self._key(labels), func))
+
+    def track_stats(self, stats: dict, key_label: str = "event", **labels):
+        """Каждый ключ словаря stats — отдельный ряд с меткой key_label; значения читаются при снятии"""
+        for key in stats:
+            self.track(functools.partial(stats.get, key, 0), **{key_label: key}, **labels)
+
+    def _samples(self) -> list[tuple[str, tuple, float]]:
+        with self._lock:
+            samples = [("", key, value) for key, value in self._values.items()]
+        for key, func in self._tracked:
+            try:
+                samples.append(("", key, float(func())))
+            except Exception as e:
+                logger.error(f"Не удалось вычислить метрику {self.name}: {e}")
+        return samples
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, key, value in self._samples():
+            labelnames = self.labelnames + (("le",) if len(key) > len(self.labelnames) else ())
+            lines.append(f"{self.name}{suffix}{_format_labels(labelnames, key)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # метки -> [счётчики по корзинам (не накопленные), сумма, количество]
+        self._series: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = next(i for i, bound in enumerate(self.buckets) if value <= bound)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self) -> list[tuple[str, tuple, float]]:
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in self._series.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    samples.append(("_bucket", key + (_format_value(bound),), cumulative))
+                samples.append(("_sum", key, total))
+                samples.append(("_count", key, count))
+        return samples
+
+
+def timed(histogram: Histogram, **labels):
+    """Декоратор: время выполнения функции (обычной или async) в histogram с метками labels"""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with histogram.time(**labels):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with histogram.time(**labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in REGISTRY.values()) + "\n"
+
+
+async def _metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8",
+                        headers={"X-Prometheus-Format": "0.0.4"})
+
+
+async def start_metrics_server(port: int = METRICS_PORT, host: str = METRICS_HOST) -> web.AppRunner | None:
+    """Поднимает GET /metrics; возвращает runner для остановки или None, если сервер отключён"""
+    if not port:
+        return None
+    app = web.Application()
+    app.router.add_get("/metrics", _metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError as e:
+        logger.error(f"Не удалось поднять /metrics на {host}:{port}: {e}")
+        await runner.cleanup()
+        return None
+    logger.info(f"Метрики: http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,144 @@
+import time
+import logging
+from typing import Any, Awaitable, Callable
+
+from maxapi.enums.update import UpdateType
+from maxapi.filters.middleware import BaseMiddleware
+
+from db.snapshot_store import pinned_snapshot
+from utils.latency import update_latency
+from utils.metrics import Counter, Histogram
+from utils.ratelimit import RATE_LIMIT_EXPENSIVE, ChatRateLimiter, ExpensiveGate, throttled_total
+
+logger = logging.getLogger(__name__)
+
+updates_total = Counter("bot_updates_total", "Обработанные обновления Max", ["update_type", "command"])
+update_errors_total = Counter("bot_update_errors_total", "Обновления, обработка которых завершилась ошибкой",
+                              ["update_type", "command"])
+update_seconds = Histogram("bot_update_seconds", "Время обработки обновления (middleware и обработчик)",
+                           ["update_type", "command"])
+update_lag_seconds = Histogram("bot_update_lag_seconds", "Задержка от события в Max до начала обработки")
+
+
+def command_label(event_object: Any) -> str:
+    """Команда (/today) или первые части payload кнопки (today_schedule) — без id, чтобы рядов было немного"""
+    callback = getattr(event_object, "callback", None)
+    if callback is not None:
+        return "_".join((callback.payload or "").split("_")[:2]) or "callback"
+    message = getattr(event_object, "message", None)
+    text = (message.body.text or "") if message is not None and message.body else ""
+    if text.startswith("/"):
+        return text.split(maxsplit=1)[0].split("@")[0]
+    return "text" if text else "-"
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Счётчики, ошибки и время обработки обновлений по типу и команде"""
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, dict[str, Any]], Awaitable[Any]],
+        event_object: Any,
+        data: dict[str, Any]
+    ) -> Any:
+        update_type = getattr(event_object, "update_type", "-")
+        labels = {"update_type": getattr(update_type, "value", update_type), "command": command_label(event_object)}
+        updates_total.inc(**labels)
+        try:
+            with update_seconds.time(**labels):
+                return await handler(event_object, data)
+        except Exception:
+            update_errors_total.inc(**labels)
+            raise
+
+
+class LatencyMiddleware(BaseMiddleware):
+    """
+    Замеряет задержку от события в Max (timestamp обновления, мс) до начала его обработки.
+    Одинаково работает для polling и webhook, поэтому режимы сравнимы по одному окну.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, dict[str, Any]], Awaitable[Any]],
+        event_object: Any,
+        data: dict[str, Any]
+    ) -> Any:
+        timestamp = getattr(event_object, "timestamp", None)
+        if timestamp:
+            lag = time.time() - timestamp / 1000
+            update_latency.observe(lag)
+            update_lag_seconds.observe(max(lag, 0.0))
+        return await handler(event_object, data)
+
+
+class RateLimitMiddleware(BaseMiddleware):
+    """
+    Ограничивает частоту сообщений и нажатий кнопок в каждом чате (ведро токенов) и общее число
+    одновременно обрабатываемых тяжёлых команд. Отклонённое обновление не доходит до обработчика,
+    а чат получает вежливую просьбу подождать (сообщением — не чаще раза в RATE_LIMIT_NOTICE_INTERVAL).
+    """
+
+    LIMITED = (UpdateType.MESSAGE_CREATED, UpdateType.MESSAGE_CALLBACK)
+
+    def __init__(self, limiter: ChatRateLimiter | None = None, gate: ExpensiveGate | None = None,
+                 expensive: frozenset[str] = RATE_LIMIT_EXPENSIVE):
+        self.limiter = limiter or ChatRateLimiter()
+        self.gate = gate or ExpensiveGate()
+        self.expensive = expensive
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, dict[str, Any]], Awaitable[Any]],
+        event_object: Any,
+        data: dict[str, Any]
+    ) -> Any:
+        if getattr(event_object, "update_type", None) not in self.LIMITED:
+            return await handler(event_object, data)
+
+        chat_id = event_object.get_ids()[0]
+        command = command_label(event_object)
+        wait = self.limiter.take(chat_id)
+        if wait:
+            throttled_total.inc(reason="chat_rate", command=command)
+            await self._notify(event_object, chat_id,
+                               f"⏳ Слишком много запросов. Пожалуйста, подождите {max(round(wait), 1)} с.")
+            return None
+
+        if command not in self.expensive:
+            return await handler(event_object, data)
+
+        if not await self.gate.acquire():
+            throttled_total.inc(reason="busy", command=command)
+            await self._notify(event_object, chat_id, "⏳ Бот сейчас сильно загружен. Попробуйте через минуту.")
+            return None
+        try:
+            return await handler(event_object, data)
+        finally:
+            self.gate.release()
+
+    async def _notify(self, event_object: Any, chat_id: int, text: str):
+        try:
+            # На нажатие кнопки Max ждёт ответа в любом случае, иначе она «крутится»
+            if event_object.update_type == UpdateType.MESSAGE_CALLBACK:
+                await event_object.answer(notification=text)
+            elif self.limiter.should_notice(chat_id):
+                await event_object.message.answer(text)
+        except Exception as e:
+            logger.error(f"Не удалось предупредить чат {chat_id} об ограничении: {e}")
+
+
+class SnapshotMiddleware(BaseMiddleware):
+    """
+    Закрепляет поколение снапшота SQLite за обработкой события:
+    все чтения расписания в рамках одного ответа идут в один и тот же файл.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, dict[str, Any]], Awaitable[Any]],
+        event_object: Any,
+        data: dict[str, Any]
+    ) -> Any:
+        with pinned_snapshot():
+            return await handler(event_object, data)
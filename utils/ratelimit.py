@@ -0,0 +1,116 @@
+"""
+Ограничение частоты команд по чатам и общего числа тяжёлых запросов.
+
+Каждый чат получает ведро токенов: RATE_LIMIT_RATE токенов в секунду, не больше RATE_LIMIT_BURST подряд.
+Тяжёлые команды (поиск по названию, отрисовка расписания) дополнительно проходят общий лимит
+RATE_LIMIT_MAX_EXPENSIVE одновременных обработок на процесс: если слот не освободился за
+RATE_LIMIT_QUEUE_TIMEOUT секунд, команда отклоняется, чтобы один чат не занимал всех.
+"""
+import os
+import time
+import asyncio
+
+from dotenv import load_dotenv
+
+from utils.metrics import Counter, Gauge
+
+load_dotenv()
+
+RATE_LIMIT_RATE = float(os.getenv("RATE_LIMIT_RATE", "1"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "5"))
+RATE_LIMIT_MAX_EXPENSIVE = int(os.getenv("RATE_LIMIT_MAX_EXPENSIVE", "8"))
+RATE_LIMIT_QUEUE_TIMEOUT = float(os.getenv("RATE_LIMIT_QUEUE_TIMEOUT", "2"))
+# Не чаще раза в столько секунд отвечать чату «слишком часто»: сам ответ — тоже запрос к Max
+RATE_LIMIT_NOTICE_INTERVAL = float(os.getenv("RATE_LIMIT_NOTICE_INTERVAL", "10"))
+# Команды и кнопки (command_label), которые читают и отрисовывают расписание
+RATE_LIMIT_EXPENSIVE = frozenset(
+    c.strip() for c in os.getenv(
+        "RATE_LIMIT_EXPENSIVE",
+        "/today,/tomorrow,/week,/find,/subscribe,/unsubscribe,/schedules,text,"
+        "today_schedule,tomorrow_schedule,week_schedule"
+    ).split(",") if c.strip()
+)
+
+throttled_total = Counter("bot_throttled_total", "Обновления, отклонённые ограничением частоты",
+                          ["reason", "command"])
+expensive_in_flight = Gauge("bot_expensive_in_flight", "Тяжёлые команды в обработке")
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float | None = None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """0, если запрос разрешён, иначе — сколько секунд подождать"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class ChatRateLimiter:
+    """Вёдра токенов по chat_id; полные (давно молчащие) вёдра периодически удаляются"""
+
+    def __init__(self, rate: float = RATE_LIMIT_RATE, burst: float = RATE_LIMIT_BURST,
+                 notice_interval: float = RATE_LIMIT_NOTICE_INTERVAL, max_chats: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.notice_interval = notice_interval
+        self.max_chats = max_chats
+        self._buckets: dict[int, TokenBucket] = {}
+        self._noticed: dict[int, float] = {}
+
+    def take(self, chat_id: int) -> float:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) >= self.max_chats:
+                self._prune()
+            bucket = self._buckets[chat_id] = TokenBucket(self.rate, self.burst)
+        return bucket.take()
+
+    def should_notice(self, chat_id: int) -> bool:
+        """Отвечать ли чату о превышении: не чаще раза в notice_interval"""
+        now = time.monotonic()
+        if now - self._noticed.get(chat_id, -self.notice_interval) < self.notice_interval:
+            return False
+        self._noticed[chat_id] = now
+        return True
+
+    def _prune(self):
+        now = time.monotonic()
+        full_after = self.burst / self.rate
+        self._buckets = {
+            chat_id: bucket for chat_id, bucket in self._buckets.items() if now - bucket.updated < full_after
+        }
+        self._noticed = {
+            chat_id: at for chat_id, at in self._noticed.items() if now - at < self.notice_interval
+        }
+
+
+class ExpensiveGate:
+    """Общий лимит одновременных тяжёлых обработок с ограниченным ожиданием слота"""
+
+    def __init__(self, limit: int = RATE_LIMIT_MAX_EXPENSIVE, timeout: float = RATE_LIMIT_QUEUE_TIMEOUT):
+        self.limit = limit
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(limit)
+        self.in_flight = 0
+        expensive_in_flight.track(lambda: self.in_flight)
+
+    async def acquire(self) -> bool:
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+        self._semaphore.release()
@@ -0,0 +1,198 @@
+import os
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Callable
+
+import aiohttp
+from dotenv import load_dotenv
+
+from utils.metrics import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+UPSTREAM_MIN_CONCURRENCY = int(os.getenv("UPSTREAM_MIN_CONCURRENCY", "2"))
+UPSTREAM_MAX_CONCURRENCY = int(os.getenv("UPSTREAM_MAX_CONCURRENCY", "32"))
+# Ответ медленнее этого считается признаком перегрузки сервиса
+UPSTREAM_TARGET_LATENCY = float(os.getenv("UPSTREAM_TARGET_LATENCY", "2"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "10"))
+BREAKER_RECOVERY_TIMEOUT = float(os.getenv("BREAKER_RECOVERY_TIMEOUT", "60"))
+
+breaker_open = Gauge("bot_circuit_breaker_open", "1, если автомат разомкнут или ждёт пробного вызова", ["name"])
+breaker_rejected_total = Counter("bot_circuit_breaker_rejected_total", "Вызовы, отклонённые автоматом", ["name"])
+upstream_limit = Gauge("bot_upstream_concurrency_limit", "Текущий адаптивный лимит параллельных вызовов", ["name"])
+upstream_in_flight = Gauge("bot_upstream_in_flight", "Выполняющиеся вызовы внешнего сервиса", ["name"])
+
+
+class CircuitOpenError(Exception):
+    """Вызов отклонён: автомат разомкнут после серии ошибок сервиса"""
+
+
+def is_http_failure(error: BaseException) -> bool:
+    """Сетевая ошибка, таймаут или ответ 5xx/429 — признак проблем сервиса, а не запроса"""
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status >= 500 or error.status == 429
+    return isinstance(error, (asyncio.TimeoutError, aiohttp.ClientError))
+
+
+class CircuitBreaker:
+    """
+    Автомат: после failure_threshold ошибок подряд размыкается и сразу отклоняет вызовы.
+    Через recovery_timeout пропускает один пробный вызов (half-open): успех замыкает автомат, ошибка — снова размыкает.
+    """
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 recovery_timeout: float = BREAKER_RECOVERY_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        breaker_open.track(lambda: self.state != self.CLOSED, name=name)
+        breaker_rejected_total.track(lambda: self.rejected, name=name)
+
+    def before_call(self):
+        if self.state == self.CLOSED:
+            return
+        if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+            self._transition(self.HALF_OPEN)
+        if self.state == self.HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return
+
+        self.rejected += 1
+        raise CircuitOpenError(f"{self.name}: сервис недоступен, повтор через "
+                               f"{max(self.recovery_timeout - (time.monotonic() - self._opened_at), 0):.0f} с")
+
+    def record_success(self):
+        self.failures = 0
+        # Успех вызова, начатого до размыкания, не замыкает автомат — это делает только пробный вызов
+        if self.state == self.HALF_OPEN:
+            self._probe_in_flight = False
+            self._transition(self.CLOSED)
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+            self._probe_in_flight = False
+            self._opened_at = time.monotonic()
+            self._transition(self.OPEN)
+
+    def _transition(self, state: str):
+        logger.warning(f"🔌 {self.name}: автомат {self.state} -> {state} (ошибок подряд: {self.failures}, "
+                       f"отклонено вызовов: {self.rejected})")
+        self.state = state
+
+    @asynccontextmanager
+    async def guard(self, is_failure: Callable[[BaseException], bool] = is_http_failure):
+        self.before_call()
+        try:
+            yield
+        except BaseException as e:
+            if is_failure(e):
+                self.record_failure()
+            else:
+                # Ответ пришёл, просто с ошибкой на уровне запроса — сервис жив
+                self.record_success()
+            raise
+        else:
+            self.record_success()
+
+
+class AdaptiveLimiter:
+    """
+    Ограничение числа одновременных вызовов по AIMD:
+    лимит растёт на 1 за каждые limit быстрых успешных вызовов и уменьшается вдвое
+    при ошибке или ответе медленнее target_latency (не чаще раза за target_latency).
+    """
+
+    def __init__(self, name: str, initial: int | None = None, min_limit: int = UPSTREAM_MIN_CONCURRENCY,
+                 max_limit: int = UPSTREAM_MAX_CONCURRENCY, target_latency: float = UPSTREAM_TARGET_LATENCY):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self.limit = float(initial if initial is not None else max_limit)
+        self.in_flight = 0
+        self._condition = asyncio.Condition()
+        self._last_decrease = 0.0
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release_unused(self):
+        """Освобождает слот без подстройки лимита: вызов так и не был сделан"""
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    async def release(self, latency: float, overloaded: bool):
+        async with self._condition:
+            self.in_flight -= 1
+            previous = int(self.limit)
+            now = time.monotonic()
+            if overloaded or latency > self.target_latency:
+                if now - self._last_decrease >= self.target_latency:
+                    self._last_decrease = now
+                    self.limit = max(self.min_limit, self.limit / 2)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+            if int(self.limit) != previous:
+                log = logger.warning if int(self.limit) < previous else logger.info
+                log(f"🚦 {self.name}: лимит параллельности {previous} -> {int(self.limit)} "
+                    f"(задержка {latency:.2f} с{', ошибка' if overloaded else ''})")
+            self._condition.notify_all()
+
+
+class Upstream:
+    """Внешний сервис: автомат и адаптивный лимит параллельности вокруг каждого вызова"""
+
+    def __init__(self, name: str, is_failure: Callable[[BaseException], bool]):
+        self.name = name
+        self.is_failure = is_failure
+        self.breaker = CircuitBreaker(name)
+        self.limiter = AdaptiveLimiter(name)
+        upstream_limit.track(lambda: int(self.limiter.limit), name=name)
+        upstream_in_flight.track(lambda: self.limiter.in_flight, name=name)
+
+    @asynccontextmanager
+    async def call(self):
+        # Автомат проверяется после ожидания в очереди: пока вызов ждал слот, автомат мог разомкнуться
+        await self.limiter.acquire()
+        try:
+            self.breaker.before_call()
+        except CircuitOpenError:
+            await self.limiter.release_unused()
+            raise
+
+        started = time.monotonic()
+        failed = False
+        try:
+            yield
+        except asyncio.CancelledError:
+            # Отмена по внешнему таймауту (asyncio.wait_for) — сервис не ответил вовремя
+            failed = True
+            raise
+        except BaseException as e:
+            failed = self.is_failure(e)
+            raise
+        finally:
+            await self.limiter.release(time.monotonic() - started, failed)
+            if failed:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+
+    def describe(self) -> str:
+        return (f"{self.name}: автомат {self.breaker.state}, лимит {int(self.limiter.limit)}, "
+                f"в работе {self.limiter.in_flight}, отклонено {self.breaker.rejected}")
@@ -0,0 +1,263 @@
+"""
+Бот из нескольких процессов-обработчиков (BOT_SHARDS > 1).
+
+Основной процесс только принимает обновления (long polling или webhook) и раскладывает их по процессам
+по chat_id % BOT_SHARDS: все обновления чата попадают в один и тот же процесс и в одну очередь,
+поэтому порядок обработки внутри чата сохраняется. Процесс-обработчик разбирает свою очередь так же,
+как режим webhook (utils/webhook.py): WEBHOOK_WORKERS задач и блокировка на чат. Состояния диалогов
+при этом нужно хранить в общей базе (FSM_STORAGE=postgres), иначе они теряются при смене числа процессов.
+"""
+import os
+import time
+import queue
+import asyncio
+import logging
+import functools
+import multiprocessing
+from asyncio.exceptions import TimeoutError as AsyncioTimeoutError
+from typing import Callable
+
+from aiohttp import ClientConnectorError, web
+from dotenv import load_dotenv
+from pydantic import ValidationError
+from maxapi import Bot, Dispatcher
+from maxapi.types.errors import Error
+
+from utils.fsm import FSM_STORAGE
+from utils.metrics import Counter
+from utils.webhook import (BOT_MODE, WEBHOOK_HOST, WEBHOOK_PATH, WEBHOOK_PORT, WEBHOOK_QUEUE_SIZE, WEBHOOK_SECRET,
+                           WebhookIngest, parse_update, prepare_dispatcher, read_update, register_webhook)
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Число процессов-обработчиков; 1 — всё в одном процессе, как раньше
+BOT_SHARDS = int(os.getenv("BOT_SHARDS", "1"))
+# Очередь обновлений между основным процессом и каждым обработчиком
+SHARD_QUEUE_SIZE = int(os.getenv("SHARD_QUEUE_SIZE", str(WEBHOOK_QUEUE_SIZE)))
+# Сколько раз за время работы перезапускать упавшие процессы-обработчики; дальше основной процесс завершается
+SHARD_MAX_RESTARTS = int(os.getenv("SHARD_MAX_RESTARTS", "5"))
+
+shard_updates_total = Counter("bot_shard_updates_total", "Обновления, переданные процессам-обработчикам", ["shard"])
+shard_overflow_total = Counter("bot_shard_overflow_total", "Обновления webhook, отклонённые из-за полной очереди процесса")
+shard_restarts_total = Counter("bot_shard_restarts_total", "Перезапуски упавших процессов-обработчиков")
+
+POLLING_RETRY_DELAY = 5
+CONNECTION_RETRY_DELAY = 30
+# Как часто проверять, живы ли процессы-обработчики (и сколько ждать места в очереди между проверками)
+LIVENESS_CHECK_INTERVAL = 5
+
+
+def update_chat_id(event: dict) -> int:
+    """chat_id из сырого обновления: у событий сообщений он в message.recipient, у остальных — на верхнем уровне"""
+    chat_id = event.get("chat_id")
+    if chat_id is None:
+        chat_id = ((event.get("message") or {}).get("recipient") or {}).get("chat_id")
+    if chat_id is None:
+        chat_id = (event.get("user") or (event.get("callback") or {}).get("user") or {}).get("user_id")
+    return chat_id or 0
+
+
+class ShardRouter:
+    """
+    Процессы-обработчики и их очереди; worker(index, queue) запускается в отдельном процессе (spawn).
+    Упавший процесс перезапускается с новой очередью (не больше max_restarts раз за время работы):
+    обновления, оставшиеся в старой очереди, теряются. Сверх лимита — RuntimeError.
+    """
+
+    def __init__(self, shards: int, worker: Callable, queue_size: int = SHARD_QUEUE_SIZE,
+                 max_restarts: int = SHARD_MAX_RESTARTS):
+        self.shards = shards
+        self.worker = worker
+        self.queue_size = queue_size
+        self.max_restarts = max_restarts
+        self.queues: list = [None] * shards
+        self.processes: list = [None] * shards
+        self.stats = {"forwarded": [0] * shards, "overflow": 0, "restarts": 0}
+        self._ctx = multiprocessing.get_context("spawn")
+        for shard in range(shards):
+            shard_updates_total.track(functools.partial(self.stats["forwarded"].__getitem__, shard), shard=shard)
+        shard_overflow_total.track(lambda: self.stats["overflow"])
+        shard_restarts_total.track(lambda: self.stats["restarts"])
+
+    def start(self):
+        for shard in range(self.shards):
+            self._spawn(shard)
+        logger.info(f"Запущено процессов-обработчиков: {self.shards}")
+
+    def _spawn(self, shard: int):
+        # Очередь всегда новая: процесс, убитый посреди get(), мог оставить блокировку старой очереди занятой
+        self.queues[shard] = self._ctx.Queue(self.queue_size)
+        self.processes[shard] = self._ctx.Process(target=self.worker, args=(shard, self.queues[shard]),
+                                                  name=f"bot-shard-{shard}", daemon=True)
+        self.processes[shard].start()
+
+    def ensure_alive(self, shard: int):
+        """Перезапускает процесс shard, если он завершился"""
+        process = self.processes[shard]
+        if process.is_alive():
+            return
+        if self.stats["restarts"] >= self.max_restarts:
+            raise RuntimeError(f"Процесс-обработчик {shard} завершился (код {process.exitcode}), "
+                               f"лимит перезапусков {self.max_restarts} исчерпан")
+        logger.error(f"Процесс-обработчик {shard} завершился (код {process.exitcode}), перезапускаю; "
+                     f"обновления из его очереди потеряны")
+        # Иначе поток подачи старой очереди держит выход основного процесса, пока не отдаст данные
+        self.queues[shard].cancel_join_thread()
+        self.stats["restarts"] += 1
+        self._spawn(shard)
+
+    async def watch(self, interval: float = LIVENESS_CHECK_INTERVAL):
+        """Периодически перезапускает упавшие процессы, в том числе те, которым сейчас нечего раздавать"""
+        while True:
+            await asyncio.sleep(interval)
+            for shard in range(self.shards):
+                self.ensure_alive(shard)
+
+    def stop(self, timeout: float = 10):
+        """Сигнал остановки всем процессам и ожидание не дольше timeout; не успевшие завершиться — terminate"""
+        deadline = time.monotonic() + timeout
+        for q, process in zip(self.queues, self.processes):
+            if not process.is_alive():
+                continue
+            try:
+                # Полная очередь процесса не должна подвешивать остановку
+                q.put(None, timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Full:
+                logger.warning(f"Очередь процесса {process.name} заполнена, сигнал остановки не отправлен")
+        for q, process in zip(self.queues, self.processes):
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.terminate()
+                process.join()
+            q.cancel_join_thread()
+
+    def shard_of(self, event: dict) -> int:
+        return update_chat_id(event) % self.shards
+
+    def try_forward(self, event: dict) -> bool:
+        """Без ожидания: False, если очередь процесса заполнена"""
+        shard = self.shard_of(event)
+        self.ensure_alive(shard)
+        try:
+            self.queues[shard].put_nowait(event)
+        except queue.Full:
+            self.stats["overflow"] += 1
+            return False
+        self.stats["forwarded"][shard] += 1
+        return True
+
+    async def forward(self, event: dict):
+        """С ожиданием места в очереди: при polling так же сдерживает чтение новых обновлений"""
+        shard = self.shard_of(event)
+        while True:
+            # Ожидание по частям: упавший процесс не разберёт очередь, и без проверки polling встал бы навсегда
+            self.ensure_alive(shard)
+            try:
+                await asyncio.to_thread(self.queues[shard].put, event, True, LIVENESS_CHECK_INTERVAL)
+                break
+            except queue.Full:
+                continue
+        self.stats["forwarded"][shard] += 1
+
+    def describe(self) -> str:
+        return (f"по процессам: {self.stats['forwarded']}, переполнений: {self.stats['overflow']}, "
+                f"перезапусков: {self.stats['restarts']}")
+
+
+async def serve_shard(dp: Dispatcher, bot: Bot, shard_queue):
+    """Процесс-обработчик: разбирает свою очередь до сигнала остановки (None)"""
+    await prepare_dispatcher(dp, bot)
+    ingest = WebhookIngest(dp, bot)
+    ingest.start_workers()
+    try:
+        while True:
+            event = await asyncio.to_thread(shard_queue.get)
+            if event is None:
+                break
+            try:
+                event_object = parse_update(event)
+            except (TypeError, ValidationError) as e:
+                logger.warning(f"Пропущено некорректное обновление: {e}")
+                continue
+            # put() ждёт места: заполненная локальная очередь сдерживает межпроцессную
+            await ingest.queue.put((event_object, time.monotonic()))
+        await ingest.queue.join()
+    finally:
+        logger.info(f"Обработчик остановлен: {ingest.describe()}")
+        await ingest.stop_workers()
+        await bot.close_session()
+
+
+async def _poll(bot: Bot, router: ShardRouter):
+    """Long polling без разбора обновлений: сырые события сразу уходят в процессы"""
+    while True:
+        try:
+            events = await bot.get_updates(marker=bot.marker_updates)
+        except AsyncioTimeoutError:
+            continue
+        except ClientConnectorError:
+            logger.error(f"Ошибка подключения, жду {CONNECTION_RETRY_DELAY} секунд")
+            await asyncio.sleep(CONNECTION_RETRY_DELAY)
+            continue
+
+        if isinstance(events, Error):
+            logger.info(f"Ошибка при получении обновлений: {events}, жду {POLLING_RETRY_DELAY} секунд")
+            await asyncio.sleep(POLLING_RETRY_DELAY)
+            continue
+
+        bot.marker_updates = events.get("marker")
+        for event in events.get("updates", []):
+            await router.forward(event)
+
+
+async def _serve_webhook(bot: Bot, router: ShardRouter, host: str, port: int):
+    stats = {"ignored": 0, "invalid": 0, "unauthorized": 0}
+
+    async def receive(request: web.Request) -> web.Response:
+        event = await read_update(request, WEBHOOK_SECRET, stats)
+        if isinstance(event, web.Response):
+            return event
+        if not router.try_forward(event):
+            return web.json_response({"ok": False}, status=503, headers={"Retry-After": "1"})
+        return web.json_response({"ok": True})
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, receive)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    await register_webhook(bot)
+    logger.info(f"Приём webhook на {host}:{port}{WEBHOOK_PATH} для {router.shards} процессов")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+async def run_sharded(bot: Bot, worker: Callable, shards: int = BOT_SHARDS,
+                      host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT):
+    """Основной процесс: запускает обработчики и раздаёт им обновления из polling или webhook до отмены"""
+    if FSM_STORAGE != "postgres":
+        logger.warning("BOT_SHARDS > 1 без FSM_STORAGE=postgres: состояния диалогов живут только в своём процессе")
+
+    router = ShardRouter(shards, worker)
+    router.start()
+    if BOT_MODE == "webhook":
+        serving = asyncio.create_task(_serve_webhook(bot, router, host, port))
+    else:
+        serving = asyncio.create_task(_poll(bot, router))
+    watchdog = asyncio.create_task(router.watch())
+    try:
+        # Исчерпан лимит перезапусков — ошибка выходит наружу, и процесс бота завершается с ненулевым кодом
+        done, _ = await asyncio.wait({serving, watchdog}, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()
+    finally:
+        serving.cancel()
+        watchdog.cancel()
+        await asyncio.gather(serving, watchdog, return_exceptions=True)
+        logger.info(f"Раздача обновлений остановлена: {router.describe()}")
+        await asyncio.to_thread(router.stop)
+        await bot.close_session()
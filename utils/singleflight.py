@@ -0,0 +1,55 @@
+import asyncio
+import functools
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+from utils.metrics import Counter
+
+T = TypeVar("T")
+
+singleflight_calls_total = Counter("bot_singleflight_calls_total", "Выполненные и объединённые вызовы",
+                                   ["name", "event"])
+
+
+class SingleFlight:
+    """
+    Объединение одинаковых одновременных вызовов: пока вызов с ключом выполняется,
+    остальные вызовы с тем же ключом ждут его результат (или исключение), а не выполняют работу заново.
+    Работа идёт в отдельной задаче: отмена любого из ожидающих, в том числе первого, не отменяет её
+    для остальных. Задача отменяется, только когда её результат не ждёт никто.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        # ключ -> [задача, сколько вызовов её ждут]
+        self._inflight: dict[Hashable, list] = {}
+        self.stats = {"executed": 0, "coalesced": 0}
+        singleflight_calls_total.track_stats(self.stats, name=name)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._inflight
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        flight = self._inflight.get(key)
+        if flight is None:
+            task = asyncio.ensure_future(func())
+            flight = self._inflight[key] = [task, 0]
+            task.add_done_callback(functools.partial(self._finished, key, flight))
+            self.stats["executed"] += 1
+        else:
+            self.stats["coalesced"] += 1
+
+        task = flight[0]
+        flight[1] += 1
+        try:
+            # shield: отмена ожидающего не должна отменять общий вызов
+            return await asyncio.shield(task)
+        finally:
+            flight[1] -= 1
+            if not flight[1] and not task.done():
+                # Результат больше никому не нужен; новые вызовы начнут работу заново, а не получат отмену
+                self._finished(key, flight)
+                task.cancel()
+
+    def _finished(self, key: Hashable, flight: list, *_):
+        if self._inflight.get(key) is flight:
+            del self._inflight[key]
@@ -0,0 +1,182 @@
+"""
+Приём обновлений Max через webhook вместо long polling.
+
+HTTP-сервер aiohttp проверяет секрет и формат обновления, кладёт его в ограниченную очередь и сразу отвечает 200.
+Очередь разбирают WEBHOOK_WORKERS обработчиков диспетчера. Обновления одного чата обрабатываются строго
+по порядку поступления (блокировка на чат), разные чаты — параллельно. Если очередь заполнена,
+сервер отвечает 503, и Max повторит доставку позже.
+"""
+import os
+import hmac
+import json
+import time
+import asyncio
+import logging
+
+from aiohttp import web
+from dotenv import load_dotenv
+from pydantic import ValidationError
+from maxapi import Bot, Dispatcher
+from maxapi.methods.types.getted_updates import UPDATE_MODEL_MAPPING
+from maxapi.utils.updates import enrich_event
+
+from utils.latency import LatencyWindow
+from utils.metrics import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# polling | webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Публичный адрес, который регистрируется в Max при старте; пусто — подписка настроена вручную
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# Секрет из заголовка X-Max-Bot-Api-Secret (5-256 символов); пусто — без проверки
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "8"))
+
+SECRET_HEADER = "X-Max-Bot-Api-Secret"
+
+webhook_updates_total = Counter("bot_webhook_updates_total", "Обновления, принятые и отклонённые приёмом webhook",
+                                ["event"])
+webhook_queue_size = Gauge("bot_webhook_queue_size", "Обновлений в очереди обработчиков")
+
+
+async def read_update(request: web.Request, secret: str, stats: dict) -> dict | web.Response:
+    """
+    Проверяет секрет и разбирает тело запроса. Возвращает обновление (dict) или готовый ответ:
+    403 — неверный секрет, 400 — не JSON, 200 — неизвестный тип (повторять доставку незачем).
+    """
+    if secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), secret):
+        stats["unauthorized"] += 1
+        return web.json_response({"ok": False}, status=403)
+
+    try:
+        event = json.loads(await request.read())
+    except ValueError:
+        stats["invalid"] += 1
+        return web.json_response({"ok": False}, status=400)
+
+    if not isinstance(event, dict) or event.get("update_type") not in UPDATE_MODEL_MAPPING:
+        stats["ignored"] += 1
+        return web.json_response({"ok": True})
+    return event
+
+
+def parse_update(event: dict):
+    """Модель обновления maxapi без обращений к API (их делает enrich_event в обработчике)"""
+    return UPDATE_MODEL_MAPPING[event["update_type"]](**event)
+
+
+async def prepare_dispatcher(dp: Dispatcher, bot: Bot):
+    """Подготовка роутеров и on_started: у maxapi она доступна только через start_polling/handle_webhook"""
+    await dp._Dispatcher__ready(bot)
+
+
+class WebhookIngest:
+    def __init__(self, dp: Dispatcher, bot: Bot, workers: int = WEBHOOK_WORKERS,
+                 queue_size: int = WEBHOOK_QUEUE_SIZE, secret: str = WEBHOOK_SECRET, path: str = WEBHOOK_PATH):
+        self.dp = dp
+        self.bot = bot
+        self.workers = workers
+        self.secret = secret
+        self.path = path
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        # chat_id -> [блокировка, сколько обработчиков её держат или ждут]
+        self._chats: dict[int | None, list] = {}
+        self._tasks: list[asyncio.Task] = []
+        self.queue_latency = LatencyWindow("webhook queue")
+        self.stats = {"accepted": 0, "ignored": 0, "invalid": 0, "unauthorized": 0, "overflow": 0, "handled": 0}
+        webhook_updates_total.track_stats(self.stats)
+        webhook_queue_size.track(self.queue.qsize)
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.receive)
+        return app
+
+    async def receive(self, request: web.Request) -> web.Response:
+        event = await read_update(request, self.secret, self.stats)
+        if isinstance(event, web.Response):
+            return event
+
+        try:
+            event_object = parse_update(event)
+        except (TypeError, ValidationError) as e:
+            self.stats["invalid"] += 1
+            logger.warning(f"Отклонено некорректное обновление webhook: {e}")
+            return web.json_response({"ok": False}, status=400)
+
+        try:
+            self.queue.put_nowait((event_object, time.monotonic()))
+        except asyncio.QueueFull:
+            self.stats["overflow"] += 1
+            return web.json_response({"ok": False}, status=503, headers={"Retry-After": "1"})
+
+        self.stats["accepted"] += 1
+        return web.json_response({"ok": True})
+
+    async def _worker(self):
+        while True:
+            event_object, received = await self.queue.get()
+            try:
+                self.queue_latency.observe(time.monotonic() - received)
+                chat_id = event_object.get_ids()[0]
+                # Между get() и захватом блокировки нет await: порядок чата сохраняется
+                entry = self._chats.setdefault(chat_id, [asyncio.Lock(), 0])
+                entry[1] += 1
+                try:
+                    async with entry[0]:
+                        await self.dp.handle(await enrich_event(event_object, self.bot))
+                finally:
+                    entry[1] -= 1
+                    if not entry[1]:
+                        del self._chats[chat_id]
+                self.stats["handled"] += 1
+            except Exception as e:
+                logger.exception(f"Ошибка обработки обновления из webhook: {e}")
+            finally:
+                self.queue.task_done()
+
+    def start_workers(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop_workers(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def describe(self) -> str:
+        return (f"очередь {self.queue.qsize()}/{self.queue.maxsize}, "
+                + ", ".join(f"{k}: {v}" for k, v in self.stats.items()))
+
+
+async def register_webhook(bot: Bot):
+    if WEBHOOK_URL:
+        await bot.subscribe_webhook(WEBHOOK_URL, secret=WEBHOOK_SECRET or None)
+        logger.info(f"Webhook зарегистрирован: {WEBHOOK_URL}")
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT):
+    """Готовит диспетчер, регистрирует webhook в Max (если задан WEBHOOK_URL) и принимает обновления до отмены"""
+    ingest = WebhookIngest(dp, bot)
+    await prepare_dispatcher(dp, bot)
+    await register_webhook(bot)
+
+    runner = web.AppRunner(ingest.build_app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    ingest.start_workers()
+    logger.info(f"Приём webhook на {host}:{port}{ingest.path}, обработчиков: {ingest.workers}")
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        logger.info(f"Webhook остановлен: {ingest.describe()}")
+        await runner.cleanup()
+        await ingest.stop_workers()